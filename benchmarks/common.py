@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from main import Peer
+from utils import LoopbackNetwork, SocketTransport, process_memory
+
+logger = logging.getLogger("LCP")
+
+TRANSPORTS = ("loopback", "socket")
+
+
+class LocalSocketTransport(SocketTransport):
+    """SocketTransport en una dirección privada de 127.0.0.0/8.
+
+    La interfaz de loopback no admite broadcast, así que los broadcasts se
+    envían por unicast a cada dirección de addresses (compartida por todos los
+    peers del clúster).
+    """
+
+    def __init__(self, host, addresses):
+        super().__init__(host)
+        self._addresses = addresses
+
+    def broadcast_addresses(self):
+        return list(self._addresses)
+
+
+class PeerCluster:
+    """Grupo de peers en un mismo proceso para los benchmarks.
+
+    Con transport='loopback' los peers se comunican por una LoopbackNetwork en
+    memoria; con 'socket' cada uno escucha con sockets reales en su propia
+    dirección 127.0.0.N (solo Linux enruta todo 127.0.0.0/8). Los historiales
+    y descargas se guardan en un directorio temporal que close() elimina.
+    """
+
+    def __init__(self, count, transport="loopback", prefix="peer", **peer_options):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Transporte desconocido: {transport}")
+        self.transport = transport
+        self.workdir = tempfile.mkdtemp(prefix="lcp-bench-")
+        self.network = LoopbackNetwork() if transport == "loopback" else None
+        self.names = []
+        self.peers = []
+        self._addresses = []
+        self._cwd = os.getcwd()
+        # El historial se guarda en el directorio actual
+        os.chdir(self.workdir)
+        try:
+            for i in range(count):
+                self.add_peer(f"{prefix}{i}", **peer_options)
+        except BaseException:
+            self.close()
+            raise
+
+    def add_peer(self, name, **peer_options):
+        if self.network is not None:
+            transport = self.network.transport()
+        else:
+            host = f"127.0.{len(self.peers) // 250}.{len(self.peers) % 250 + 1}"
+            self._addresses.append(host)
+            transport = LocalSocketTransport(host, self._addresses)
+        peer = Peer(
+            name,
+            download_dir=os.path.join(self.workdir, name),
+            transport=transport,
+            **peer_options,
+        )
+        self.peers.append(peer)
+        self.names.append(name)
+        return peer
+
+    def wait_for_discovery(self, pairs=None, timeout=60.0):
+        """Espera a que cada peer conozca a los indicados
+
+        Args:
+            pairs: Pares (origen, destino) de índices; por defecto todos
+            timeout: Segundos máximos de espera
+
+        Returns:
+            float: Segundos hasta que todos los pares se conocían
+
+        Raises:
+            TimeoutError: Si algún par no se descubre a tiempo
+        """
+        if pairs is None:
+            pairs = [
+                (i, j)
+                for i in range(len(self.peers))
+                for j in range(len(self.peers))
+                if i != j
+            ]
+        started = time.monotonic()
+        pending = set(pairs)
+        while pending:
+            pending = {
+                (i, j)
+                for i, j in pending
+                if self.names[j] not in self.peers[i].get_peers()
+            }
+            if not pending:
+                break
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(
+                    f"{len(pending)} pares sin descubrir tras {timeout:.0f} s"
+                )
+            time.sleep(0.05)
+        return time.monotonic() - started
+
+    def close(self):
+        for peer in self.peers:
+            try:
+                peer.close()
+            except Exception as e:
+                logger.warning(f"Error cerrando {peer.user_id_str.strip()}: {e}")
+        self.peers = []
+        os.chdir(self._cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def summarize(samples, scale=1000.0):
+    """Media, percentiles y máximo de samples multiplicados por scale
+
+    Con el scale por defecto convierte segundos a milisegundos.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) * scale,
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": ordered[-1] * scale,
+    }
+
+
+def environment():
+    """Datos del entorno para poder comparar resultados entre ejecuciones"""
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "revision": revision,
+    }
+
+
+def peak_rss():
+    """Pico de memoria residente del proceso en bytes (None si no se conoce)
+
+    Es el máximo desde que arrancó el proceso, así que solo crece de un
+    escenario al siguiente.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def parse_size(text):
+    """Convierte '512', '64K', '16M' o '2G' en bytes"""
+    text = text.strip().upper()
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def add_common_arguments(parser):
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORTS,
+        default="loopback",
+        help="Red en memoria o sockets reales en 127.0.0.0/8",
+    )
+    parser.add_argument(
+        "--output", help="Archivo donde escribir el JSON (por defecto, stdout)"
+    )
+    parser.add_argument(
+        "--log-level",
+        default="ERROR",
+        help="Nivel de log de los peers durante la medida",
+    )
+
+
+def configure_logging(level):
+    logging.getLogger().setLevel(level.upper())
+    logging.getLogger("LCP").setLevel(level.upper())
+
+
+def write_report(benchmark, config, results, output=None):
+    """Escribe el informe JSON de un benchmark en output o en stdout"""
+    report = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+        "rss": process_memory(),
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    return report
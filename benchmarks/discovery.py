@@ -0,0 +1,456 @@
+"""Simulador de descubrimiento con cientos de peers virtuales.
+
+Unos pocos peers reales (la clase Peer completa, con _discovery_service,
+send_echo y _cleanup_inactive_peers sin cambios) comparten una
+LoopbackNetwork con cientos de peers virtuales. Cada peer virtual es un
+manejador de datagramas sin hilo propio que habla el protocolo de
+descubrimiento: responde a los ECHO y anuncia su presencia con un ECHO
+broadcast cada --echo-interval segundos, como el servicio de
+autodescubrimiento.
+
+Los peers virtuales entran de golpe (burst), repartidos en --ramp segundos
+(ramp) o de golpe y con rotación continua (churn). En --leave-at sale además
+una fracción de ellos para medir cuánto tardan los peers reales en
+olvidarlos. En --late-join-at se arrancan peers reales nuevos para medir en
+cuánto tiempo descubren a todos.
+
+El informe incluye:
+
+- datagramas por segundo y CPU del proceso (serie por segundo y resumen)
+- tiempo de convergencia de las entradas
+- expiraciones falsas (peers vivos que un peer real da por perdidos)
+- latencia de expiración de los que salen
+- contención de _peers_lock en los peers reales
+
+La expiración tarda 90 s y la limpieza corre cada ~15 s, así que las
+ejecuciones deben durar varios minutos para medirla.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.discovery --virtual 500 --pattern churn --output d.json
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from protocol import BROADCAST_ID, RESPONSE_OK
+
+from .common import (
+    PeerCluster,
+    add_common_arguments,
+    configure_logging,
+    peak_rss,
+    summarize,
+    write_report,
+)
+
+PATTERNS = ("burst", "ramp", "churn")
+
+
+def _normalize(user_id):
+    return user_id.strip().rstrip("\x00")
+
+
+class VirtualPeer:
+    """Peer ligero que solo participa en el descubrimiento"""
+
+    def __init__(self, network, name):
+        self.name = name
+        self.user_id = name.encode("utf-8").ljust(20)[:20]
+        self.transport = network.transport()
+        self.joined = None
+        self.left = None
+        self.echoes_answered = 0
+        self.replies_received = 0
+        self._socket = None
+
+    @property
+    def alive(self):
+        return self.joined is not None and self.left is None
+
+    def join(self):
+        self._socket = self.transport.udp_handler(self._handle)
+        self.joined = time.monotonic()
+        self.send_echo()
+
+    def leave(self):
+        self.left = time.monotonic()
+        self._socket.close()
+
+    def send_echo(self):
+        header = bytearray(100)
+        header[0:20] = self.user_id
+        header[20:40] = BROADCAST_ID
+        header[40] = 0
+        for address in self.transport.broadcast_addresses():
+            try:
+                self._socket.sendto(header, (address, self.transport.udp_port))
+            except OSError:
+                return
+
+    def _handle(self, sock, data, source):
+        if len(data) == 25:
+            self.replies_received += 1
+            return
+        if len(data) != 100 or data[40] != 0 or data[0:20] == self.user_id:
+            return
+        user_to = bytes(data[20:40])
+        if user_to != BROADCAST_ID and user_to.rstrip(b"\x00") != self.user_id:
+            return
+        response = bytearray(25)
+        response[0] = RESPONSE_OK
+        response[1:21] = self.user_id
+        self.echoes_answered += 1
+        sock.sendto(response, source)
+
+
+class EchoScheduler:
+    """Hilo que lanza el ECHO periódico de cada peer virtual"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._heap = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="VirtualEchoes"
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, peer):
+        # Fase aleatoria, como peers que arrancaron en momentos distintos
+        due = time.monotonic() + random.uniform(0, self.interval)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._sequence), peer))
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stop:
+                    return
+                due, _, peer = heapq.heappop(self._heap)
+                if peer.alive:
+                    heapq.heappush(
+                        self._heap, (due + self.interval, next(self._sequence), peer)
+                    )
+            if peer.alive:
+                peer.send_echo()
+
+
+class DiscoveryObserver:
+    """Registra las altas y bajas de peers que notifica cada peer real"""
+
+    def __init__(self):
+        self.first_seen = {}
+        self.removals = []
+        self.readded = 0
+        self._lock = threading.Lock()
+
+    def attach(self, peer, name):
+        peer.register_peer_discovery_callback(
+            lambda user_id, added: self._record(name, _normalize(user_id), added),
+            maxsize=100000,
+            overflow="block",
+        )
+
+    def _record(self, observer, user_id, added):
+        now = time.monotonic()
+        with self._lock:
+            key = (observer, user_id)
+            if not added:
+                self.removals.append((observer, user_id, now))
+            elif key in self.first_seen:
+                self.readded += 1
+            else:
+                self.first_seen[key] = now
+
+
+class Sampler:
+    """Muestrea cada segundo el tráfico, la CPU y lo que conoce cada peer real"""
+
+    def __init__(self, network, cluster, virtual):
+        self.network = network
+        self.cluster = cluster
+        self.virtual = virtual
+        self.timeline = []
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Sampler")
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        last_time = time.monotonic()
+        last_cpu = time.process_time()
+        last_datagrams = self.network.stats()["datagrams"]
+        while not self._stop.wait(1.0):
+            now = time.monotonic()
+            cpu = time.process_time()
+            datagrams = self.network.stats()["datagrams"]
+            elapsed = now - last_time
+            alive = {peer.name for peer in list(self.virtual) if peer.alive}
+            known = [
+                len(alive.intersection(peer.get_peers()))
+                for peer in list(self.cluster.peers)
+            ]
+            self.timeline.append(
+                {
+                    "t": now - self._started,
+                    "datagrams_per_second": (datagrams - last_datagrams) / elapsed,
+                    "cpu": (cpu - last_cpu) / elapsed,
+                    "alive_virtual": len(alive),
+                    "min_known": min(known) if known else 0,
+                }
+            )
+            last_time, last_cpu, last_datagrams = now, cpu, datagrams
+
+
+def late_join_convergence(peer, virtual, started, timeout):
+    """Segundos hasta que peer conoce a todos los peers virtuales vivos"""
+    deadline = started + timeout
+    while time.monotonic() < deadline:
+        alive = {v.name for v in list(virtual) if v.alive}
+        if alive.issubset(peer.get_peers()):
+            return time.monotonic() - started
+        time.sleep(0.1)
+    return None
+
+
+def analyze(observer, reals, virtual, late_names):
+    """Convergencia de las entradas, expiraciones falsas y latencia de expiración"""
+    by_name = {peer.name: peer for peer in virtual}
+    with observer._lock:
+        first_seen = dict(observer.first_seen)
+        removals = list(observer.removals)
+        readded = observer.readded
+
+    join_times = []
+    unconverged = 0
+    for peer in virtual:
+        seen = [first_seen.get((real, peer.name)) for real in reals]
+        if None in seen:
+            unconverged += peer.alive
+            continue
+        join_times.append(max(seen) - peer.joined)
+
+    false_expiries = 0
+    expiry_latency = []
+    for observer_name, user_id, when in removals:
+        peer = by_name.get(user_id)
+        if peer is None or observer_name in late_names:
+            continue
+        if peer.left is None or when < peer.left:
+            false_expiries += 1
+        else:
+            expiry_latency.append(when - peer.left)
+
+    left = [peer for peer in virtual if peer.left is not None]
+    # Cada par (peer real, peer virtual) es una oportunidad de expirar en falso
+    observations = len(reals) * len(virtual)
+    return {
+        "join_convergence_ms": summarize(join_times),
+        "unconverged_joins": unconverged,
+        "false_expiries": false_expiries,
+        "false_expiry_rate": false_expiries / observations if observations else 0.0,
+        "readded": readded,
+        "left": len(left),
+        "expired": len(expiry_latency),
+        "expiry_latency_s": summarize(expiry_latency, scale=1.0),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--virtual", type=int, default=500, help="Peers virtuales")
+    parser.add_argument("--real", type=int, default=3, help="Peers reales")
+    parser.add_argument("--pattern", choices=PATTERNS, default="ramp")
+    parser.add_argument(
+        "--ramp", type=float, default=30.0, help="Segundos de entrada en 'ramp'"
+    )
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=0.01,
+        help="Fracción de peers virtuales que se sustituye cada segundo en 'churn'",
+    )
+    parser.add_argument(
+        "--leave-at",
+        type=float,
+        default=30.0,
+        help="Segundo en el que sale de golpe --leave-fraction de los virtuales",
+    )
+    parser.add_argument("--leave-fraction", type=float, default=0.1)
+    parser.add_argument(
+        "--late-join-at",
+        type=float,
+        default=60.0,
+        help="Segundo en el que se arrancan los peers reales tardíos",
+    )
+    parser.add_argument("--late-joiners", type=int, default=1)
+    parser.add_argument(
+        "--echo-interval",
+        type=float,
+        default=15.0,
+        help="Segundos entre ECHO de cada peer virtual (el servicio real tarda "
+        "unos 15: 5 de espera de respuestas y 10 de pausa)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=240.0, help="Segundos de simulación"
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.transport != "loopback":
+        parser.error("El simulador solo funciona con --transport loopback")
+    output = os.path.abspath(args.output) if args.output else None
+    configure_logging(args.log_level)
+
+    virtual = []
+    names = (f"v{i:05d}" for i in itertools.count())
+    late_names = []
+    late_convergence = []
+    cluster = PeerCluster(args.real, "loopback", prefix="real", instrument_locks=True)
+    with cluster:
+        network = cluster.network
+        observer = DiscoveryObserver()
+        for peer, name in zip(cluster.peers, cluster.names):
+            observer.attach(peer, name)
+        scheduler = EchoScheduler(args.echo_interval)
+        sampler = Sampler(network, cluster, virtual)
+
+        def join(count):
+            for _ in range(count):
+                peer = VirtualPeer(network, next(names))
+                virtual.append(peer)
+                peer.join()
+                scheduler.add(peer)
+
+        def measure_late_join(peer, join_started, timeout):
+            late_convergence.append(
+                late_join_convergence(peer, virtual, join_started, timeout)
+            )
+
+        def leave(count):
+            alive = [peer for peer in virtual if peer.alive]
+            for peer in random.sample(alive, min(count, len(alive))):
+                peer.leave()
+
+        scheduler.start()
+        sampler.start()
+        cpu_started = time.process_time()
+        started = time.monotonic()
+        churn_credit = 0.0
+        left_once = False
+        late_started = False
+        late_threads = []
+        if args.pattern != "ramp":
+            join(args.virtual)
+
+        while True:
+            elapsed = time.monotonic() - started
+            if elapsed >= args.duration:
+                break
+            if args.pattern == "ramp":
+                target = min(args.virtual, int(args.virtual * elapsed / args.ramp) + 1)
+                join(target - len(virtual))
+            elif args.pattern == "churn":
+                churn_credit += args.virtual * args.churn * 0.1
+                if churn_credit >= 1:
+                    replaced = int(churn_credit)
+                    churn_credit -= replaced
+                    leave(replaced)
+                    join(replaced)
+            if not left_once and elapsed >= args.leave_at:
+                left_once = True
+                leave(int(args.virtual * args.leave_fraction))
+            if not late_started and elapsed >= args.late_join_at:
+                late_started = True
+                for _ in range(args.late_joiners):
+                    name = f"late{len(late_names)}"
+                    late_names.append(name)
+                    peer = cluster.add_peer(name, instrument_locks=True)
+                    thread = threading.Thread(
+                        target=measure_late_join,
+                        args=(peer, time.monotonic(), args.duration - elapsed),
+                        daemon=True,
+                    )
+                    thread.start()
+                    late_threads.append(thread)
+            time.sleep(0.1)
+
+        wall = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+        sampler.stop()
+        scheduler.stop()
+        for thread in late_threads:
+            thread.join(timeout=1)
+
+        results = analyze(observer, cluster.names[: args.real], virtual, late_names)
+        timeline = sampler.timeline
+        results.update(
+            {
+                "virtual_peers": len(virtual),
+                "alive_at_end": sum(peer.alive for peer in virtual),
+                "datagrams": network.stats()["datagrams"],
+                "datagrams_per_second": summarize(
+                    [sample["datagrams_per_second"] for sample in timeline],
+                    scale=1.0,
+                ),
+                "cpu_utilization": cpu / wall if wall else 0.0,
+                "cpu_per_second": summarize(
+                    [sample["cpu"] for sample in timeline], scale=1.0
+                ),
+                "peak_rss": peak_rss(),
+                "late_join_convergence_s": late_convergence,
+                "peers_lock": {
+                    name: peer.get_lock_contention(top_sites=3).get("peers")
+                    for name, peer in zip(cluster.names, cluster.peers)
+                },
+                "timeline": timeline,
+            }
+        )
+
+    config = {
+        "virtual": args.virtual,
+        "real": args.real,
+        "pattern": args.pattern,
+        "ramp": args.ramp,
+        "churn": args.churn,
+        "leave_at": args.leave_at,
+        "leave_fraction": args.leave_fraction,
+        "late_join_at": args.late_join_at,
+        "late_joiners": args.late_joiners,
+        "echo_interval": args.echo_interval,
+        "duration": args.duration,
+    }
+    write_report("discovery", config, [results], output)
+
+
+if __name__ == "__main__":
+    main()
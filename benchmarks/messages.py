@@ -0,0 +1,297 @@
+"""Benchmark de mensajería: mensajes por segundo y latencia del handshake.
+
+Arranca varios peers en un mismo proceso y mide send_message uno a uno,
+varios emisores hacia un mismo receptor y broadcast_message, para cada tamaño
+de mensaje. El resultado es un JSON con una entrada por escenario y tamaño.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.messages --peers 8 --messages 500 --output base.json
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from .common import (
+    PeerCluster,
+    add_common_arguments,
+    configure_logging,
+    summarize,
+    write_report,
+)
+
+SCENARIOS = ("one_to_one", "many_to_one", "broadcast")
+
+
+class DeliveryRecorder:
+    """Anota cuándo recibe cada peer cada mensaje del benchmark"""
+
+    def __init__(self):
+        self._arrivals = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def attach(self, peer, name):
+        peer.register_message_callback(
+            lambda user_from, message: self._record(name, message),
+            maxsize=100000,
+            overflow="block",
+        )
+
+    def _record(self, name, message):
+        now = time.perf_counter()
+        tag = message.split("|", 1)[0]
+        with self._lock:
+            self._arrivals.setdefault(tag, {}).setdefault(name, now)
+            self._changed.notify_all()
+
+    def wait(self, tags, receivers, timeout):
+        """Espera a que todos los receivers tengan todos los tags"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                missing = sum(
+                    1
+                    for tag in tags
+                    for name in receivers
+                    if name not in self._arrivals.get(tag, ())
+                )
+                remaining = deadline - time.monotonic()
+                if not missing or remaining <= 0:
+                    return missing
+                self._changed.wait(remaining)
+
+    def arrivals(self, tag):
+        with self._lock:
+            return dict(self._arrivals.get(tag, {}))
+
+
+def make_message(tag, size):
+    text = f"{tag}|"
+    return text + "x" * max(0, size - len(text))
+
+
+def run_unicast(cluster, recorder, scenario, senders, receiver, count, size, timeout):
+    """Cada emisor envía count mensajes seguidos al receptor, todos a la vez"""
+    latencies = [[] for _ in senders]
+    failures = [0] * len(senders)
+    tags = [[] for _ in senders]
+    barrier = threading.Barrier(len(senders) + 1)
+    receiver_name = cluster.names[receiver]
+
+    def send(slot, index):
+        peer = cluster.peers[index]
+        barrier.wait()
+        for seq in range(count):
+            tag = f"{scenario}-{size}-{index}-{seq}"
+            message = make_message(tag, size)
+            started = time.perf_counter()
+            ok = peer.send_message(receiver_name, message)
+            elapsed = time.perf_counter() - started
+            if ok:
+                latencies[slot].append(elapsed)
+                tags[slot].append(tag)
+            else:
+                failures[slot] += 1
+
+    threads = [
+        threading.Thread(target=send, args=(slot, index), name=f"Bench-{index}")
+        for slot, index in enumerate(senders)
+    ]
+    for thread in threads:
+        thread.start()
+    cpu_started = time.process_time()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    sent_tags = [tag for slot_tags in tags for tag in slot_tags]
+    missing = recorder.wait(sent_tags, [receiver_name], timeout)
+    samples = [latency for slot in latencies for latency in slot]
+    return {
+        "scenario": scenario,
+        "size": size,
+        "senders": len(senders),
+        "attempted": count * len(senders),
+        "acknowledged": len(samples),
+        "failed": sum(failures),
+        "delivered": len(sent_tags) - missing,
+        "seconds": elapsed,
+        "cpu_seconds": cpu,
+        "messages_per_second": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize(samples),
+    }
+
+
+def run_broadcast(cluster, recorder, sender, count, size, timeout, interval):
+    """El emisor hace count broadcasts; la latencia es hasta cada entrega
+
+    El body_id de los mensajes sale del milisegundo actual, así que dos
+    broadcasts en el mismo milisegundo se confunden en el receptor: se envían
+    separados por interval segundos.
+    """
+    peer = cluster.peers[sender]
+    receivers = [name for i, name in enumerate(cluster.names) if i != sender]
+    sent = {}
+    failures = 0
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for seq in range(count):
+        tag = f"broadcast-{size}-{sender}-{seq}"
+        sent_at = time.perf_counter()
+        if peer.broadcast_message(make_message(tag, size), max_retries=0):
+            sent[tag] = sent_at
+        else:
+            failures += 1
+        time.sleep(interval)
+    send_elapsed = time.perf_counter() - started
+    missing = recorder.wait(list(sent), receivers, timeout)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    samples = []
+    last_arrival = started
+    for tag, sent_at in sent.items():
+        for name, arrived in recorder.arrivals(tag).items():
+            if name in receivers:
+                samples.append(arrived - sent_at)
+                last_arrival = max(last_arrival, arrived)
+    expected = len(sent) * len(receivers)
+    delivery_time = last_arrival - started
+    return {
+        "scenario": "broadcast",
+        "size": size,
+        "receivers": len(receivers),
+        "attempted": count,
+        "sent": len(sent),
+        "failed": failures,
+        "delivered": expected - missing,
+        "delivery_ratio": (expected - missing) / expected if expected else 0.0,
+        "seconds": elapsed,
+        "send_seconds": send_elapsed,
+        "cpu_seconds": cpu,
+        "messages_per_second": len(sent) / send_elapsed if send_elapsed else 0.0,
+        "deliveries_per_second": (
+            len(samples) / delivery_time if delivery_time > 0 else 0.0
+        ),
+        "latency_ms": summarize(samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--peers", type=int, default=8, help="Peers en el clúster")
+    parser.add_argument(
+        "--senders",
+        type=int,
+        default=4,
+        help="Emisores simultáneos en many_to_one",
+    )
+    parser.add_argument(
+        "--messages", type=int, default=200, help="Mensajes por emisor y escenario"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="16,256,1000",
+        help="Tamaños de mensaje en bytes, separados por comas (el listener UDP "
+        "lee hasta 1024 bytes por datagrama)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Escenarios a ejecutar: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Segundos máximos de espera por las entregas de cada escenario",
+    )
+    parser.add_argument(
+        "--broadcast-interval",
+        type=float,
+        default=0.005,
+        help="Segundos entre broadcasts consecutivos",
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    scenarios = [name.strip() for name in args.scenarios.split(",")]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Escenario desconocido: {name}")
+    if args.peers < 2:
+        parser.error("Se necesitan al menos 2 peers")
+    senders = min(args.senders, args.peers - 1)
+    output = os.path.abspath(args.output) if args.output else None
+    configure_logging(args.log_level)
+
+    results = []
+    with PeerCluster(args.peers, args.transport) as cluster:
+        recorder = DeliveryRecorder()
+        for peer, name in zip(cluster.peers, cluster.names):
+            recorder.attach(peer, name)
+        discovery = cluster.wait_for_discovery()
+
+        for size in sizes:
+            if "one_to_one" in scenarios:
+                results.append(
+                    run_unicast(
+                        cluster,
+                        recorder,
+                        "one_to_one",
+                        [1],
+                        0,
+                        args.messages,
+                        size,
+                        args.timeout,
+                    )
+                )
+            if "many_to_one" in scenarios:
+                results.append(
+                    run_unicast(
+                        cluster,
+                        recorder,
+                        "many_to_one",
+                        list(range(1, senders + 1)),
+                        0,
+                        args.messages,
+                        size,
+                        args.timeout,
+                    )
+                )
+            if "broadcast" in scenarios:
+                results.append(
+                    run_broadcast(
+                        cluster,
+                        recorder,
+                        0,
+                        args.messages,
+                        size,
+                        args.timeout,
+                        args.broadcast_interval,
+                    )
+                )
+
+    config = {
+        "peers": args.peers,
+        "senders": senders,
+        "messages": args.messages,
+        "sizes": sizes,
+        "scenarios": scenarios,
+        "broadcast_interval": args.broadcast_interval,
+        "transport": args.transport,
+        "discovery_seconds": discovery,
+    }
+    write_report("messages", config, results, output)
+
+
+if __name__ == "__main__":
+    main()
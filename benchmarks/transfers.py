@@ -0,0 +1,273 @@
+"""Benchmark de transferencia de archivos: MB/s, CPU por GB, RSS y TTFB.
+
+Genera archivos de los tamaños indicados y los envía con send_file entre
+peers del mismo proceso. Hay tres escenarios: una transferencia cada vez,
+varias simultáneas hacia un mismo peer y varias simultáneas hacia peers
+distintos. El resultado es un JSON con una entrada por escenario y tamaño.
+
+El tiempo hasta el primer byte (TTFB) va desde la llamada a send_file hasta
+que el emisor empieza a enviar datos. Incluye la espera en la cola, el árbol
+Merkle, el header y la conexión, y se obtiene de la traza del emisor.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.transfers --sizes 1K,1M,64M,2G --output base.json
+"""
+
+import argparse
+import os
+import shutil
+import threading
+import time
+
+from .common import (
+    PeerCluster,
+    add_common_arguments,
+    configure_logging,
+    parse_size,
+    peak_rss,
+    summarize,
+    write_report,
+)
+
+SCENARIOS = ("single", "concurrent_one", "concurrent_many")
+
+_BLOCK_SIZE = 1024 * 1024
+
+
+class CompletionTracker:
+    """Anota cuándo termina (bien o mal) cada envío según su ruta de origen"""
+
+    def __init__(self):
+        self._finished = {}
+        self._cond = threading.Condition()
+
+    def attach(self, peer):
+        peer.register_file_progress_callback(
+            self._record, maxsize=100000, overflow="block"
+        )
+
+    def _record(self, user_id, file_path, progress, status):
+        if status not in ("completado", "error"):
+            return
+        with self._cond:
+            self._finished.setdefault(
+                file_path, (time.perf_counter(), status == "completado")
+            )
+            self._cond.notify_all()
+
+    def wait(self, paths, timeout):
+        """Espera a que terminen los envíos de paths y los olvida
+
+        Returns:
+            dict: {ruta: (instante de fin, éxito)} de los que terminaron
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                finished = [path for path in paths if path in self._finished]
+                remaining = deadline - time.monotonic()
+                if len(finished) == len(paths) or remaining <= 0:
+                    return {path: self._finished.pop(path) for path in finished}
+                self._cond.wait(remaining)
+
+
+def generate_file(path, size):
+    """Crea un archivo de size bytes repitiendo un bloque aleatorio"""
+    block = os.urandom(min(size, _BLOCK_SIZE))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def first_data_times(peer, expected, timeout=2.0):
+    """Instante (perf_counter) en que cada envío empezó a mandar datos
+
+    El aviso de 'completado' se publica antes de que termine la operación
+    send_file de la traza, así que se espera a que aparezcan las de expected.
+
+    Returns:
+        dict: {ruta de origen: segundos}
+    """
+    deadline = time.monotonic() + timeout
+    paths = {}
+    data_starts = {}
+    while True:
+        for event in peer.export_trace(clear=True)["traceEvents"]:
+            if event.get("name") == "send_file":
+                paths[event["args"]["trace_id"]] = event["args"].get("path")
+            elif event.get("name") == "send_data":
+                data_starts.setdefault(event["args"]["trace_id"], event["ts"])
+        starts = {
+            paths[trace_id]: start / 1_000_000
+            for trace_id, start in data_starts.items()
+            if trace_id in paths
+        }
+        if all(path in starts for path in expected) or time.monotonic() > deadline:
+            return starts
+        time.sleep(0.01)
+
+
+def clear_downloads(cluster):
+    for name in cluster.names:
+        shutil.rmtree(os.path.join(cluster.workdir, name), ignore_errors=True)
+
+
+def run_batches(cluster, tracker, scenario, batches, source, size, timeout):
+    """Envía cada lote de (emisor, receptor) a la vez y espera a que termine
+
+    Returns:
+        dict: Resultado del escenario
+    """
+    submitted = {}
+    finished = {}
+    first_data = {}
+    links = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for batch in batches:
+        paths = []
+        for sender, receiver in batch:
+            # Una ruta distinta por envío para poder seguirlo; los enlaces
+            # duros evitan copiar el archivo
+            path = f"{source}.{scenario}.{len(links)}"
+            os.link(source, path)
+            links.append(path)
+            paths.append(path)
+            submitted[path] = time.perf_counter()
+            if not cluster.peers[sender].send_file(cluster.names[receiver], path):
+                finished[path] = (time.perf_counter(), False)
+        finished.update(tracker.wait([p for p in paths if p not in finished], timeout))
+        completed = [path for path in paths if finished.get(path, (0, False))[1]]
+        for sender in {sender for sender, _ in batch}:
+            first_data.update(first_data_times(cluster.peers[sender], completed))
+    cpu = time.process_time() - cpu_started
+    ended = max([when for when, _ in finished.values()] or [time.perf_counter()])
+    elapsed = ended - started
+
+    completed = [path for path, (_, ok) in finished.items() if ok]
+    moved = size * len(completed)
+    durations = [finished[path][0] - submitted[path] for path in completed]
+    ttfb = [
+        first_data[path] - submitted[path] for path in completed if path in first_data
+    ]
+    for path in links:
+        os.unlink(path)
+    clear_downloads(cluster)
+    return {
+        "scenario": scenario,
+        "size": size,
+        "transfers": len(links),
+        "completed": len(completed),
+        "failed": len([path for path, (_, ok) in finished.items() if not ok]),
+        "timed_out": len(links) - len(finished),
+        "seconds": elapsed,
+        "mb_per_second": moved / 1_000_000 / elapsed if elapsed > 0 else 0.0,
+        "transfer_mb_per_second": summarize(
+            [size / 1_000_000 / d for d in durations if d > 0], scale=1.0
+        ),
+        "cpu_seconds": cpu,
+        "cpu_seconds_per_gb": cpu / (moved / 1_000_000_000) if moved else None,
+        "peak_rss": peak_rss(),
+        "ttfb_ms": summarize(ttfb),
+        "transfer_ms": summarize(durations),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1K,1M,16M,256M",
+        help="Tamaños de archivo separados por comas (admite K, M y G)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Escenarios a ejecutar: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Transferencias consecutivas del escenario single",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Transferencias simultáneas de los escenarios concurrentes",
+    )
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        help="Límite de envíos simultáneos del emisor (por defecto el del peer)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="Segundos máximos de espera por cada lote de transferencias",
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(","))
+    scenarios = [name.strip() for name in args.scenarios.split(",")]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Escenario desconocido: {name}")
+    output = os.path.abspath(args.output) if args.output else None
+    configure_logging(args.log_level)
+
+    results = []
+    # Peer 0 envía; los demás reciben
+    receivers = list(range(1, args.concurrency + 1))
+    with PeerCluster(args.concurrency + 1, args.transport) as cluster:
+        sender = cluster.peers[0]
+        if args.max_concurrent:
+            sender.set_max_concurrent_transfers(args.max_concurrent)
+        tracker = CompletionTracker()
+        tracker.attach(sender)
+        sender.start_tracing()
+        discovery = cluster.wait_for_discovery([(0, i) for i in receivers])
+
+        # De menor a mayor tamaño, porque el pico de RSS es acumulativo
+        for size in sizes:
+            source = os.path.join(cluster.workdir, f"source-{size}.bin")
+            generate_file(source, size)
+            batches = {
+                "single": [[(0, 1)] for _ in range(args.repeat)],
+                "concurrent_one": [[(0, 1)] * args.concurrency],
+                "concurrent_many": [[(0, receiver) for receiver in receivers]],
+            }
+            for scenario in scenarios:
+                results.append(
+                    run_batches(
+                        cluster,
+                        tracker,
+                        scenario,
+                        batches[scenario],
+                        source,
+                        size,
+                        args.timeout,
+                    )
+                )
+            os.unlink(source)
+
+    config = {
+        "sizes": sizes,
+        "scenarios": scenarios,
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "max_concurrent": args.max_concurrent,
+        "transport": args.transport,
+        "discovery_seconds": discovery,
+    }
+    write_report("transfers", config, results, output)
+
+
+if __name__ == "__main__":
+    main()
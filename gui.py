@@ -5,7 +5,7 @@ import os
 import logging
 import concurrent.futures
 import queue
-from utils import get_optimal_thread_count
+from utils import configure_logging, get_optimal_thread_count
 from main import Peer
 
 ctk.set_appearance_mode("System")
@@ -67,7 +67,8 @@ class LCPChat(ctk.CTk):
         self.load_all_message_history()
 
         self.after(1000, self.update_ui)
-        self.after(100, self.process_ui_updates)
+        self._ui_interval = 100
+        self.after(self._ui_interval, self.process_ui_updates)
 
         self.append_to_chat("Sistema", f"Bienvenido {username}!")
         self.append_to_chat(
@@ -475,6 +476,14 @@ class LCPChat(ctk.CTk):
         )
         self.file_button.pack(side="left", padx=5, pady=5, fill="x", expand=True)
 
+        self.folder_button = ctk.CTkButton(
+            self.buttons_frame,
+            text="Enviar Carpeta",
+            command=self.send_folder,
+            font=("Arial", 12),
+        )
+        self.folder_button.pack(side="left", padx=5, pady=5, fill="x", expand=True)
+
         self.status_var = ctk.StringVar()
         self.status_var.set("Conectando...")
         self.status_bar = ctk.CTkLabel(
@@ -504,8 +513,7 @@ class LCPChat(ctk.CTk):
         all_peers = self.peer.get_peers()
         online_peers = [peer_id for peer_id in all_peers if peer_id.strip() != ""]
 
-        with self.peer._message_history_lock:
-            historical_peers = list(self.peer._message_history.keys())
+        historical_peers = self.peer.get_history_peers()
 
         all_contacts = set(online_peers)
         for hist_peer in historical_peers:
@@ -996,6 +1004,29 @@ class LCPChat(ctk.CTk):
         self.status_var.set(f"Preparando envío de archivo a {current_chat}...")
         self.thread_pool.submit(self._send_file_thread, current_chat, filepath)
 
+    def send_folder(self):
+        """Envía una carpeta completa al usuario seleccionado en una sola transferencia"""
+        if not self.current_chat:
+            self.append_to_chat(
+                "Sistema", "Por favor, selecciona un usuario para enviar archivos."
+            )
+            return
+
+        dirpath = filedialog.askdirectory(title="Selecciona una carpeta para enviar")
+        if not dirpath:
+            return
+
+        current_chat = self.current_chat
+        if current_chat not in self.peer.get_peers():
+            self.append_to_chat(
+                "Sistema",
+                f"Error: No se puede enviar carpeta a {current_chat}, peer no encontrado.",
+            )
+            return
+
+        self.status_var.set(f"Preparando envío de carpeta a {current_chat}...")
+        self.thread_pool.submit(self._send_file_thread, current_chat, dirpath)
+
     def _send_file_thread(self, user_to, filepath):
         """Ejecuta el envío de archivos en un hilo separado"""
         try:
@@ -1020,7 +1051,10 @@ class LCPChat(ctk.CTk):
                 lambda: self.append_to_chat("Tú", file_msg, clean_user_to)
             )
 
-            success = self.peer.send_file(user_to, filepath)
+            if os.path.isdir(filepath):
+                success = self.peer.send_directory(user_to, filepath)
+            else:
+                success = self.peer.send_file(user_to, filepath)
 
             if not success:
                 self.update_queue.put(
@@ -1175,8 +1209,7 @@ class LCPChat(ctk.CTk):
 
             self.peer.load_message_history()
 
-            with self.peer._message_history_lock:
-                past_contacts = list(self.peer._message_history.keys())
+            past_contacts = self.peer.get_history_peers()
 
             if not past_contacts:
                 logger.info("No se encontró historial de conversaciones previas")
@@ -1314,6 +1347,8 @@ class LCPChat(ctk.CTk):
 
     def process_ui_updates(self):
         """Procesa las actualizaciones de la interfaz de usuario desde la cola"""
+        # Si el bucle de Tk se bloquea, el watchdog deja de recibir este latido
+        self.peer.watchdog_tick("GUI", self._ui_interval / 1000, threshold=5.0)
         processed = 0
         while not self.update_queue.empty() and processed < 10:
             try:
@@ -1331,8 +1366,8 @@ class LCPChat(ctk.CTk):
                 logger.error(f"Error inesperado en cola de UI: {e}", exc_info=True)
 
         pending = self.update_queue.qsize()
-        next_interval = 50 if pending > 10 else (100 if pending > 0 else 500)
-        self.after(next_interval, self.process_ui_updates)
+        self._ui_interval = 50 if pending > 10 else (100 if pending > 0 else 500)
+        self.after(self._ui_interval, self.process_ui_updates)
 
     def process_all_pending_updates(self):
         """Procesa todas las actualizaciones pendientes en la cola hasta vaciarla"""
@@ -1361,6 +1396,31 @@ class LCPChat(ctk.CTk):
                 "Posible bucle en la cola de actualizaciones: se alcanzó el límite de iteraciones"
             )
 
+    def get_memory_usage(self):
+        """Uso de memoria del peer más el de la interfaz: líneas y caracteres de
+        los cuadros de chat, actualizaciones pendientes y barras de progreso"""
+        usage = self.peer.get_memory_usage()
+
+        textboxes = [self.chat_display] + [
+            info["chat"] for info in self.chat_history.values()
+        ]
+        lines = 0
+        chars = 0
+        for textbox in textboxes:
+            lines += int(textbox.index("end-1c").split(".")[0])
+            chars += len(textbox.get("1.0", "end-1c"))
+        usage["gui_textboxes"] = {
+            "entries": len(textboxes),
+            "lines": lines,
+            "bytes": chars,
+        }
+        usage["gui_update_queue"] = {"entries": self.update_queue.qsize()}
+        usage["gui_progress_bars"] = {"entries": len(self.file_progress_bars)}
+        usage["gui_sent_notifications"] = {
+            "entries": len(self.sent_file_notifications)
+        }
+        return usage
+
     def add_contact_to_ui(self, user_id):
         """Añade un contacto a la interfaz aunque no esté conectado actualmente"""
         clean_user_id = user_id.strip()
@@ -1414,5 +1474,7 @@ class LCPChat(ctk.CTk):
 
 
 if __name__ == "__main__":
+    # LCP_LOG_MODE=development mantiene el registro síncrono y detallado
+    configure_logging(os.environ.get("LCP_LOG_MODE", "production"))
     app = LCPChat()
     app.mainloop()
@@ -7,8 +7,58 @@ import queue
 import random
 import logging
 import os
-import json
-from utils import get_optimal_thread_count, get_network_info
+import shutil
+import contextlib
+from utils import (
+    get_optimal_thread_count,
+    ChunkVerifier,
+    build_file_tree,
+    chunk_count,
+    decode_leaves,
+    encode_leaves,
+    TransferRegistry,
+    BandwidthShaper,
+    TransferScheduler,
+    BackgroundFileWriter,
+    ConnectionPool,
+    ProgressMonitor,
+    EventBus,
+    HistoryJournal,
+    SQLiteHistoryStore,
+    SegmentHistoryStore,
+    HistoryCache,
+    HistoryRecord,
+    ArchivePatcher,
+    ArchiveReader,
+    build_archive_tree,
+    build_manifest,
+    collect_directory,
+    collect_files,
+    manifest_length,
+    parse_manifest,
+    MetricsRegistry,
+    MetricsServer,
+    Tracer,
+    SamplingProfiler,
+    InstrumentedLock,
+    contention_summary,
+    AllocationTracker,
+    container_usage,
+    process_memory,
+    Watchdog,
+    SocketTransport,
+)
+from utils.disk_writer import FSYNC_END, reserve_path
+from utils.event_bus import BLOCK
+from utils.history_journal import read_history, snapshot_records
+from utils.history_sync import (
+    accept_ordinal,
+    missing_for_remote,
+    recv_frame,
+    remote_to_entries,
+    send_frame,
+)
+from utils.transfers import ACTIVE, COMPLETED, EXPIRED, FAILED, VERIFYING
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,15 +66,57 @@ logging.basicConfig(
     datefmt="%H:%M:%S",
 )
 logger = logging.getLogger("LCP")
+# Subsistemas con registros por paquete: se pueden ajustar y muestrear por
+# separado (ver utils.log_config)
+udp_logger = logging.getLogger("LCP.udp")
+message_logger = logging.getLogger("LCP.messages")
+discovery_logger = logging.getLogger("LCP.discovery")
 
 
 class Peer:
-    def __init__(self, user_id):
+    def __init__(
+        self,
+        user_id,
+        download_dir=None,
+        fsync_policy=FSYNC_END,
+        history_backend="segments",
+        history_memory_budget=8 * 1024 * 1024,
+        history_idle_timeout=600,
+        instrument_locks=False,
+        watchdog_threshold=30.0,
+        transport=None,
+    ):
+        """
+        Args:
+            user_id: Nombre del usuario (se normaliza a 20 bytes)
+            download_dir: Directorio donde se guardan los archivos recibidos
+                (por defecto ./lcp_descargas)
+            fsync_policy: Política de fsync de los archivos recibidos: 'never',
+                'end', 'interval' o 'always'
+            history_backend: 'segments' (archivos binarios indexados por peer,
+                leídos bajo demanda), 'journal' (JSON + diario) o 'sqlite' (base
+                de datos con índices y búsqueda de texto completo)
+            history_memory_budget: Bytes estimados máximos del historial en
+                memoria; al superarlos se desalojan las conversaciones menos usadas
+            history_idle_timeout: Segundos sin uso tras los que una conversación
+                se desaloja de memoria
+            instrument_locks: Si es True los locks globales del peer registran
+                tiempos de espera y retención (ver get_lock_contention())
+            watchdog_threshold: Segundos que un worker, listener o el servicio de
+                descubrimiento puede estar ocupado sin avanzar antes de que el
+                watchdog lo dé por bloqueado
+            transport: Transporte con el que se crean los sockets y se contacta
+                con otros peers; por defecto SocketTransport() (sockets reales
+                en 0.0.0.0 y los puertos LCP). Con LoopbackNetwork.transport()
+                varios peers comparten un proceso sin usar la red
+        """
+        self.download_dir = download_dir or os.path.join(os.getcwd(), "lcp_descargas")
+        self.fsync_policy = fsync_policy
+        self._instrumented_locks = [] if instrument_locks else None
 
         self._expected_message_bodies = {}
-        self._expected_bodies_lock = threading.Lock()
+        self._expected_bodies_lock = self._new_lock("expected_bodies")
 
-        self._message_history = {}
         self._message_history_lock = threading.Lock()
         self._MAX_MESSAGE_HISTORY = 10
 
@@ -49,6 +141,59 @@ class Peer:
         logger.info(
             f"Inicializando peer LCP con ID: '{original_id}' (ID normalizado: '{self.user_id_str}')"
         )
+
+        self.history_backend = history_backend
+        history_file = self._history_file_path()
+        if history_backend == "segments":
+            self._history_store = SegmentHistoryStore(
+                f"{os.path.splitext(history_file)[0]}.segments"
+            )
+            if self._history_store.is_empty():
+                self._import_json_history(history_file)
+        elif history_backend == "sqlite":
+            self._history_store = SQLiteHistoryStore(
+                f"{os.path.splitext(history_file)[0]}.db"
+            )
+            if self._history_store.is_empty():
+                self._import_json_history(history_file)
+        elif history_backend == "journal":
+            self._history_store = HistoryJournal(
+                f"{history_file}.journal", history_file, self._history_snapshot
+            )
+        else:
+            raise ValueError(f"Backend de historial desconocido: {history_backend}")
+        # Las conversaciones no residentes se leen del almacén o, con el
+        # diario, de un archivo por peer en el directorio de desalojo
+        if history_backend == "journal":
+            history_location = {"spill_dir": f"{history_file}.spill"}
+        else:
+            history_location = {"loader": self._load_conversation}
+        self._message_history = HistoryCache(
+            self._MAX_MESSAGE_HISTORY,
+            memory_budget=history_memory_budget,
+            idle_timeout=history_idle_timeout,
+            **history_location,
+        )
+        # Los nuevos registros continúan la secuencia de los ya persistidos
+        self._history_seq = self._history_store.last_seq()
+        # Mayor ordinal conocido de cada autor por conversación, para deduplicar
+        # mensajes y sincronizar el historial con los peers al reconectar. Solo
+        # se guardan las de las conversaciones en uso: el resto se leen con
+        # _read_marks() al necesitarlas (_drop_cold_history_state())
+        self._history_marks = {}
+        # Ordinales vistos por debajo de cada marca (llegan desordenados)
+        self._ordinal_windows = {}
+        self._next_ordinals = {}
+        self._last_history_sync = {}
+        self._HISTORY_SYNC_INTERVAL = 30
+        if history_backend == "journal":
+            # El diario no se puede consultar por peer: sus marcas se leen
+            # todas al arrancar, junto a las guardadas al desalojar
+            self._history_marks = self._history_store.ordinal_marks()
+            for peer_id, marks in self._history_marks.items():
+                saved = self._read_marks(peer_id)
+                for author in ("self", "peer"):
+                    marks[author] = max(marks[author], saved[author])
         logger.debug(
             f"ID codificado en bytes ({len(self.user_id)} bytes): {self.user_id.hex()}"
         )
@@ -58,6 +203,13 @@ class Peer:
             self.file_workers_count,
             self.max_concurrent_transfers,
         ) = get_optimal_thread_count()
+        # Cada envío admitido por file_send_queue ocupa un FileSender: con menos
+        # workers que max_concurrent_transfers el límite sería inalcanzable
+        self.file_workers_count = max(
+            self.file_workers_count, self.max_concurrent_transfers
+        )
+        self._file_workers_started = 0
+        self._file_workers_lock = threading.Lock()
 
         logger.info(
             f"Configurando {self.message_workers_count} hilos para mensajes (operaciones de red UDP)"
@@ -70,23 +222,39 @@ class Peer:
         )
 
         self.peers = {}
-        self._peers_lock = threading.Lock()
+        self._peers_lock = self._new_lock("peers")
+
+        self._incoming_transfers = TransferRegistry("entrante")
+        self._outgoing_transfers = TransferRegistry("saliente")
+        self._bandwidth = BandwidthShaper()
+        self._transport = transport or SocketTransport()
+        self._closed = threading.Event()
+        self._connection_pool = ConnectionPool(
+            self._transport.tcp_port, connect=self._transport.connect
+        )
+        self._progress = ProgressMonitor(
+            [self._incoming_transfers, self._outgoing_transfers]
+        )
 
-        self._udp_socket_lock = threading.Lock()
+        self._udp_socket_lock = self._new_lock("udp_socket")
         self._tcp_socket_lock = threading.Lock()
-        self._callback_lock = threading.Lock()
+        self._events = EventBus()
         self._conversation_locks = {}
-        self._conversation_locks_lock = threading.Lock()
-
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.udp_socket.bind(("0.0.0.0", UDP_PORT))
-        logger.info(f"Socket UDP inicializado en 0.0.0.0:{UDP_PORT}")
+        self._conversation_locks_lock = self._new_lock("conversation_locks")
+        self._init_metrics()
+        self._watchdog = Watchdog(watchdog_threshold, metrics=self.metrics)
+        self._tracer = Tracer()
+        self._profiler = None
+        self._allocations = AllocationTracker()
+
+        host = self._transport.host
+        self.udp_socket = self._transport.udp_socket(
+            self._transport.udp_port, broadcast=True
+        )
+        logger.info(f"Socket UDP inicializado en {host}:{self._transport.udp_port}")
 
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tcp_socket.bind(("0.0.0.0", TCP_PORT))
-        self.tcp_socket.listen(self.max_concurrent_transfers)
-        logger.info(f"Socket TCP inicializado en 0.0.0.0:{TCP_PORT}")
+        self.tcp_socket = self._transport.tcp_listener(self.max_concurrent_transfers)
+        logger.info(f"Socket TCP inicializado en {host}:{self._transport.tcp_port}")
 
         udp_thread = threading.Thread(
             target=self._udp_listener, daemon=True, name="UDP-Listener"
@@ -106,18 +274,13 @@ class Peer:
         discovery_thread.start()
         logger.info("Servicio de autodescubrimiento iniciado")
 
-        self.message_callbacks = []
-        self.file_callbacks = []
-        self.peer_discovery_callbacks = []
-
-        self.file_progress_callbacks = []
+        self._progress.subscribe(self._publish_progress)
+        self._progress.start()
+        self._events.subscribe("peer", self._on_peer_discovered, name="HistorySync")
 
         self.message_queue = queue.Queue()
 
-        self.file_send_queue = queue.Queue()
-
-        self.active_file_transfers = 0
-        self._transfers_lock = threading.Lock()
+        self.file_send_queue = TransferScheduler(self.max_concurrent_transfers)
 
         for i in range(self.message_workers_count):
             worker_name = f"Worker-{i+1}"
@@ -126,27 +289,57 @@ class Peer:
             ).start()
         logger.info(f"Worker de mensajes {worker_name} iniciado")
 
-        for i in range(self.file_workers_count):
-            worker_name = f"FileSender-{i+1}"
-            threading.Thread(
-                target=self._file_send_worker, daemon=True, name=worker_name
-            ).start()
-        logger.info(f"Worker de envío de archivos {worker_name} iniciado")
-
-    def _build_header(self, user_to, operation, body_id=0, body_length=0):
-        """Construye el header"""
+        self._start_file_workers(self.file_workers_count)
+
+        self._watchdog.start()
+
+    def _start_file_workers(self, count):
+        """Arranca FileSenders hasta que haya count (nunca los reduce)"""
+        with self._file_workers_lock:
+            while self._file_workers_started < count:
+                self._file_workers_started += 1
+                worker_name = f"FileSender-{self._file_workers_started}"
+                threading.Thread(
+                    target=self._file_send_worker, daemon=True, name=worker_name
+                ).start()
+                logger.info("Worker de envío de archivos %s iniciado", worker_name)
+            self.file_workers_count = self._file_workers_started
+
+    def _build_header(
+        self,
+        user_to,
+        operation,
+        body_id=0,
+        body_length=0,
+        flags=0,
+        root_hash=None,
+        ordinal=None,
+    ):
+        """Construye el header
+
+        Los campos flags, root_hash y ordinal viajan en la zona Reserved del
+        header, por lo que un peer que no los conozca simplemente los ignora.
+        """
         header = bytearray(100)
         header[0:20] = self.user_id
         if user_to is None:
             header[20:40] = BROADCAST_ID
-            logger.debug(f"Configurando destino como BROADCAST en header")
+            udp_logger.debug("Configurando destino como BROADCAST en header")
         else:
             header[20:40] = user_to.encode("utf-8").ljust(20, b"\x00")
-            logger.debug(f"Configurando destino como {user_to} en header)")
+            udp_logger.debug("Configurando destino como %s en header", user_to)
 
         header[40] = operation
         header[41] = body_id
         header[42:50] = body_length.to_bytes(8, "big")
+        header[HEADER_FLAGS_OFFSET] = flags
+        if root_hash is not None:
+            header[ROOT_HASH_OFFSET : ROOT_HASH_OFFSET + ROOT_HASH_SIZE] = root_hash
+        if ordinal is not None:
+            header[HEADER_FLAGS_OFFSET] |= FLAG_ORDINAL
+            header[ORDINAL_OFFSET : ORDINAL_OFFSET + ORDINAL_SIZE] = ordinal.to_bytes(
+                ORDINAL_SIZE, "big"
+            )
 
         return header
 
@@ -164,21 +357,36 @@ class Peer:
             try:
                 user_to = user_to_bytes.decode("utf-8").rstrip("\x00")
             except UnicodeDecodeError:
-                logger.warning(f"Error decodificando campo user_to")
+                udp_logger.warning("Error decodificando campo user_to")
                 user_to = user_to_bytes.decode("utf-8", errors="replace")
 
         try:
             user_from = data[0:20].decode("utf-8").rstrip("\x00")
         except UnicodeDecodeError:
-            logger.warning(f"Error decodificando campo user_from")
+            udp_logger.warning("Error decodificando campo user_from")
             user_from = data[0:20].decode("utf-8", errors="replace")
 
+        flags = data[HEADER_FLAGS_OFFSET]
+        root_hash = None
+        if flags & FLAG_INTEGRITY:
+            root_hash = bytes(
+                data[ROOT_HASH_OFFSET : ROOT_HASH_OFFSET + ROOT_HASH_SIZE]
+            )
+        ordinal = None
+        if flags & FLAG_ORDINAL:
+            ordinal = int.from_bytes(
+                data[ORDINAL_OFFSET : ORDINAL_OFFSET + ORDINAL_SIZE], "big"
+            )
+
         return {
             "user_from": user_from,
             "user_to": user_to,
             "operation": data[40],
             "body_id": data[41],
             "body_length": int.from_bytes(data[42:50], "big"),
+            "flags": flags,
+            "root_hash": root_hash,
+            "ordinal": ordinal,
         }
 
     def _send_response(self, addr, status, reason=None):
@@ -197,23 +405,37 @@ class Peer:
             RESPONSE_OK: "OK",
             RESPONSE_BAD_REQUEST: "BAD REQUEST",
             RESPONSE_INTERNAL_ERROR: "INTERNAL ERROR",
+            RESPONSE_CHUNKS_CORRUPT: "CHUNKS CORRUPT",
         }.get(status, f"UNKNOWN STATUS ({status})")
 
         if reason and status != RESPONSE_OK:
-            logger.warning(
-                f"Enviando respuesta {status_text} a {addr[0]}:{addr[1]} - Razón: {reason}"
+            udp_logger.warning(
+                "Enviando respuesta %s a %s:%s - Razón: %s",
+                status_text,
+                addr[0],
+                addr[1],
+                reason,
             )
         else:
-            logger.debug(f"Enviando respuesta {status_text} a {addr[0]}:{addr[1]}")
+            udp_logger.debug(
+                "Enviando respuesta %s a %s:%s", status_text, addr[0], addr[1]
+            )
 
-        logger.debug(
-            f"Datos de respuesta: status={status}, userId={self.user_id_str.strip()} (bytes={response[1:21].hex()[:20]})"
-        )
+        if udp_logger.isEnabledFor(logging.DEBUG):
+            udp_logger.debug(
+                "Datos de respuesta: status=%d, userId=%s (bytes=%s)",
+                status,
+                self.user_id_str.strip(),
+                response[1:21].hex()[:20],
+            )
 
         try:
             self.udp_socket.sendto(response, addr)
+            self._count_sent(response)
         except Exception as e:
-            logger.error(f"Error enviando respuesta a {addr[0]}:{addr[1]}: {e}")
+            udp_logger.error(
+                "Error enviando respuesta a %s:%s: %s", addr[0], addr[1], e
+            )
 
     def _build_response(self, status, reason=None):
         """Construye respuesta
@@ -233,10 +455,13 @@ class Peer:
             RESPONSE_OK: "OK",
             RESPONSE_BAD_REQUEST: "BAD REQUEST",
             RESPONSE_INTERNAL_ERROR: "INTERNAL ERROR",
+            RESPONSE_CHUNKS_CORRUPT: "CHUNKS CORRUPT",
         }.get(status, f"UNKNOWN STATUS ({status})")
 
         if reason and status != RESPONSE_OK:
-            logger.warning(f"Construyendo respuesta {status_text} - Razón: {reason}")
+            udp_logger.warning(
+                "Construyendo respuesta %s - Razón: %s", status_text, reason
+            )
 
         return response
 
@@ -244,14 +469,25 @@ class Peer:
         """Servicio periódico de autodescubrimiento"""
         while True:
             try:
+                self._watchdog.busy("ronda de descubrimiento")
                 self.send_echo()
                 self._cleanup_inactive_peers()
-                time.sleep(10)
+                for transfer in self._incoming_transfers.expire_stale():
+                    self._count_transfer(transfer)
+                self._connection_pool.close_idle()
+                self._message_history.evict_idle()
+                self._drop_cold_history_state()
+                self._message_history.write_spills()
+                self._purge_stale_bodies()
+                self._watchdog.idle()
+                if self._closed.wait(10):
+                    return
             except Exception as e:
                 logger.error(
                     f"Error en servicio de autodescubrimiento: {e}", exc_info=True
                 )
-                time.sleep(5)
+                if self._closed.wait(5):
+                    return
 
     def _cleanup_inactive_peers(self):
         """Limpia peers inactivos de la lista de peers conocidos y consolida duplicados"""
@@ -286,42 +522,47 @@ class Peer:
                         to_remove.append(peer_id)
 
                 for peer_id in to_remove:
-                    logger.info(
-                        f"Peer inactivo eliminado: {normalized_id} (sin actividad por >90s)"
+                    discovery_logger.info(
+                        "Peer inactivo eliminado: %s (sin actividad por >90s)",
+                        normalized_id,
                     )
                     self.peers.pop(peer_id, None)
                     inactive_peers.append(normalized_id)
 
         for old_id, new_id in consolidated_peers:
-            logger.debug(f"Consolidado peer duplicado: '{old_id}' -> '{new_id}'")
+            discovery_logger.debug(
+                "Consolidado peer duplicado: '%s' -> '%s'", old_id, new_id
+            )
 
-        if inactive_peers:
-            with self._callback_lock:
-                for user_id in inactive_peers:
-                    for callback in self.peer_discovery_callbacks:
-                        callback(user_id, False)
+        for user_id in inactive_peers:
+            self._events.publish("peer", user_id, False)
 
     def send_echo(self):
         """Operación 0: Echo-Reply para descubrimiento"""
         header = self._build_header(None, 0)
 
-        logger.debug(
-            f"Header ECHO construido manualmente: {header[0:20].hex()[:20]}... -> {header[20:40].hex()[:20]}... op={header[40]}"
-        )
-        logger.debug(
-            f"Enviando ECHO con ID origen: '{self.user_id_str.strip()}' (bytes: {header[0:20].hex()[:20]})"
-        )
-
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as echo_socket:
-            echo_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            echo_socket.bind(("0.0.0.0", 0))
+        if discovery_logger.isEnabledFor(logging.DEBUG):
+            discovery_logger.debug(
+                "Header ECHO construido manualmente: %s... -> %s... op=%s",
+                header[0:20].hex()[:20],
+                header[20:40].hex()[:20],
+                header[40],
+            )
+            discovery_logger.debug(
+                "Enviando ECHO con ID origen: '%s' (bytes: %s)",
+                self.user_id_str.strip(),
+                header[0:20].hex()[:20],
+            )
 
-            for i in get_network_info():
-                logger.info(f"Enviando ECHO (broadcast) a {i}:{UDP_PORT}")
-                echo_socket.sendto(header, (i, UDP_PORT))
+        udp_port = self._transport.udp_port
+        with self._transport.udp_socket(broadcast=True) as echo_socket:
+            for i in self._transport.broadcast_addresses():
+                discovery_logger.info("Enviando ECHO (broadcast) a %s:%s", i, udp_port)
+                echo_socket.sendto(header, (i, udp_port))
+                self._count_sent(header)
 
             echo_socket.settimeout(5)
-            logger.info(f"Esperando respuestas al ECHO durante 5 segundos...")
+            discovery_logger.info("Esperando respuestas al ECHO durante 5 segundos...")
 
             start_time = time.time()
 
@@ -335,8 +576,8 @@ class Peer:
 
                             if raw_status == 0:
                                 user_id_bytes = resp_data[1:21]
-                                logger.debug(
-                                    f"Respuesta ECHO con formato correcto: status=0, ID sigue después"
+                                discovery_logger.debug(
+                                    "Respuesta ECHO con formato correcto: status=0, ID sigue después"
                                 )
 
                             user_id_bytes = user_id_bytes.rstrip(b"\x00")
@@ -345,22 +586,30 @@ class Peer:
                                 user_id = user_id_bytes.decode("utf-8")
                                 user_id = self._normalize_user_id(user_id)
                             except UnicodeDecodeError:
-                                logger.warning(f"Error decodificando ID de usuario")
+                                discovery_logger.warning(
+                                    "Error decodificando ID de usuario"
+                                )
                                 continue
 
                             my_id = self._normalize_user_id(self.user_id_str)
                             if user_id == my_id:
-                                logger.debug(
-                                    f"Ignorando respuesta ECHO de nosotros mismos: {user_id}"
+                                discovery_logger.debug(
+                                    "Ignorando respuesta ECHO de nosotros mismos: %s",
+                                    user_id,
                                 )
                                 continue
 
-                            logger.info(
-                                f"Recibida respuesta ECHO de '{user_id}' desde {resp_addr[0]}:{resp_addr[1]}"
-                            )
-                            logger.debug(
-                                f"Datos completos de respuesta: {resp_data.hex()}"
+                            discovery_logger.info(
+                                "Recibida respuesta ECHO de '%s' desde %s:%s",
+                                user_id,
+                                resp_addr[0],
+                                resp_addr[1],
                             )
+                            if discovery_logger.isEnabledFor(logging.DEBUG):
+                                discovery_logger.debug(
+                                    "Datos completos de respuesta: %s",
+                                    resp_data.hex(),
+                                )
 
                             with self._peers_lock:
                                 existing_peer = False
@@ -409,35 +658,45 @@ class Peer:
                                         datetime.now(),
                                     )
 
-                                    logger.info(f"Nuevo peer descubierto: {user_id}")
-                                    with self._callback_lock:
-                                        for callback in self.peer_discovery_callbacks:
-                                            callback(user_id.strip(), True)
+                                    discovery_logger.info(
+                                        "Nuevo peer descubierto: %s", user_id
+                                    )
+                                    self._events.publish("peer", user_id.strip(), True)
 
                     except socket.timeout:
                         break
 
             except Exception as e:
-                logger.error(f"Error procesando respuestas ECHO: {e}", exc_info=True)
+                discovery_logger.error(
+                    "Error procesando respuestas ECHO: %s", e, exc_info=True
+                )
 
             finally:
-                logger.info(
-                    f"Finalizada espera de respuestas ECHO. Tiempo total: {time.time() - start_time:.2f}s"
+                discovery_logger.info(
+                    "Finalizada espera de respuestas ECHO. Tiempo total: %.2fs",
+                    time.time() - start_time,
                 )
 
         return
 
     def _udp_listener(self):
         """Escucha mensajes UDP de control"""
-        logger.info("Iniciando escucha de mensajes UDP en puerto %d", UDP_PORT)
+        udp_logger.info(
+            "Iniciando escucha de mensajes UDP en puerto %d", self._transport.udp_port
+        )
         while True:
             try:
                 self.udp_socket.settimeout(None)
 
+                self._watchdog.idle()
                 data, addr = self.udp_socket.recvfrom(1024)
-                logger.info(
-                    f"UDP recibido: {len(data)} bytes desde {addr[0]}:{addr[1]}"
+                self._watchdog.busy("datagrama UDP")
+                self._m_datagrams_in.inc()
+                self._m_bytes_in.inc(len(data))
+                udp_logger.info(
+                    "UDP recibido: %s bytes desde %s:%s", len(data), addr[0], addr[1]
                 )
+                self._expect_message_body(data, addr)
                 handler_thread = threading.Thread(
                     target=self._handle_udp_message,
                     args=(data, addr),
@@ -445,15 +704,42 @@ class Peer:
                     name=f"UDPHandler-{addr[0]}:{addr[1]}",
                 )
                 handler_thread.start()
-                logger.debug(
-                    f"Lanzado hilo {handler_thread.name} para procesar mensaje UDP"
+                udp_logger.debug(
+                    "Lanzado hilo %s para procesar mensaje UDP", handler_thread.name
                 )
             except socket.timeout:
                 continue
             except Exception as e:
-                logger.error(f"Error en UDP listener: {e}")
+                if self._closed.is_set():
+                    return
+                udp_logger.error("Error en UDP listener: %s", e)
                 time.sleep(0.1)
 
+    def _expect_message_body(self, data, addr):
+        """Registra la espera del cuerpo de un header de mensaje recién llegado
+
+        Se llama desde el hilo listener, antes de lanzar el hilo del datagrama:
+        los broadcasts envían el cuerpo sin esperar la confirmación del header y
+        su hilo podría adelantarse al del header o al worker que lo atiende.
+        """
+        if len(data) != HEADER_SIZE or data[40] != MESSAGE:
+            return
+        user_to = data[20:40]
+        if data[0:20] == self.user_id or (
+            user_to != BROADCAST_ID
+            and user_to.rstrip(b"\x00 ") != self.user_id.rstrip(b"\x00 ")
+        ):
+            return
+        key = f"{addr[0]}:{data[41]}"
+        with self._expected_bodies_lock:
+            self._expected_message_bodies[key] = {
+                "data": None,
+                "received": False,
+                "event": threading.Event(),
+                "length": 8 + int.from_bytes(data[42:50], "big"),
+                "timestamp": time.time(),
+            }
+
     def _handle_udp_message(self, data, addr):
         """Maneja un mensaje UDP en un hilo separado"""
         try:
@@ -463,25 +749,40 @@ class Peer:
 
                     with self._expected_bodies_lock:
                         key = f"{addr[0]}:{body_id}"
-                        if key in self._expected_message_bodies:
-                            self._expected_message_bodies[key]["data"] = data
-                            self._expected_message_bodies[key]["received"] = True
-                            self._expected_message_bodies[key]["event"].set()
+                        expected = self._expected_message_bodies.get(key)
+                        # Solo se acepta un cuerpo del origen y con la longitud
+                        # que anunció su header
+                        if (
+                            expected is not None
+                            and not expected["received"]
+                            and len(data) == expected["length"]
+                        ):
+                            expected["data"] = data
+                            expected["received"] = True
+                            expected["event"].set()
 
                             thread_name = threading.current_thread().name
-                            logger.debug(
-                                f"{thread_name} recibió cuerpo de mensaje con ID {body_id} de {addr[0]}, notificando al hilo de procesamiento"
+                            udp_logger.debug(
+                                "%s recibió cuerpo de mensaje con ID %s de %s, notificando al hilo de procesamiento",
+                                thread_name,
+                                body_id,
+                                addr[0],
                             )
                             return
 
                 except Exception as e:
-                    logger.debug(f"Error verificando si es un cuerpo de mensaje: {e}")
+                    udp_logger.debug(
+                        "Error verificando si es un cuerpo de mensaje: %s", e
+                    )
 
             """if len(data) > 100:
                 return self._send_response(addr, RESPONSE_BAD_REQUEST)
             elif len(data) < 100:
-                logger.warning(
-                    f"Recibido mensaje UDP con formato desconocido desde {addr[0]}:{addr[1]} (tamaño: {len(data)} bytes)"
+                udp_logger.warning(
+                    "Recibido mensaje UDP con formato desconocido desde %s:%s (tamaño: %d bytes)",
+                    addr[0],
+                    addr[1],
+                    len(data),
                 )
                 return self._send_response(addr, RESPONSE_BAD_REQUEST)"""
 
@@ -492,7 +793,9 @@ class Peer:
             my_id = self._normalize_user_id(self.user_id_str)
 
             if sender_id == my_id:
-                logger.debug(f"Ignorando mensaje propio desde {addr[0]}:{addr[1]}")
+                udp_logger.debug(
+                    "Ignorando mensaje propio desde %s:%s", addr[0], addr[1]
+                )
                 return
 
             with self._peers_lock:
@@ -526,13 +829,16 @@ class Peer:
 
                     self.peers[normalized_id] = (addr[0], datetime.now())
                 status_text = "nuevo" if is_new else "existente"
-                logger.info(
-                    f"Peer {status_text} registrado: {sender_id} en {addr[0]}:{addr[1]}"
+                udp_logger.info(
+                    "Peer %s registrado: %s en %s:%s",
+                    status_text,
+                    sender_id,
+                    addr[0],
+                    addr[1],
                 )
 
             if is_new:
-                for callback in self.peer_discovery_callbacks:
-                    callback(header["user_from"], True)
+                self._events.publish("peer", header["user_from"], True)
 
             operation_type = "desconocida"
             if header["operation"] == 0:
@@ -557,88 +863,125 @@ class Peer:
                     }
                 )
 
-            logger.info(
-                f"Recibido mensaje de tipo {operation_type} (op={header['operation']}) de {header['user_from']}"
+            udp_logger.info(
+                "Recibido mensaje de tipo %s (op=%s) de %s",
+                operation_type,
+                header["operation"],
+                header["user_from"],
             )
 
             if header["operation"] > 0:
-                logger.debug(
-                    f"Cola de mensajes: aproximadamente {self.message_queue.qsize()} tareas pendientes"
+                udp_logger.debug(
+                    "Cola de mensajes: aproximadamente %s tareas pendientes",
+                    self.message_queue.qsize(),
                 )
 
         except Exception as e:
-            logger.error(f"Error procesando mensaje UDP: {e}")
+            udp_logger.error("Error procesando mensaje UDP: %s", e)
 
     def _tcp_listener(self):
         """Escucha conexiones TCP para transferencia de archivos"""
-        logger.info(f"Iniciando escucha de conexiones TCP en puerto {TCP_PORT}")
+        logger.info(
+            "Iniciando escucha de conexiones TCP en puerto %s", self._transport.tcp_port
+        )
         while True:
             try:
+                self._watchdog.idle()
                 conn, addr = self.tcp_socket.accept()
-                logger.info(f"Nueva conexión TCP desde {addr[0]}:{addr[1]}")
+                self._watchdog.busy("conexión TCP")
+                logger.info("Nueva conexión TCP desde %s:%s", addr[0], addr[1])
                 handler_thread = threading.Thread(
-                    target=self._handle_file_transfer,
+                    target=self._handle_tcp_connection,
                     args=(conn, addr),
                     daemon=True,
                     name=f"FileHandler-{addr[0]}:{addr[1]}",
                 )
                 handler_thread.start()
                 logger.info(
-                    f"Lanzado hilo {handler_thread.name} para manejar transferencia de archivo"
+                    "Lanzado hilo %s para manejar transferencia de archivo",
+                    handler_thread.name,
                 )
             except Exception as e:
-                logger.error(f"Error en TCP listener: {e}", exc_info=True)
+                if self._closed.is_set():
+                    return
+                logger.error("Error en TCP listener: %s", e, exc_info=True)
 
     def _process_echo(self, header, addr):
         """Procesa operación 0: Echo-Reply para autodescubrimiento"""
         user_from = header["user_from"]
         worker_name = threading.current_thread().name
 
-        logger.info(
-            f"{worker_name} procesando ECHO de {user_from} desde {addr[0]}:{addr[1]}"
+        discovery_logger.info(
+            "%s procesando ECHO de %s desde %s:%s",
+            worker_name,
+            user_from,
+            addr[0],
+            addr[1],
         )
 
         expected_recipient = self.user_id_str.rstrip("\x00")
         user_to = header["user_to"]
 
         if user_to != BROADCAST_ID and user_to != expected_recipient:
-            logger.debug(
-                f"{worker_name} ignorando ECHO para otro destinatario: {user_to}"
+            discovery_logger.debug(
+                "%s ignorando ECHO para otro destinatario: %s", worker_name, user_to
             )
             return
 
         with self._udp_socket_lock:
-            logger.debug(f"{worker_name} enviando respuesta a ECHO de {user_from}")
+            discovery_logger.debug(
+                "%s enviando respuesta a ECHO de %s", worker_name, user_from
+            )
 
             echo_response = self._build_response(RESPONSE_OK)
 
-            logger.debug(
-                f"{worker_name} enviando respuesta ECHO: status={RESPONSE_OK}, ID={self.user_id_str.strip()} (bytes: {echo_response.hex()})"
-            )
+            if discovery_logger.isEnabledFor(logging.DEBUG):
+                discovery_logger.debug(
+                    "%s enviando respuesta ECHO: status=%s, ID=%s (bytes: %s)",
+                    worker_name,
+                    RESPONSE_OK,
+                    self.user_id_str.strip(),
+                    echo_response.hex(),
+                )
 
             try:
                 self.udp_socket.sendto(echo_response, addr)
-                logger.info(f"{worker_name} respuesta a ECHO enviada a {user_from}")
+                self._count_sent(echo_response)
+                discovery_logger.info(
+                    "%s respuesta a ECHO enviada a %s", worker_name, user_from
+                )
             except Exception as e:
-                logger.error(f"{worker_name} error enviando respuesta ECHO: {e}")
+                discovery_logger.error(
+                    "%s error enviando respuesta ECHO: %s", worker_name, e
+                )
 
     def _process_message(self, header, addr):
         """Procesa operación 1: Message-Response"""
         user_from = header["user_from"]
         worker_name = threading.current_thread().name
-        logger.info(
-            f"{worker_name} iniciando procesamiento de mensaje de {user_from} desde {addr[0]}:{addr[1]}"
+        message_logger.info(
+            "%s iniciando procesamiento de mensaje de %s desde %s:%s",
+            worker_name,
+            user_from,
+            addr[0],
+            addr[1],
         )
 
+        self._bandwidth.note_chat_activity()
+
         with self._conversation_locks_lock:
             if user_from not in self._conversation_locks:
-                logger.debug(f"Creando nuevo lock de conversación para {user_from}")
+                message_logger.debug(
+                    "Creando nuevo lock de conversación para %s", user_from
+                )
                 self._conversation_locks[user_from] = threading.Lock()
             user_lock = self._conversation_locks[user_from]
 
+        span = self._tracer.begin("conversation_lock_wait")
         with user_lock:
-            logger.debug(
-                f"{worker_name} adquirió lock de conversación para {user_from}"
+            span.end()
+            message_logger.debug(
+                "%s adquirió lock de conversación para %s", worker_name, user_from
             )
 
             if not all(
@@ -652,8 +995,10 @@ class Peer:
                 ]
             ):
                 with self._udp_socket_lock:
-                    logger.warning(
-                        f"{worker_name} rechazando header de {user_from} por formato incorrecto"
+                    message_logger.warning(
+                        "%s rechazando header de %s por formato incorrecto",
+                        worker_name,
+                        user_from,
                     )
                     self._send_response(
                         addr, RESPONSE_BAD_REQUEST, "Header incompleto o malformado"
@@ -666,8 +1011,10 @@ class Peer:
                 and header["user_to"] != BROADCAST_ID
             ):
                 with self._udp_socket_lock:
-                    logger.warning(
-                        f"{worker_name} rechazando mensaje para destinatario incorrecto: {header['user_to']}"
+                    message_logger.warning(
+                        "%s rechazando mensaje para destinatario incorrecto: %s",
+                        worker_name,
+                        header["user_to"],
                     )
                     self._send_response(
                         addr,
@@ -677,12 +1024,19 @@ class Peer:
                 return
 
             # Fase 1: Enviar confirmación del header
+            span = self._tracer.begin("ack_header")
             with self._udp_socket_lock:
-                logger.debug(
-                    f"{worker_name} enviando confirmación de header (phase 1) a {addr[0]}:{addr[1]}"
+                message_logger.debug(
+                    "%s enviando confirmación de header (phase 1) a %s:%s",
+                    worker_name,
+                    addr[0],
+                    addr[1],
                 )
                 self._send_response(addr, RESPONSE_OK)
-                logger.info(f"{worker_name} confirmó recepción de header a {user_from}")
+                message_logger.info(
+                    "%s confirmó recepción de header a %s", worker_name, user_from
+                )
+            span.end()
 
             try:
                 # Fase 2: Recibir cuerpo del mensaje
@@ -690,26 +1044,39 @@ class Peer:
                 expected_body_id = header["body_id"]
                 expected_length = header["body_length"]
 
-                message_wait_event = threading.Event()
                 key = f"{addr[0]}:{expected_body_id}"
 
+                # El listener ya registró la espera al recibir el header; solo
+                # falta si se purgó mientras el header esperaba en la cola
                 with self._expected_bodies_lock:
-                    self._expected_message_bodies[key] = {
-                        "data": None,
-                        "received": False,
-                        "event": message_wait_event,
-                        "timestamp": time.time(),
-                    }
-                    logger.debug(
-                        f"{worker_name} registrando espera de cuerpo de mensaje con ID {expected_body_id} de {addr[0]}"
+                    expected = self._expected_message_bodies.setdefault(
+                        key,
+                        {
+                            "data": None,
+                            "received": False,
+                            "event": threading.Event(),
+                            "length": 8 + expected_length,
+                            "timestamp": time.time(),
+                        },
+                    )
+                    message_wait_event = expected["event"]
+                    message_logger.debug(
+                        "%s registrando espera de cuerpo de mensaje con ID %s de %s",
+                        worker_name,
+                        expected_body_id,
+                        addr[0],
                     )
 
                 # Fase 2: Esperamos por el evento de recepción del cuerpo
-                received = message_wait_event.wait(timeout_secs)
+                with self._tracer.span("wait_body", bytes=expected_length):
+                    received = message_wait_event.wait(timeout_secs)
 
                 if not received:
-                    logger.error(
-                        f"{worker_name} timeout esperando cuerpo con ID {expected_body_id} de {addr[0]}"
+                    message_logger.error(
+                        "%s timeout esperando cuerpo con ID %s de %s",
+                        worker_name,
+                        expected_body_id,
+                        addr[0],
                     )
                     with self._expected_bodies_lock:
                         if key in self._expected_message_bodies:
@@ -727,21 +1094,30 @@ class Peer:
                     body_data = message_data["data"]
                     del self._expected_message_bodies[key]
 
-                logger.info(
-                    f"{worker_name} recibido cuerpo de mensaje: {len(body_data)} bytes"
+                message_logger.info(
+                    "%s recibido cuerpo de mensaje: %s bytes",
+                    worker_name,
+                    len(body_data),
                 )
                 msg_addr = (
                     addr[0],
                     addr[1],
                 )
 
-                logger.info(
-                    f"{worker_name} recibió {len(body_data)} bytes de datos desde {msg_addr[0]}:{msg_addr[1]}"
+                message_logger.info(
+                    "%s recibió %s bytes de datos desde %s:%s",
+                    worker_name,
+                    len(body_data),
+                    msg_addr[0],
+                    msg_addr[1],
                 )
 
                 if msg_addr[0] != addr[0]:
-                    logger.warning(
-                        f"{worker_name} detectó IP diferente en mensaje de datos: esperaba {addr[0]}, recibió {msg_addr[0]}"
+                    message_logger.warning(
+                        "%s detectó IP diferente en mensaje de datos: esperaba %s, recibió %s",
+                        worker_name,
+                        addr[0],
+                        msg_addr[0],
                     )
                     with self._udp_socket_lock:
                         self._send_response(
@@ -756,15 +1132,18 @@ class Peer:
                 )
 
                 if received_body_id == expected_body_id:
-                    logger.debug(
-                        f"{worker_name} verificó BodyId correcto: {received_body_id}"
+                    message_logger.debug(
+                        "%s verificó BodyId correcto: %s", worker_name, received_body_id
                     )
 
                     actual_length = len(body_data) - 8
 
                     if actual_length != expected_length:
-                        logger.warning(
-                            f"{worker_name} tamaño de mensaje incorrecto: esperaba {expected_length}, recibió {actual_length}"
+                        message_logger.warning(
+                            "%s tamaño de mensaje incorrecto: esperaba %s, recibió %s",
+                            worker_name,
+                            expected_length,
+                            actual_length,
                         )
                         with self._udp_socket_lock:
                             self._send_response(
@@ -779,67 +1158,101 @@ class Peer:
                             message = body_data[8:].decode("utf-8")
                         except UnicodeDecodeError:
                             message = body_data[8:].decode("utf-8", errors="replace")
-                            logger.warning(
-                                f"{worker_name} mensaje con caracteres inválidos de {user_from}"
+                            message_logger.warning(
+                                "%s mensaje con caracteres inválidos de %s",
+                                worker_name,
+                                user_from,
                             )
 
-                        log_len = min(50, len(message))
-                        log_preview = message[:log_len] + (
-                            "..." if len(message) > log_len else ""
-                        )
-                        logger.info(
-                            f"{worker_name} decodificó mensaje de {user_from}: {log_preview}"
+                        message_logger.info(
+                            "%s decodificó mensaje de %s: %.50s",
+                            worker_name,
+                            user_from,
+                            message,
                         )
 
                         if not message.strip():
-                            logger.warning(
-                                f"{worker_name} mensaje vacío recibido de {user_from}, ignorando"
+                            message_logger.warning(
+                                "%s mensaje vacío recibido de %s, ignorando",
+                                worker_name,
+                                user_from,
                             )
                             with self._udp_socket_lock:
                                 self._send_response(addr, RESPONSE_OK)
                             return
 
-                        callbacks_count = len(self.message_callbacks)
-                        if callbacks_count == 0:
-                            logger.debug(
-                                f"{worker_name} no hay callbacks registrados, mensaje ignorado"
+                        safe_user_from = user_from.strip()
+                        is_broadcast = header["user_to"] == BROADCAST_ID
+                        ordinal = None if is_broadcast else header.get("ordinal")
+                        with self._tracer.span("store_history"):
+                            stored = self._store_message_in_history(
+                                safe_user_from,
+                                message,
+                                is_outgoing=False,
+                                ordinal=ordinal,
+                                broadcast=is_broadcast,
                             )
-                        else:
-                            safe_user_from = user_from.strip()
-                            with self._callback_lock:
-                                logger.debug(
-                                    f"{worker_name} notificando mensaje a {callbacks_count} callbacks"
+
+                        if stored is None:
+                            # No se puede saber si ya se recibió: mejor que el
+                            # emisor lo dé por fallido que confirmar sin guardar
+                            message_logger.warning(
+                                "%s ordinal %s de %s fuera de la ventana de "
+                                "duplicados",
+                                worker_name,
+                                ordinal,
+                                user_from,
+                            )
+                            with self._udp_socket_lock:
+                                self._send_response(
+                                    addr,
+                                    RESPONSE_BAD_REQUEST,
+                                    "Ordinal fuera de la ventana de duplicados",
                                 )
-                                for i, callback in enumerate(self.message_callbacks):
-                                    try:
-                                        # Almacenar el mensaje en el historial antes de enviarlo a los callbacks
-                                        self._store_message_in_history(
-                                            safe_user_from, message, is_outgoing=False
-                                        )
+                            return
 
-                                        callback(safe_user_from, message)
-                                        if i == 0 or i == callbacks_count - 1:
-                                            logger.debug(
-                                                f"{worker_name} callback {i+1}/{callbacks_count} completado"
-                                            )
-                                    except Exception as cb_e:
-                                        logger.error(
-                                            f"{worker_name} error en callback {i+1}: {cb_e}",
-                                            exc_info=True,
-                                        )
+                        if stored:
+                            self._m_messages_received.inc()
+                            # Los callbacks se atienden en los hilos del bus: la
+                            # confirmación no espera a que terminen
+                            with self._tracer.span("dispatch_callbacks"):
+                                delivered = self._events.publish(
+                                    "message", safe_user_from, message
+                                )
+                            message_logger.debug(
+                                "%s mensaje encolado para %s suscriptores",
+                                worker_name,
+                                delivered,
+                            )
+                        else:
+                            # Ya está en el historial: se confirma igualmente
+                            message_logger.info(
+                                "%s mensaje duplicado de %s ignorado",
+                                worker_name,
+                                user_from,
+                            )
 
                         # Fase 3: Confirmar recepción
+                        span = self._tracer.begin("ack_final")
                         with self._udp_socket_lock:
-                            logger.debug(
-                                f"{worker_name} enviando confirmación final (phase 3) a {addr[0]}:{addr[1]}"
+                            message_logger.debug(
+                                "%s enviando confirmación final (phase 3) a %s:%s",
+                                worker_name,
+                                addr[0],
+                                addr[1],
                             )
                             self._send_response(addr, RESPONSE_OK)
-                            logger.info(
-                                f"{worker_name} completó procesamiento de mensaje de {user_from}"
+                            message_logger.info(
+                                "%s completó procesamiento de mensaje de %s",
+                                worker_name,
+                                user_from,
                             )
+                        span.end()
                     except UnicodeDecodeError as ude:
-                        logger.error(
-                            f"{worker_name} error decodificando mensaje como UTF-8: {ude}"
+                        message_logger.error(
+                            "%s error decodificando mensaje como UTF-8: %s",
+                            worker_name,
+                            ude,
                         )
                         with self._udp_socket_lock:
                             self._send_response(
@@ -848,8 +1261,11 @@ class Peer:
                                 "Error de codificación del mensaje",
                             )
                 else:
-                    logger.warning(
-                        f"{worker_name} error de BodyId: esperaba {expected_body_id}, recibió {received_body_id}"
+                    message_logger.warning(
+                        "%s error de BodyId: esperaba %s, recibió %s",
+                        worker_name,
+                        expected_body_id,
+                        received_body_id,
                     )
                     with self._udp_socket_lock:
                         self._send_response(
@@ -859,9 +1275,12 @@ class Peer:
                         )
 
             except socket.timeout:
-                logger.error(
-                    f"{worker_name} timeout esperando datos de mensaje de {user_from}"
+                message_logger.error(
+                    "%s timeout esperando datos de mensaje de %s",
+                    worker_name,
+                    user_from,
                 )
+                self._m_timeouts.labels("receive_message").inc()
                 with self._udp_socket_lock:
                     self._send_response(
                         addr,
@@ -869,8 +1288,11 @@ class Peer:
                         "Timeout esperando datos del mensaje",
                     )
             except Exception as e:
-                logger.error(
-                    f"{worker_name} error procesando mensaje de {user_from}: {e}",
+                message_logger.error(
+                    "%s error procesando mensaje de %s: %s",
+                    worker_name,
+                    user_from,
+                    e,
                     exc_info=True,
                 )
                 with self._udp_socket_lock:
@@ -879,8 +1301,9 @@ class Peer:
                     )
             finally:
                 if random.random() < 0.1:
-                    logger.debug(
-                        f"{worker_name} iniciando limpieza de locks de conversación antiguas"
+                    message_logger.debug(
+                        "%s iniciando limpieza de locks de conversación antiguas",
+                        worker_name,
                     )
                     self._cleanup_conversation_locks()
 
@@ -889,7 +1312,7 @@ class Peer:
         user_from = header["user_from"]
         worker_name = threading.current_thread().name
 
-        logger.info(f"{worker_name} procesando solicitud de archivo de {user_from}")
+        logger.info("%s procesando solicitud de archivo de %s", worker_name, user_from)
 
         if not all(
             key in header
@@ -897,7 +1320,9 @@ class Peer:
         ):
             with self._udp_socket_lock:
                 logger.warning(
-                    f"{worker_name} rechazando header de archivo de {user_from} por formato incorrecto"
+                    "%s rechazando header de archivo de %s por formato incorrecto",
+                    worker_name,
+                    user_from,
                 )
                 self._send_response(
                     addr, RESPONSE_BAD_REQUEST, "Header incompleto o malformado"
@@ -908,7 +1333,9 @@ class Peer:
         if header["user_to"] != expected_recipient:
             with self._udp_socket_lock:
                 logger.warning(
-                    f"{worker_name} rechazando archivo para destinatario incorrecto: {header['user_to']}"
+                    "%s rechazando archivo para destinatario incorrecto: %s",
+                    worker_name,
+                    header["user_to"],
                 )
                 self._send_response(
                     addr,
@@ -921,7 +1348,9 @@ class Peer:
         if file_size <= 0:
             with self._udp_socket_lock:
                 logger.warning(
-                    f"{worker_name} rechazando archivo de tamaño inválido: {file_size} bytes"
+                    "%s rechazando archivo de tamaño inválido: %s bytes",
+                    worker_name,
+                    file_size,
                 )
                 self._send_response(
                     addr,
@@ -930,160 +1359,262 @@ class Peer:
                 )
             return
 
-        with self._peers_lock:
-            expected_file_id = header["body_id"]
-            if not hasattr(self, "_expected_file_transfers"):
-                self._expected_file_transfers = {}
-
-            peer_ip = addr[0]
-            self._expected_file_transfers[peer_ip] = {
-                "body_id": expected_file_id,
-                "file_size": file_size,
-                "user_from": user_from,
-                "timestamp": time.time(),
-            }
-            logger.info(
-                f"{worker_name} registrando transferencia esperada de {user_from} con ID {expected_file_id}"
-            )
-
-        with self._udp_socket_lock:
-            logger.info(
-                f"{worker_name} aceptando solicitud de archivo de {user_from}, tamaño: {file_size} bytes, ID: {expected_file_id}"
+        expected_file_id = header["body_id"]
+        try:
+            self._incoming_transfers.create(
+                addr[0],
+                expected_file_id,
+                user_id=user_from,
+                file_size=file_size,
+                root_hash=header.get("root_hash"),
+                flags=header.get("flags", 0),
             )
+        except ValueError as e:
+            with self._udp_socket_lock:
+                self._send_response(addr, RESPONSE_BAD_REQUEST, str(e))
+            return
         logger.info(
-            f"{worker_name} esperando conexión TCP de {user_from} para transferencia de archivo con ID {expected_file_id}"
+            "%s registrando transferencia esperada de %s con ID %s",
+            worker_name,
+            user_from,
+            expected_file_id,
         )
 
-    def _handle_file_transfer(self, conn, addr):
-        """Maneja la transferencia de archivo por TCP"""
-        worker_name = threading.current_thread().name
         logger.info(
-            f"{worker_name} iniciando manejo de transferencia de archivo desde {addr[0]}:{addr[1]}"
+            "%s aceptando solicitud de archivo de %s, tamaño: %s bytes, ID: %s",
+            worker_name,
+            user_from,
+            file_size,
+            expected_file_id,
+        )
+        logger.info(
+            "%s esperando conexión TCP de %s para transferencia de archivo con ID %s",
+            worker_name,
+            user_from,
+            expected_file_id,
         )
 
+    def _handle_tcp_connection(self, conn, addr):
+        """Atiende una conexión TCP entrante.
+
+        Una conexión normal lleva una sola transferencia que empieza por su
+        file_id. Si empieza por KEEPALIVE_MAGIC es persistente: se confirma con OK
+        y se atienden transferencias seguidas hasta que el emisor la cierra, pasa
+        KEEPALIVE_IDLE_TIMEOUT sin actividad o una transferencia no termina limpia.
+        Si empieza por SYNC_MAGIC es una sincronización de historial.
+        """
+        worker_name = threading.current_thread().name
         try:
-            file_id_bytes = conn.recv(8)
-            if len(file_id_bytes) < 8:
+            preface = self._recv_file_id(conn)
+            if preface is None:
                 logger.error(
-                    f"{worker_name} recibió identificador de archivo incompleto: {len(file_id_bytes)} bytes"
+                    "%s recibió identificador de archivo incompleto", worker_name
                 )
                 conn.send(
                     self._build_response(
                         RESPONSE_BAD_REQUEST, "ID de archivo incompleto"
                     )
                 )
-                conn.close()
                 return
 
-            file_id = int.from_bytes(file_id_bytes, "big")
-            logger.info(f"{worker_name} recibió identificador de archivo: {file_id}")
+            if preface == SYNC_MAGIC:
+                self._handle_history_sync(conn, addr)
+                return
 
-            expected_transfer_info = None
-            peer_id = None
+            if preface != KEEPALIVE_MAGIC:
+                file_id = int.from_bytes(preface, "big")
+                with self._tracer.operation(
+                    "receive_file", peer=addr[0], file_id=file_id
+                ):
+                    self._handle_file_transfer(conn, addr, file_id)
+                return
 
-            with self._peers_lock:
-                if (
-                    hasattr(self, "_expected_file_transfers")
-                    and addr[0] in self._expected_file_transfers
+            logger.info(
+                "%s conexión persistente establecida con %s:%s",
+                worker_name,
+                addr[0],
+                addr[1],
+            )
+            conn.send(self._build_response(RESPONSE_OK))
+            handled = 0
+            while True:
+                conn.settimeout(KEEPALIVE_IDLE_TIMEOUT)
+                try:
+                    file_id_bytes = self._recv_file_id(conn)
+                except socket.timeout:
+                    logger.debug("%s conexión persistente inactiva", worker_name)
+                    break
+                if file_id_bytes is None:
+                    break
+                conn.settimeout(None)
+
+                handled += 1
+                file_id = int.from_bytes(file_id_bytes, "big")
+                with self._tracer.operation(
+                    "receive_file", peer=addr[0], file_id=file_id, keepalive=True
                 ):
-                    expected_transfer_info = self._expected_file_transfers[addr[0]]
+                    if not self._handle_file_transfer(conn, addr, file_id):
+                        break
+
+            logger.info(
+                "%s conexión persistente con %s cerrada tras %s transferencias",
+                worker_name,
+                addr[0],
+                handled,
+            )
+        except Exception as e:
+            logger.error("%s error en conexión TCP: %s", worker_name, e, exc_info=True)
+        finally:
+            conn.close()
+            logger.debug("%s conexión TCP cerrada", worker_name)
+
+    def _recv_file_id(self, conn):
+        """Lee los 8 bytes iniciales de una transferencia
+
+        Returns:
+            bytes o None si la conexión se cerró antes de completarlos
+        """
+        data = b""
+        while len(data) < 8:
+            chunk = conn.recv(8 - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _handle_file_transfer(self, conn, addr, file_id):
+        """Maneja la transferencia de archivo por TCP
+
+        Returns:
+            bool: True si la transferencia terminó con OK y la conexión puede
+                seguir usándose para otra
+        """
+        worker_name = threading.current_thread().name
+        logger.info(
+            "%s iniciando manejo de transferencia de archivo desde %s:%s",
+            worker_name,
+            addr[0],
+            addr[1],
+        )
+
+        transfer = None
+        writer = None
+        try:
+            logger.info("%s recibió identificador de archivo: %s", worker_name, file_id)
 
+            peer_id = None
+            with self._peers_lock:
                 for user_id, (ip, _) in self.peers.items():
                     if ip == addr[0]:
                         peer_id = user_id
                         break
 
-            if not expected_transfer_info:
+            # La conexión TCP puede llegar antes de que se procese el header UDP
+            with self._tracer.span("claim_offer"):
+                transfer = self._incoming_transfers.claim(addr[0], file_id, timeout=2)
+            if not transfer:
                 logger.warning(
-                    f"{worker_name} no hay transferencia esperada desde IP {addr[0]}, rechazando conexión"
+                    "%s no hay transferencia esperada con ID %s desde IP %s, rechazando conexión",
+                    worker_name,
+                    file_id,
+                    addr[0],
                 )
                 conn.send(
                     self._build_response(
                         RESPONSE_BAD_REQUEST, "Transferencia no autorizada"
                     )
                 )
-                conn.close()
-                return
-
-            if expected_transfer_info["body_id"] != file_id:
-                logger.warning(
-                    f"{worker_name} ID de archivo incorrecto: esperado {expected_transfer_info['body_id']}, recibido {file_id}"
-                )
-                conn.send(
-                    self._build_response(
-                        RESPONSE_BAD_REQUEST, "ID de archivo incorrecto"
-                    )
-                )
-                conn.close()
-                return
+                return False
 
             if not peer_id:
+                self._incoming_transfers.fail_if_pending(
+                    transfer, "Peer no identificado"
+                )
                 logger.warning(
-                    f"{worker_name} no pudo identificar peer con IP {addr[0]}, cerrando conexión"
+                    "%s no pudo identificar peer con IP %s, cerrando conexión",
+                    worker_name,
+                    addr[0],
                 )
                 conn.send(
                     self._build_response(RESPONSE_BAD_REQUEST, "Peer no identificado")
                 )
-                conn.close()
-                return
+                return False
 
             logger.info(
-                f"{worker_name} identificó peer como {peer_id} para la transferencia de archivo con ID {file_id}"
+                "%s identificó peer como %s para la transferencia de archivo con ID %s",
+                worker_name,
+                peer_id,
+                file_id,
             )
 
+            if transfer.info.get("flags", 0) & FLAG_ARCHIVE:
+                return self._receive_archive(conn, transfer, peer_id)
+
             timestamp = int(time.time())
-            temp_file = f"lcp_file_{timestamp}_{peer_id}.dat"
-            expected_size = expected_transfer_info["file_size"]
+            final_path = os.path.join(
+                self.download_dir,
+                f"lcp_file_{timestamp}_{file_id}_{peer_id.strip()}.dat",
+            )
+            expected_size = transfer.file_size
+
+            verifier = None
+            if transfer.info.get("root_hash"):
+                verifier = ChunkVerifier(transfer.info["root_hash"], expected_size)
 
             try:
+                # Los hashes de los chunks se calculan en el hilo escritor
+                writer = BackgroundFileWriter(
+                    final_path, fsync_policy=self.fsync_policy, hasher=verifier
+                )
                 logger.info(
-                    f"{worker_name} creando archivo temporal: {temp_file}, tamaño esperado: {expected_size} bytes"
+                    "%s creando archivo temporal: %s, tamaño esperado: %s bytes",
+                    worker_name,
+                    writer.temp_path,
+                    expected_size,
                 )
 
                 bytes_recibidos = 0
-                with open(temp_file, "wb") as f:
-                    logger.info(
-                        f"{worker_name} iniciando recepción de datos de archivo"
-                    )
+                logger.info("%s iniciando recepción de datos de archivo", worker_name)
 
-                    while bytes_recibidos < expected_size:
-                        bytes_restantes = expected_size - bytes_recibidos
-                        chunk_size = bytes_restantes
-
-                        data = conn.recv(chunk_size)
-                        if not data:
-                            logger.debug(
-                                f"{worker_name} fin de transmisión detectado antes de completar"
-                            )
-                            break
+                span = self._tracer.begin("receive_data", bytes=expected_size)
+                while bytes_recibidos < expected_size:
+                    buffer = writer.acquire_buffer()
+                    filled = self._recv_into_buffer(
+                        conn, buffer, expected_size - bytes_recibidos
+                    )
+                    if not filled:
+                        writer.release_buffer(buffer)
+                        logger.debug(
+                            "%s fin de transmisión detectado antes de completar",
+                            worker_name,
+                        )
+                        break
 
-                        f.write(data)
-                        bytes_recibidos += len(data)
+                    writer.submit(buffer, filled)
+                    bytes_recibidos += filled
+                    transfer.bytes_done = bytes_recibidos
+                span.end()
 
-                        if bytes_recibidos % (1024 * 1024) < 4096:
-                            progress = (
-                                int((bytes_recibidos / expected_size) * 100)
-                                if expected_size > 0
-                                else 0
-                            )
-                            logger.info(
-                                f"{worker_name} progreso: {bytes_recibidos/1024:.1f} KB ({progress}%) recibidos de {peer_id}"
-                            )
+                with self._tracer.span("drain_writer"):
+                    writer.drain()
 
             except IOError as e:
-                logger.error(f"{worker_name} error de I/O escribiendo archivo: {e}")
+                logger.error("%s error de I/O escribiendo archivo: %s", worker_name, e)
                 conn.send(
                     self._build_response(
                         RESPONSE_INTERNAL_ERROR, f"Error de I/O: {str(e)}"
                     )
                 )
-                return
+                return False
 
             try:
-                received_size = os.path.getsize(temp_file)
+                received_size = writer.bytes_written
                 if received_size != expected_size:
                     logger.error(
-                        f"{worker_name} tamaño de archivo incorrecto: esperado {expected_size}, recibido {received_size}"
+                        "%s tamaño de archivo incorrecto: esperado %s, recibido %s",
+                        worker_name,
+                        expected_size,
+                        received_size,
                     )
                     conn.send(
                         self._build_response(
@@ -1091,35 +1622,62 @@ class Peer:
                             f"Tamaño incorrecto: esperado {expected_size}, recibido {received_size}",
                         )
                     )
-                    return
+                    return False
 
                 logger.info(
-                    f"{worker_name} transferencia completa: {bytes_recibidos} bytes recibidos en {temp_file}"
+                    "%s transferencia completa: %s bytes recibidos en %s",
+                    worker_name,
+                    bytes_recibidos,
+                    writer.temp_path,
                 )
 
-                with self._peers_lock:
-                    if (
-                        hasattr(self, "_expected_file_transfers")
-                        and addr[0] in self._expected_file_transfers
-                    ):
-                        del self._expected_file_transfers[addr[0]]
+                self._incoming_transfers.transition(transfer, VERIFYING)
+                span = self._tracer.begin("verify")
+                if verifier and not verifier.root_matches():
+                    if not self._repair_corrupt_chunks(conn, writer, verifier):
+                        logger.error(
+                            "%s no se pudo reparar el archivo de %s tras %s rondas",
+                            worker_name,
+                            peer_id,
+                            MAX_REPAIR_ROUNDS,
+                        )
+                        conn.send(
+                            self._build_response(
+                                RESPONSE_BAD_REQUEST, "Chunks corruptos sin reparar"
+                            )
+                        )
+                        return False
+                    logger.info(
+                        "%s archivo de %s reparado y verificado", worker_name, peer_id
+                    )
+                elif verifier:
+                    logger.debug("%s raíz de Merkle verificada", worker_name)
+                span.end()
 
-                logger.info(
-                    f"{worker_name} notificando recepción de archivo a {len(self.file_callbacks)} callbacks"
-                )
-                for callback in self.file_callbacks:
-                    callback(peer_id, temp_file)
+                span = self._tracer.begin("finalize")
+                temp_file = writer.finish()
+                writer = None
+                transfer.info["file_path"] = temp_file
+                self._incoming_transfers.transition(transfer, COMPLETED)
+
+                self._events.publish("file", peer_id, temp_file)
 
                 logger.debug(
-                    f"{worker_name} enviando confirmación de recepción exitosa a {peer_id}"
+                    "%s enviando confirmación de recepción exitosa a %s",
+                    worker_name,
+                    peer_id,
                 )
                 conn.send(self._build_response(RESPONSE_OK))
+                span.end()
                 logger.info(
-                    f"{worker_name} transferencia de archivo finalizada correctamente"
+                    "%s transferencia de archivo finalizada correctamente", worker_name
                 )
+                return True
 
             except Exception as e:
-                logger.error(f"{worker_name} error verificando archivo recibido: {e}")
+                logger.error(
+                    "%s error verificando archivo recibido: %s", worker_name, e
+                )
                 conn.send(
                     self._build_response(
                         RESPONSE_INTERNAL_ERROR, f"Error interno: {str(e)}"
@@ -1127,7 +1685,7 @@ class Peer:
                 )
 
         except ConnectionError as e:
-            logger.error(f"{worker_name} error de conexión: {e}")
+            logger.error("%s error de conexión: %s", worker_name, e)
             try:
                 conn.send(
                     self._build_response(
@@ -1138,7 +1696,10 @@ class Peer:
                 pass
         except Exception as e:
             logger.error(
-                f"{worker_name} error en transferencia de archivo: {e}", exc_info=True
+                "%s error en transferencia de archivo: %s",
+                worker_name,
+                e,
+                exc_info=True,
             )
             try:
                 conn.send(
@@ -1147,59 +1708,345 @@ class Peer:
             except:
                 pass
         finally:
-            conn.close()
-            logger.debug(f"{worker_name} conexión TCP cerrada")
-
-    def _cleanup_conversation_locks(self):
-        """Limpia locks de conversaciones antiguas"""
-        with self._conversation_locks_lock:
-            if len(self._conversation_locks) > 100:
-                keys_to_remove = random.sample(
-                    list(self._conversation_locks.keys()),
-                    len(self._conversation_locks) - 50,
+            if writer:
+                writer.abort()
+            if transfer:
+                self._incoming_transfers.fail_if_pending(
+                    transfer, "Transferencia interrumpida"
                 )
-                for key in keys_to_remove:
-                    del self._conversation_locks[key]
+                self._count_transfer(transfer)
 
-    def _message_worker(self):
-        """Procesa mensajes de la cola"""
+        return False
+
+    def _receive_archive(self, conn, transfer, peer_id):
+        """Recibe un envío de varios archivos y reconstruye el árbol de directorios.
+
+        El flujo TCP contiene el manifiesto seguido del contenido de cada archivo
+        en el mismo orden. Los archivos se escriben en un directorio temporal de
+        download_dir que se renombra al final, así un envío interrumpido no deja
+        un árbol a medias. Si el header anuncia una raíz de Merkle, se verifica
+        el flujo completo y se reparan los chunks corruptos como en un archivo.
+
+        Returns:
+            bool: True si terminó con OK
+        """
         worker_name = threading.current_thread().name
 
-        while True:
-            try:
-                task = self.message_queue.get()
-                header = task["header"]
-                addr = task["addr"]
+        try:
+            prefix = self._recv_exact(conn, 4)
+            manifest = prefix + self._recv_exact(conn, manifest_length(prefix))
+            name, files = parse_manifest(manifest[4:])
+        except ValueError as e:
+            logger.error("%s manifiesto inválido de %s: %s", worker_name, peer_id, e)
+            conn.send(self._build_response(RESPONSE_BAD_REQUEST, str(e)))
+            return False
 
-                logger.info(
-                    f"{worker_name} procesando tarea de tipo '{task['type']}' de {header['user_from']} ({addr[0]}:{addr[1]})"
+        received = len(manifest)
+        total_size = received + sum(size for _, size in files)
+        if total_size != transfer.file_size:
+            logger.error(
+                "%s el manifiesto de %s no coincide con el tamaño anunciado: %s != %s",
+                worker_name,
+                peer_id,
+                total_size,
+                transfer.file_size,
+            )
+            conn.send(
+                self._build_response(
+                    RESPONSE_BAD_REQUEST, "Manifiesto inconsistente con el header"
                 )
+            )
+            return False
 
-                start_time = time.time()
+        logger.info(
+            "%s recibiendo '%s' de %s: %s archivos, %s bytes",
+            worker_name,
+            name,
+            peer_id,
+            len(files),
+            total_size,
+        )
 
-                if task["type"] == "message":
-                    logger.info(
-                        f"{worker_name} procesando mensaje de {header['user_from']}"
+        staging = os.path.join(
+            self.download_dir, f".{name}.{threading.get_ident()}.part"
+        )
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        transfer.bytes_done = received
+        verifier = None
+        if transfer.info.get("root_hash"):
+            verifier = ChunkVerifier(transfer.info["root_hash"], total_size)
+            verifier.update(manifest)
+        paths = [os.path.join(staging, relative) for relative, _ in files]
+        writer = None
+        try:
+            for path, (relative, size) in zip(paths, files):
+                # Un único escritor (hilo y buffers) para todos los archivos, que
+                # además calcula los hashes del flujo en orden
+                if writer is None:
+                    writer = BackgroundFileWriter(
+                        path, fsync_policy=self.fsync_policy, hasher=verifier
                     )
-                    self._process_message(header, addr)
-
-                elif task["type"] == "file":
-                    logger.info(
-                        f"{worker_name} procesando solicitud de archivo de {header['user_from']}"
+                else:
+                    writer.next_file(path)
+                remaining = size
+                while remaining:
+                    buffer = writer.acquire_buffer()
+                    filled = self._recv_into_buffer(conn, buffer, remaining)
+                    if not filled:
+                        writer.release_buffer(buffer)
+                        raise ConnectionError(
+                            f"Conexión cerrada recibiendo '{relative}'"
+                        )
+                    writer.submit(buffer, filled)
+                    remaining -= filled
+                    received += filled
+                    transfer.bytes_done = received
+            if writer:
+                writer.finish()
+                writer = None
+
+            self._incoming_transfers.transition(transfer, VERIFYING)
+            if verifier and not verifier.root_matches():
+                patcher = ArchivePatcher(manifest, paths, [size for _, size in files])
+                if not self._repair_corrupt_chunks(conn, patcher, verifier):
+                    logger.error(
+                        "%s no se pudo reparar '%s' de %s tras %s rondas",
+                        worker_name,
+                        name,
+                        peer_id,
+                        MAX_REPAIR_ROUNDS,
                     )
-                    self._process_file_request(header, addr)
-
-                process_time = time.time() - start_time
-                logger.info(
-                    f"{worker_name} completó procesamiento en {process_time:.3f} segundos"
+                    conn.send(
+                        self._build_response(
+                            RESPONSE_BAD_REQUEST, "Chunks corruptos sin reparar"
+                        )
+                    )
+                    shutil.rmtree(staging, ignore_errors=True)
+                    return False
+                logger.info("%s '%s' de %s reparado", worker_name, name, peer_id)
+
+            final_root = reserve_path(
+                os.path.join(self.download_dir, name), directory=True
+            )
+            if os.name == "nt":
+                # En Windows os.replace no sustituye directorios
+                os.rmdir(final_root)
+            os.replace(staging, final_root)
+        except Exception:
+            if writer:
+                writer.abort()
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        transfer.info["file_path"] = final_root
+        self._incoming_transfers.transition(transfer, COMPLETED)
+        logger.info(
+            "%s '%s' recibido de %s: %s archivos en %s",
+            worker_name,
+            name,
+            peer_id,
+            len(files),
+            final_root,
+        )
+
+        self._events.publish("file", peer_id, final_root)
+
+        conn.send(self._build_response(RESPONSE_OK))
+        return True
+
+    def _repair_corrupt_chunks(self, conn, writer, verifier):
+        """Solicita al emisor el reenvío de los chunks cuyo hash no coincide.
+
+        Tras avisar con RESPONSE_CHUNKS_CORRUPT, el emisor envía su tabla de hojas;
+        se comparan con las calculadas durante la recepción y se piden únicamente
+        los chunks que difieren.
+
+        Args:
+            conn: Socket TCP de la transferencia
+            writer: BackgroundFileWriter del archivo que se va a reparar (o un
+                ArchivePatcher con los archivos de un envío)
+            verifier: ChunkVerifier con las hojas calculadas durante la recepción
+
+        Returns:
+            bool: True si tras la reparación todos los chunks coinciden
+        """
+        worker_name = threading.current_thread().name
+
+        conn.send(
+            self._build_response(RESPONSE_CHUNKS_CORRUPT, "Raíz de Merkle no coincide")
+        )
+
+        leaf_count = int.from_bytes(self._recv_exact(conn, 4), "big")
+        if leaf_count != chunk_count(verifier.total_size, verifier.chunk_size):
+            raise ValueError(f"Tabla de hojas con tamaño inválido: {leaf_count}")
+        remote_leaves = decode_leaves(
+            leaf_count, self._recv_exact(conn, leaf_count * ROOT_HASH_SIZE)
+        )
+        corrupt = verifier.find_corrupt_chunks(remote_leaves)
+
+        for attempt in range(1, MAX_REPAIR_ROUNDS + 1):
+            logger.warning(
+                "%s %s chunks corruptos, solicitando reenvío (ronda %s/%s)",
+                worker_name,
+                len(corrupt),
+                attempt,
+                MAX_REPAIR_ROUNDS,
+            )
+            conn.sendall(
+                len(corrupt).to_bytes(4, "big")
+                + b"".join(index.to_bytes(4, "big") for index in corrupt)
+            )
+
+            pending = set(corrupt)
+            still_corrupt = []
+            for _ in corrupt:
+                index = int.from_bytes(self._recv_exact(conn, 4), "big")
+                if index not in pending:
+                    raise ValueError(f"Chunk no solicitado recibido: {index}")
+                pending.discard(index)
+
+                data = self._recv_exact(conn, verifier.chunk_length(index))
+                writer.write_at(index * verifier.chunk_size, data)
+                if not verifier.replace_chunk(index, data, remote_leaves):
+                    still_corrupt.append(index)
+
+            writer.drain()
+            corrupt = still_corrupt
+            if not corrupt:
+                return True
+
+            if attempt < MAX_REPAIR_ROUNDS:
+                conn.send(
+                    self._build_response(
+                        RESPONSE_CHUNKS_CORRUPT, "Chunks aún corruptos"
+                    )
+                )
+
+        return False
+
+    def _recv_into_buffer(self, conn, buffer, max_bytes):
+        """Llena un buffer con hasta max_bytes leídos del socket
+
+        Returns:
+            int: Bytes leídos (menos que el buffer solo si la conexión se cerró)
+        """
+        view = memoryview(buffer)[: min(len(buffer), max_bytes)]
+        filled = 0
+        while filled < len(view):
+            received = conn.recv_into(view[filled:])
+            if not received:
+                break
+            filled += received
+        return filled
+
+    def _recv_exact(self, conn, size):
+        """Lee exactamente size bytes de un socket TCP
+
+        Raises:
+            ConnectionError: Si la conexión se cierra antes de completar la lectura
+        """
+        buffer = bytearray()
+        while len(buffer) < size:
+            data = conn.recv(size - len(buffer))
+            if not data:
+                raise ConnectionError(
+                    f"Conexión cerrada: esperados {size} bytes, recibidos {len(buffer)}"
+                )
+            buffer.extend(data)
+        return bytes(buffer)
+
+    def _purge_stale_bodies(self, max_age=30):
+        """Elimina las esperas de cuerpo de mensaje que nadie retiró
+
+        Cada espera se borra al recibir el cuerpo o al agotar su timeout; si el
+        hilo que la registró falla entre medias, la entrada quedaría para siempre.
+        """
+        cutoff = time.time() - max_age
+        with self._expected_bodies_lock:
+            stale = [
+                key
+                for key, entry in self._expected_message_bodies.items()
+                if entry["timestamp"] < cutoff
+            ]
+            for key in stale:
+                del self._expected_message_bodies[key]
+        if stale:
+            logger.warning(
+                f"{len(stale)} esperas de cuerpo de mensaje huérfanas eliminadas"
+            )
+        return len(stale)
+
+    def _cleanup_conversation_locks(self):
+        """Limpia locks de conversaciones antiguas"""
+        with self._conversation_locks_lock:
+            if len(self._conversation_locks) > 100:
+                keys_to_remove = random.sample(
+                    list(self._conversation_locks.keys()),
+                    len(self._conversation_locks) - 50,
+                )
+                for key in keys_to_remove:
+                    del self._conversation_locks[key]
+
+    def _message_worker(self):
+        """Procesa mensajes de la cola"""
+        worker_name = threading.current_thread().name
+
+        while True:
+            try:
+                task = self.message_queue.get()
+                header = task["header"]
+                addr = task["addr"]
+                self._watchdog.busy("%s de %s", task["type"], header["user_from"])
+
+                message_logger.info(
+                    "%s procesando tarea de tipo '%s' de %s (%s:%s)",
+                    worker_name,
+                    task["type"],
+                    header["user_from"],
+                    addr[0],
+                    addr[1],
+                )
+
+                start_time = time.perf_counter()
+
+                if task["type"] == "message":
+                    message_logger.info(
+                        "%s procesando mensaje de %s", worker_name, header["user_from"]
+                    )
+                    with self._tracer.operation(
+                        "process_message", peer=header["user_from"]
+                    ):
+                        self._process_message(header, addr)
+
+                elif task["type"] == "file":
+                    message_logger.info(
+                        "%s procesando solicitud de archivo de %s",
+                        worker_name,
+                        header["user_from"],
+                    )
+                    with self._tracer.operation(
+                        "process_file_request", peer=header["user_from"]
+                    ):
+                        self._process_file_request(header, addr)
+
+                process_time = time.perf_counter() - start_time
+                self._m_task_time.labels(task["type"]).observe(process_time)
+                message_logger.info(
+                    "%s completó procesamiento en %.3f segundos",
+                    worker_name,
+                    process_time,
                 )
 
             except Exception as e:
-                logger.error(f"{worker_name} error: {e}")
+                message_logger.error("%s error: %s", worker_name, e)
             finally:
+                self._watchdog.idle()
                 self.message_queue.task_done()
-                logger.debug(
-                    f"{worker_name} listo para siguiente tarea. Cola: aprox. {self.message_queue.qsize()} pendientes"
+                message_logger.debug(
+                    "%s listo para siguiente tarea. Cola: aprox. %s pendientes",
+                    worker_name,
+                    self.message_queue.qsize(),
                 )
 
     def _file_send_worker(self):
@@ -1207,191 +2054,250 @@ class Peer:
         worker_name = threading.current_thread().name
 
         while True:
+            # Bloquea hasta que haya tarea y hueco bajo max_concurrent_transfers
+            task = self.file_send_queue.get()
             try:
-                task = self.file_send_queue.get()
                 user_to = task["user_to"]
                 file_path = task["file_path"]
+                self._watchdog.busy("envío de '%s' a %s", file_path, user_to)
 
                 logger.info(
-                    f"{worker_name} procesando envío de archivo '{file_path}' a {user_to}"
+                    "%s procesando envío de archivo '%s' a %s (%s/%s activas)",
+                    worker_name,
+                    file_path,
+                    user_to,
+                    self.file_send_queue.active,
+                    self.file_send_queue.max_concurrent,
                 )
 
                 start_time = time.time()
 
-                with self._transfers_lock:
-                    if self.active_file_transfers >= self.max_concurrent_transfers:
-                        logger.warning(
-                            f"{worker_name} alcanzó límite de transferencias concurrentes ({self.max_concurrent_transfers})"
-                        )
-                        self.file_send_queue.put(task)
-                        time.sleep(1)
-                        self.file_send_queue.task_done()
-                        continue
-
-                    self.active_file_transfers += 1
-                    logger.info(
-                        f"{worker_name} inicia transferencia ({self.active_file_transfers}/{self.max_concurrent_transfers} activas)"
-                    )
-
                 try:
-                    success = self._send_file(user_to, file_path)
+                    if "entries" in task:
+                        with self._tracer.operation(
+                            "send_archive", peer=user_to, path=file_path
+                        ):
+                            success = self._send_archive(
+                                user_to, file_path, task["name"], task["entries"]
+                            )
+                    else:
+                        with self._tracer.operation(
+                            "send_file", peer=user_to, path=file_path
+                        ):
+                            success = self._send_file(user_to, file_path)
 
                     if success:
                         logger.info(
-                            f"{worker_name} archivo enviado exitosamente a {user_to}"
+                            "%s archivo enviado exitosamente a %s", worker_name, user_to
+                        )
+                        self._events.publish(
+                            "file_progress", user_to, file_path, 100, "completado"
                         )
-                        with self._callback_lock:
-                            for callback in self.file_progress_callbacks:
-                                callback(
-                                    user_to, file_path, 100, "completado"
-                                )  # 100% completado
                     else:
                         logger.error(
-                            f"{worker_name} error enviando archivo a {user_to}"
+                            "%s error enviando archivo a %s", worker_name, user_to
+                        )
+                        self._events.publish(
+                            "file_progress", user_to, file_path, -1, "error"
                         )
-                        with self._callback_lock:
-                            for callback in self.file_progress_callbacks:
-                                callback(
-                                    user_to, file_path, -1, "error"
-                                )  # -1 indica error
 
                 finally:
-                    with self._transfers_lock:
-                        self.active_file_transfers -= 1
-                        logger.info(
-                            f"{worker_name} finaliza transferencia ({self.active_file_transfers}/{self.max_concurrent_transfers} activas)"
-                        )
+                    logger.info("%s finaliza transferencia", worker_name)
 
                 process_time = time.time() - start_time
                 logger.info(
-                    f"{worker_name} completó procesamiento en {process_time:.3f} segundos"
+                    "%s completó procesamiento en %.3f segundos",
+                    worker_name,
+                    process_time,
                 )
 
             except Exception as e:
-                logger.error(f"{worker_name} error: {e}", exc_info=True)
+                logger.error("%s error: %s", worker_name, e, exc_info=True)
             finally:
-                self.file_send_queue.task_done()
+                self._watchdog.idle()
+                self.file_send_queue.release()
                 logger.debug(
-                    f"{worker_name} listo para siguiente tarea. Cola: aprox. {self.file_send_queue.qsize()} pendientes"
+                    "%s listo para siguiente tarea. Cola: aprox. %s pendientes",
+                    worker_name,
+                    self.file_send_queue.qsize(),
                 )
 
     def send_message(self, user_to, message):
         """Envía un mensaje a otro peer"""
-        logger.info(f"Intentando enviar mensaje a '{user_to}': {message[:50]}...")
+        with self._tracer.operation("send_message", peer=user_to):
+            return self._send_message(user_to, message)
+
+    def _send_message(self, user_to, message):
+        message_logger.info(
+            "Intentando enviar mensaje a '%s': %.50s...", user_to, message
+        )
 
         found_peer = None
         peer_addr = None
 
-        with self._peers_lock:
+        with self._tracer.span("resolve_peer"), self._peers_lock:
             normalized_to = self._normalize_user_id(user_to)
 
             for peer_id, (ip, _) in self.peers.items():
                 if self._normalize_user_id(peer_id) == normalized_to:
                     found_peer = peer_id
-                    peer_addr = (ip, 9990)
+                    peer_addr = (ip, self._transport.udp_port)
                     break
 
             if not found_peer:
-                logger.error(
-                    f"No se puede enviar mensaje: peer '{user_to}' no encontrado"
+                message_logger.error(
+                    "No se puede enviar mensaje: peer '%s' no encontrado", user_to
                 )
                 return False
 
-            logger.info(
-                f"Peer '{user_to}' encontrado como '{found_peer}' en {peer_addr[0]}:{peer_addr[1]}"
+            message_logger.info(
+                "Peer '%s' encontrado como '%s' en %s:%s",
+                user_to,
+                found_peer,
+                peer_addr[0],
+                peer_addr[1],
             )
 
         message_id = int(time.time() * 1000) % 256
         message_bytes = message.encode("utf-8")
         expected_user_id = found_peer.encode("utf-8").ljust(20)[:20]
+        self._bandwidth.note_chat_activity()
 
         with self._conversation_locks_lock:
             if found_peer not in self._conversation_locks:
-                logger.debug(
-                    f"Creando nuevo lock de conversación para envío a {found_peer}"
+                message_logger.debug(
+                    "Creando nuevo lock de conversación para envío a %s", found_peer
                 )
                 self._conversation_locks[found_peer] = threading.Lock()
             user_lock = self._conversation_locks[found_peer]
 
+        span = self._tracer.begin("conversation_lock_wait")
         with user_lock:
-            logger.debug(f"Adquirido lock de conversación para envío a {found_peer}")
-            with socket.socket(
-                socket.AF_INET, socket.SOCK_DGRAM
-            ) as conversation_socket:
-                conversation_socket.bind(("0.0.0.0", 0))
+            span.end()
+            message_logger.debug(
+                "Adquirido lock de conversación para envío a %s", found_peer
+            )
+            # Con el lock tomado los envíos a un peer salen en orden de ordinal
+            ordinal = self._allocate_ordinal(found_peer)
+            with self._transport.udp_socket() as conversation_socket:
                 conversation_socket.settimeout(5)
                 local_port = conversation_socket.getsockname()[1]
-                logger.debug(
-                    f"Socket temporal creado en puerto {local_port} para conversación con {found_peer}"
+                message_logger.debug(
+                    "Socket temporal creado en puerto %s para conversación con %s",
+                    local_port,
+                    found_peer,
                 )
 
                 try:
                     # Fase 1: Enviar header
                     header = self._build_header(
-                        found_peer, MESSAGE, message_id, len(message_bytes)
+                        found_peer,
+                        MESSAGE,
+                        message_id,
+                        len(message_bytes),
+                        ordinal=ordinal,
                     )
-                    logger.info(
-                        f"FASE 1: Enviando header LCP a {peer_addr[0]}:{peer_addr[1]} desde puerto {local_port}"
+                    message_logger.info(
+                        "FASE 1: Enviando header LCP a %s:%s desde puerto %s",
+                        peer_addr[0],
+                        peer_addr[1],
+                        local_port,
                     )
 
+                    started = time.perf_counter()
+                    span = self._tracer.begin("header_roundtrip")
                     conversation_socket.sendto(header, peer_addr)
-                    logger.debug(f"Header enviado, esperando respuesta (timeout: 5s)")
+                    self._count_sent(header)
+                    message_logger.debug(
+                        "Header enviado, esperando respuesta (timeout: 5s)"
+                    )
 
                     resp_data, resp_addr = conversation_socket.recvfrom(25)
-                    logger.debug(
-                        f"Respuesta recibida desde {resp_addr[0]}:{resp_addr[1]} ({len(resp_data)} bytes)"
+                    header_acked = time.perf_counter()
+                    span.end(status=resp_data[0])
+                    self._m_handshake.labels("header").observe(header_acked - started)
+                    message_logger.debug(
+                        "Respuesta recibida desde %s:%s (%s bytes)",
+                        resp_addr[0],
+                        resp_addr[1],
+                        len(resp_data),
                     )
 
                     if resp_data[0] != 0:
-                        logger.error(
-                            f"Respuesta negativa recibida: status={resp_data[0]}"
+                        message_logger.error(
+                            "Respuesta negativa recibida: status=%s", resp_data[0]
                         )
                         return False
 
-                    logger.info(f"FASE 1 completada: header aceptado por {found_peer}")
+                    message_logger.info(
+                        "FASE 1 completada: header aceptado por %s", found_peer
+                    )
 
                     # Fase 2: Enviar cuerpo del mensaje
                     body = message_id.to_bytes(8, "big") + message_bytes
-                    logger.info(
-                        f"FASE 2: Enviando cuerpo del mensaje a {peer_addr[0]}:{peer_addr[1]} ({len(body)} bytes) desde puerto {local_port}"
+                    message_logger.info(
+                        "FASE 2: Enviando cuerpo del mensaje a %s:%s (%s bytes) desde puerto %s",
+                        peer_addr[0],
+                        peer_addr[1],
+                        len(body),
+                        local_port,
                     )
 
+                    span = self._tracer.begin("body_roundtrip", bytes=len(body))
                     conversation_socket.sendto(body, peer_addr)
-                    logger.debug(
-                        f"Cuerpo enviado, esperando confirmación final (timeout: 5s)"
+                    self._count_sent(body)
+                    message_logger.debug(
+                        "Cuerpo enviado, esperando confirmación final (timeout: 5s)"
                     )
 
                     resp_data, resp_addr = conversation_socket.recvfrom(25)
-                    logger.debug(
-                        f"Confirmación recibida desde {resp_addr[0]}:{resp_addr[1]}"
+                    finished = time.perf_counter()
+                    span.end(status=resp_data[0])
+                    self._m_handshake.labels("body").observe(finished - header_acked)
+                    self._m_handshake.labels("total").observe(finished - started)
+                    message_logger.debug(
+                        "Confirmación recibida desde %s:%s", resp_addr[0], resp_addr[1]
                     )
 
                     if resp_data[0] == 0:
-                        logger.info(
-                            f"FASE 2 completada: mensaje entregado exitosamente a {found_peer}"
+                        message_logger.info(
+                            "FASE 2 completada: mensaje entregado exitosamente a %s",
+                            found_peer,
                         )
+                        self._m_messages_sent.inc()
                         # Almacenar el mensaje enviado en el historial
-                        self._store_message_in_history(
-                            found_peer, message, is_outgoing=True
-                        )
+                        with self._tracer.span("store_history"):
+                            self._store_message_in_history(
+                                found_peer, message, is_outgoing=True, ordinal=ordinal
+                            )
                     else:
-                        logger.error(
-                            f"Error en confirmación final: status={resp_data[0]}"
+                        message_logger.error(
+                            "Error en confirmación final: status=%s", resp_data[0]
                         )
 
                     return resp_data[0] == 0
 
                 except socket.timeout:
-                    logger.error(f"Timeout esperando respuesta de {found_peer}")
+                    message_logger.error(
+                        "Timeout esperando respuesta de %s", found_peer
+                    )
+                    self._m_timeouts.labels("send_message").inc()
                     return False
                 except Exception as e:
-                    logger.error(
-                        f"Error enviando mensaje a {found_peer}: {e}", exc_info=True
+                    message_logger.error(
+                        "Error enviando mensaje a %s: %s", found_peer, e, exc_info=True
                     )
                     return False
 
-    def send_file(self, user_to, file_path):
-        """Envía un archivo a otro peer"""
+    def send_file(self, user_to, file_path, priority=None):
+        """Envía un archivo a otro peer
+
+        Args:
+            user_to: ID del peer destino
+            file_path: Ruta del archivo
+            priority: INTERACTIVE o BULK (utils.scheduler); por defecto se decide
+                según el tamaño del archivo
+        """
         logger.info(f"Intentando enviar archivo '{file_path}' a '{user_to}'")
 
         found_peer = None
@@ -1403,7 +2309,7 @@ class Peer:
             for peer_id, (ip, _) in self.peers.items():
                 if self._normalize_user_id(peer_id) == normalized_to:
                     found_peer = peer_id
-                    peer_addr = (ip, UDP_PORT)
+                    peer_addr = (ip, self._transport.udp_port)
                     break
 
         if not found_peer:
@@ -1418,13 +2324,241 @@ class Peer:
             logger.error(f"No se puede enviar archivo: '{file_path}' no existe")
             return False
 
-        self.file_send_queue.put({"user_to": found_peer, "file_path": file_path})
+        self.file_send_queue.put(
+            {"user_to": found_peer, "file_path": file_path},
+            size=os.path.getsize(file_path),
+            priority=priority,
+        )
         logger.info(f"Archivo '{file_path}' añadido a la cola de envío")
         return True
 
+    def send_files(self, user_to, file_paths, name="archivos", priority=None):
+        """Envía varios archivos o directorios a otro peer en una sola sesión TCP
+
+        Args:
+            user_to: ID del peer destino
+            file_paths: Rutas de archivos o directorios
+            name: Nombre de la carpeta que se creará en el receptor
+            priority: INTERACTIVE o BULK (utils.scheduler); por defecto se decide
+                según el tamaño total
+        """
+        try:
+            entries = collect_files(file_paths)
+        except ValueError as e:
+            logger.error(f"No se pueden enviar archivos: {e}")
+            return False
+        return self._queue_archive(user_to, name, name, entries, priority)
+
+    def send_directory(self, user_to, dir_path, priority=None):
+        """Envía un directorio completo a otro peer en una sola sesión TCP
+
+        Args:
+            user_to: ID del peer destino
+            dir_path: Ruta del directorio
+            priority: INTERACTIVE o BULK (utils.scheduler); por defecto se decide
+                según el tamaño total
+        """
+        if not os.path.isdir(dir_path):
+            logger.error(f"No se puede enviar directorio: '{dir_path}' no existe")
+            return False
+        name = os.path.basename(os.path.normpath(dir_path))
+        return self._queue_archive(
+            user_to, dir_path, name, collect_directory(dir_path), priority
+        )
+
+    def _queue_archive(self, user_to, label, name, entries, priority):
+        """Encola un envío de varios archivos como una única tarea"""
+        found_peer, _ = self._resolve_peer(user_to)
+        if not found_peer:
+            logger.error(
+                "No se puede enviar '%s': peer '%s' no encontrado", label, user_to
+            )
+            return False
+
+        if not entries:
+            logger.error("No se puede enviar '%s': no contiene archivos", label)
+            return False
+
+        self.file_send_queue.put(
+            {
+                "user_to": found_peer,
+                "file_path": label,
+                "name": name,
+                "entries": entries,
+            },
+            size=sum(os.path.getsize(local) for local, _ in entries),
+            priority=priority,
+        )
+        logger.info(
+            "'%s' (%s archivos) añadido a la cola de envío para %s",
+            label,
+            len(entries),
+            found_peer,
+        )
+        return True
+
+    def _resolve_peer(self, user_to):
+        """Busca un peer conocido por su ID normalizado
+
+        Returns:
+            Tuple[str, tuple]: (ID del peer, dirección UDP) o (None, None)
+        """
+        with self._peers_lock:
+            normalized_to = self._normalize_user_id(user_to)
+            for peer_id, (ip, _) in self.peers.items():
+                if self._normalize_user_id(peer_id) == normalized_to:
+                    return peer_id, (ip, self._transport.udp_port)
+        return None, None
+
+    def _send_archive(self, user_to, label, name, entries):
+        """Envía un manifiesto seguido del contenido de varios archivos por una
+        única conexión TCP.
+
+        Los archivos pequeños se agrupan en bloques de FILE_CHUNK_SIZE antes de
+        enviarse, de modo que miles de archivos no generan miles de escrituras
+        en el socket. El header anuncia la raíz de Merkle del flujo completo
+        (manifiesto y archivos), así que el receptor lo verifica y repara igual
+        que un archivo suelto.
+        """
+        worker_name = threading.current_thread().name
+        found_peer, peer_addr = self._resolve_peer(user_to)
+        if not found_peer:
+            logger.error(
+                "No se puede enviar '%s': peer '%s' no encontrado en el momento de envío",
+                label,
+                user_to,
+            )
+            return False
+
+        manifest, sizes = build_manifest(name, entries)
+        total_size = len(manifest) + sum(sizes)
+
+        try:
+            transfer = self._outgoing_transfers.create(
+                peer_addr[0],
+                user_id=found_peer,
+                file_size=total_size,
+                file_path=label,
+                files=len(entries),
+            )
+        except ValueError as e:
+            logger.error("%s no se puede enviar '%s': %s", worker_name, label, e)
+            return False
+        file_id = transfer.file_id
+        flow = self._bandwidth.open_flow(peer_addr[0])
+
+        self._events.publish("file_progress", found_peer, label, 0, "iniciando")
+
+        logger.info(
+            "%s enviando '%s' a %s: %s archivos, %s bytes (file_id: %s)",
+            worker_name,
+            label,
+            found_peer,
+            len(entries),
+            total_size,
+            file_id,
+        )
+
+        try:
+            paths = [local for local, _ in entries]
+            with self._tracer.span("merkle_tree", bytes=total_size):
+                leaves, root_hash = build_archive_tree(manifest, paths, sizes)
+            header = self._build_header(
+                found_peer,
+                2,
+                file_id,
+                total_size,
+                flags=FLAG_ARCHIVE | FLAG_INTEGRITY,
+                root_hash=root_hash,
+            )
+            with self._udp_socket_lock:
+                self.udp_socket.sendto(header, peer_addr)
+                self._count_sent(header)
+
+            with self._connection_pool.connection(peer_addr[0]) as s:
+                self._outgoing_transfers.transition(transfer, ACTIVE)
+                s.sendall(file_id.to_bytes(8, "big") + manifest)
+
+                bytes_enviados = len(manifest)
+                pending = bytearray()
+                for index, ((local, relative), size) in enumerate(zip(entries, sizes)):
+                    remaining = size
+                    with open(local, "rb") as f:
+                        while remaining:
+                            data = f.read(min(FILE_CHUNK_SIZE, remaining))
+                            if not data:
+                                raise ValueError(
+                                    f"'{relative}' cambió de tamaño durante el envío"
+                                )
+                            pending += data
+                            remaining -= len(data)
+
+                            last_file = index == len(entries) - 1 and not remaining
+                            if len(pending) < FILE_CHUNK_SIZE and not last_file:
+                                continue
+
+                            self._bandwidth.throttle(flow, len(pending))
+                            s.sendall(pending)
+                            bytes_enviados += len(pending)
+                            transfer.bytes_done = bytes_enviados
+                            self._watchdog.heartbeat()
+                            pending = bytearray()
+
+                if pending:
+                    # Los últimos archivos estaban vacíos
+                    self._bandwidth.throttle(flow, len(pending))
+                    s.sendall(pending)
+                    transfer.bytes_done = bytes_enviados + len(pending)
+
+                logger.info(
+                    "%s '%s' enviado a %s, esperando confirmación",
+                    worker_name,
+                    label,
+                    found_peer,
+                )
+                self._outgoing_transfers.transition(transfer, VERIFYING)
+                resp_data = self._recv_exact(s, RESPONSE_SIZE)
+                resp_data = self._resend_corrupt_chunks(
+                    s, ArchiveReader(manifest, paths, sizes), leaves, resp_data, flow
+                )
+                if resp_data[0] == RESPONSE_OK:
+                    self._connection_pool.mark_reusable(s)
+
+            if resp_data[0] == RESPONSE_OK:
+                self._outgoing_transfers.transition(transfer, COMPLETED)
+                logger.info("%s '%s' entregado a %s", worker_name, label, found_peer)
+                return True
+
+            self._outgoing_transfers.transition(
+                transfer, FAILED, f"Respuesta final: status={resp_data[0]}"
+            )
+            logger.error(
+                "%s %s rechazó '%s': status=%s",
+                worker_name,
+                found_peer,
+                label,
+                resp_data[0],
+            )
+            return False
+
+        except Exception as e:
+            logger.error(
+                "%s error enviando '%s' a %s: %s",
+                worker_name,
+                label,
+                found_peer,
+                e,
+                exc_info=True,
+            )
+            self._events.publish("file_progress", found_peer, label, 0, "error")
+            return False
+        finally:
+            self._outgoing_transfers.fail_if_pending(transfer, "Envío interrumpido")
+            self._count_transfer(transfer)
+            self._bandwidth.close_flow(flow)
+
     def _send_file(self, user_to, file_path):
         """Realiza el envío de un archivo a otro peer"""
-        file_id = int(time.time() * 1000) % 256
         file_size = os.path.getsize(file_path)
 
         found_peer = None
@@ -1436,132 +2570,238 @@ class Peer:
             for peer_id, (ip, _) in self.peers.items():
                 if self._normalize_user_id(peer_id) == normalized_to:
                     found_peer = peer_id
-                    peer_addr = (ip, UDP_PORT)
+                    peer_addr = (ip, self._transport.udp_port)
                     break
 
         if not found_peer or not peer_addr:
             logger.error(
-                f"No se puede enviar archivo: peer '{user_to}' no encontrado en el momento de envío"
+                "No se puede enviar archivo: peer '%s' no encontrado en el momento de envío",
+                user_to,
             )
             return False
 
         worker_name = threading.current_thread().name
 
-        with self._callback_lock:
-            for callback in self.file_progress_callbacks:
-                callback(user_to, file_path, 0, "iniciando")
+        try:
+            transfer = self._outgoing_transfers.create(
+                peer_addr[0],
+                user_id=found_peer,
+                file_size=file_size,
+                file_path=file_path,
+            )
+        except ValueError as e:
+            logger.error("%s no se puede enviar archivo: %s", worker_name, e)
+            return False
+        file_id = transfer.file_id
+        flow = self._bandwidth.open_flow(peer_addr[0])
+
+        self._events.publish("file_progress", user_to, file_path, 0, "iniciando")
 
         logger.info(
-            f"{worker_name} enviando archivo a {user_to}: '{file_path}' (file_id: {file_id}, tamaño: {file_size} bytes)"
+            "%s enviando archivo a %s: '%s' (file_id: %s, tamaño: %s bytes)",
+            worker_name,
+            user_to,
+            file_path,
+            file_id,
+            file_size,
         )
 
         try:
+            # La raíz se anuncia en el header, así que el árbol se calcula antes
+            with self._tracer.span("merkle_tree", bytes=file_size):
+                leaves, root_hash = build_file_tree(file_path)
+            logger.debug(
+                "%s árbol de Merkle calculado: %s chunks, raíz %s",
+                worker_name,
+                len(leaves),
+                root_hash.hex()[:16],
+            )
+
             # Fase 1: Enviar header
-            header = self._build_header(found_peer, 2, file_id, file_size)
+            header = self._build_header(
+                found_peer,
+                2,
+                file_id,
+                file_size,
+                flags=FLAG_INTEGRITY,
+                root_hash=root_hash,
+            )
             logger.info(
-                f"{worker_name} FASE 1: Enviando header de archivo a {peer_addr[0]}:{peer_addr[1]}"
+                "%s FASE 1: Enviando header de archivo a %s:%s",
+                worker_name,
+                peer_addr[0],
+                peer_addr[1],
             )
-            with self._udp_socket_lock:
+            with self._tracer.span("send_header"), self._udp_socket_lock:
                 self.udp_socket.sendto(header, peer_addr)
+                self._count_sent(header)
 
             logger.info(
-                f"{worker_name} FASE 1 completada: header de archivo aceptado por {found_peer}"
+                "%s FASE 1 completada: header de archivo aceptado por %s",
+                worker_name,
+                found_peer,
             )
 
             # Fase 2: Enviar archivo por TCP
             logger.info(
-                f"{worker_name} FASE 2: Iniciando transferencia TCP con {peer_addr[0]}:{peer_addr[1]}"
+                "%s FASE 2: Iniciando transferencia TCP con %s:%s",
+                worker_name,
+                peer_addr[0],
+                peer_addr[1],
             )
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            span = self._tracer.begin("connect")
+            with self._connection_pool.connection(peer_addr[0]) as s:
+                span.end()
                 logger.debug(
-                    f"{worker_name} Conectando a {peer_addr[0]}:{peer_addr[1]} para transferencia de archivo"
+                    "%s Conexión con %s lista para transferencia de archivo",
+                    worker_name,
+                    peer_addr[0],
                 )
-                s.connect(peer_addr)
+                self._outgoing_transfers.transition(transfer, ACTIVE)
 
                 # Enviar identificador de archivo
                 logger.debug(
-                    f"{worker_name} Enviando identificador de archivo: {file_id}"
+                    "%s Enviando identificador de archivo: %s", worker_name, file_id
                 )
-                s.send(file_id.to_bytes(8, "big"))
+                s.sendall(file_id.to_bytes(8, "big"))
 
                 # Transferir contenido del archivo
                 bytes_enviados = 0
+                span = self._tracer.begin("send_data", bytes=file_size)
                 with open(file_path, "rb") as f:
                     logger.info(
-                        f"{worker_name} Iniciando transferencia de datos del archivo"
+                        "%s Iniciando transferencia de datos del archivo", worker_name
                     )
-                    last_progress_update = 0
 
                     while True:
-                        chunk = f.read(4096)
+                        chunk = f.read(FILE_CHUNK_SIZE)
                         if not chunk:
                             break
-                        s.send(chunk)
+                        self._bandwidth.throttle(flow, len(chunk))
+                        s.sendall(chunk)
                         bytes_enviados += len(chunk)
-
-                        if file_size > 0:
-                            progress = min(100, int((bytes_enviados * 100) / file_size))
-
-                            if (progress - last_progress_update >= 5) or (
-                                bytes_enviados % (1024 * 1024) < 4096
-                            ):
-                                last_progress_update = progress
-                                logger.info(
-                                    f"{worker_name} Progreso: {bytes_enviados/1024:.1f} KB ({progress}%) enviados a {found_peer}"
-                                )
-                                with self._callback_lock:
-                                    for callback in self.file_progress_callbacks:
-                                        callback(
-                                            found_peer, file_path, progress, "progreso"
-                                        )
+                        # El progreso lo publica ProgressMonitor muestreando este contador
+                        transfer.bytes_done = bytes_enviados
+                        self._watchdog.heartbeat()
+                span.end()
 
                 logger.info(
-                    f"{worker_name} Transferencia completa: {bytes_enviados} bytes enviados a {found_peer}"
+                    "%s Transferencia completa: %s bytes enviados a %s",
+                    worker_name,
+                    bytes_enviados,
+                    found_peer,
                 )
 
                 logger.debug(
-                    f"{worker_name} Esperando confirmación final de transferencia"
+                    "%s Esperando confirmación final de transferencia", worker_name
                 )
-                resp_data = s.recv(25)
+                self._outgoing_transfers.transition(transfer, VERIFYING)
+                with self._tracer.span("await_confirmation"):
+                    resp_data = self._recv_exact(s, RESPONSE_SIZE)
+                    # Un archivo suelto es un flujo sin manifiesto
+                    resp_data = self._resend_corrupt_chunks(
+                        s,
+                        ArchiveReader(b"", [file_path], [file_size]),
+                        leaves,
+                        resp_data,
+                        flow,
+                    )
 
                 if resp_data[0] == 0:
+                    self._connection_pool.mark_reusable(s)
+                    self._outgoing_transfers.transition(transfer, COMPLETED)
                     logger.info(
-                        f"{worker_name} FASE 2 completada: archivo entregado exitosamente a {found_peer}"
+                        "%s FASE 2 completada: archivo entregado exitosamente a %s",
+                        worker_name,
+                        found_peer,
+                    )
+                    self._events.publish(
+                        "file_progress", found_peer, file_path, 100, "completado"
                     )
-                    with self._callback_lock:
-                        for callback in self.file_progress_callbacks:
-                            callback(found_peer, file_path, 100, "completado")
                     return True
                 else:
+                    self._outgoing_transfers.transition(
+                        transfer, FAILED, f"Respuesta final: status={resp_data[0]}"
+                    )
                     logger.error(
-                        f"{worker_name} Error en confirmación final de archivo: status={resp_data[0]}"
+                        "%s Error en confirmación final de archivo: status=%s",
+                        worker_name,
+                        resp_data[0],
                     )
                     return False
 
         except socket.timeout:
-            logger.error(f"{worker_name} Timeout esperando respuesta de {found_peer}")
-            with self._callback_lock:
-                for callback in self.file_progress_callbacks:
-                    callback(found_peer, file_path, 0, "error")
+            logger.error(
+                "%s Timeout esperando respuesta de %s", worker_name, found_peer
+            )
+            self._events.publish("file_progress", found_peer, file_path, 0, "error")
             return False
         except ConnectionError as e:
-            logger.error(f"{worker_name} Error de conexión con {found_peer}: {e}")
-            with self._callback_lock:
-                for callback in self.file_progress_callbacks:
-                    callback(found_peer, file_path, 0, "error")
+            logger.error("%s Error de conexión con %s: %s", worker_name, found_peer, e)
+            self._events.publish("file_progress", found_peer, file_path, 0, "error")
             return False
         except Exception as e:
             logger.error(
-                f"{worker_name} Error enviando archivo a {found_peer}: {e}",
+                "%s Error enviando archivo a %s: %s",
+                worker_name,
+                found_peer,
+                e,
                 exc_info=True,
             )
-            with self._callback_lock:
-                for callback in self.file_progress_callbacks:
-                    callback(found_peer, file_path, 0, "error")
+            self._events.publish("file_progress", found_peer, file_path, 0, "error")
             return False
         finally:
+            self._outgoing_transfers.fail_if_pending(transfer, "Envío interrumpido")
+            self._count_transfer(transfer)
+            self._bandwidth.close_flow(flow)
             self.udp_socket.settimeout(None)
-            logger.debug(f"{worker_name} Socket UDP restaurado a modo no bloqueante")
+            logger.debug("%s Socket UDP restaurado a modo no bloqueante", worker_name)
+
+    def _resend_corrupt_chunks(self, conn, reader, leaves, resp_data, flow):
+        """Atiende las solicitudes de reenvío de chunks del receptor.
+
+        Args:
+            conn: Socket TCP de la transferencia
+            reader: ArchiveReader con el flujo enviado
+            leaves: Hojas del árbol de Merkle del flujo
+            resp_data: Primera respuesta recibida tras enviar los datos
+            flow: Flujo del limitador de ancho de banda de la transferencia
+
+        Returns:
+            bytes: Respuesta final del receptor
+        """
+        worker_name = threading.current_thread().name
+        rounds = 0
+
+        while resp_data[0] == RESPONSE_CHUNKS_CORRUPT and rounds < MAX_REPAIR_ROUNDS:
+            if rounds == 0:
+                conn.sendall(encode_leaves(leaves))
+            rounds += 1
+
+            count = int.from_bytes(self._recv_exact(conn, 4), "big")
+            raw_indices = self._recv_exact(conn, count * 4)
+            indices = [
+                int.from_bytes(raw_indices[i : i + 4], "big")
+                for i in range(0, len(raw_indices), 4)
+            ]
+            logger.warning(
+                "%s receptor solicita reenvío de %s chunks (ronda %s/%s)",
+                worker_name,
+                count,
+                rounds,
+                MAX_REPAIR_ROUNDS,
+            )
+
+            for index in indices:
+                if index >= len(leaves):
+                    raise ValueError(f"Índice de chunk inválido: {index}")
+                data = reader.read(index * INTEGRITY_CHUNK_SIZE, INTEGRITY_CHUNK_SIZE)
+                self._bandwidth.throttle(flow, len(data))
+                conn.sendall(index.to_bytes(4, "big") + data)
+
+            resp_data = self._recv_exact(conn, RESPONSE_SIZE)
+
+        return resp_data
 
     def broadcast_message(self, message, max_retries=3, retry_delay=1.0):
         """Envía un mensaje a todos los peers con una única transmisión.
@@ -1573,19 +2813,23 @@ class Peer:
         Returns:
             bool: True si el mensaje fue enviado correctamente, False en caso de error
         """
-        logger.info(
-            f"Iniciando envío de mensaje broadcast con reintentos: {message[:50]}..."
+        message_logger.info(
+            "Iniciando envío de mensaje broadcast con reintentos: %s...", message[:50]
         )
         message_id = int(time.time() * 1000) % 256
         message_bytes = message.encode("utf-8")
-        broadcast_addresses = get_network_info()
+        broadcast_addresses = self._transport.broadcast_addresses()
+        udp_port = self._transport.udp_port
+        self._bandwidth.note_chat_activity()
 
         # Header y body que se enviarán
         header = self._build_header(None, MESSAGE, message_id, len(message_bytes))
         body = message_id.to_bytes(8, "big") + message_bytes
 
-        logger.info(
-            f"Enviando broadcast (message_id: {message_id}, tamaño: {len(message_bytes)} bytes)"
+        message_logger.info(
+            "Enviando broadcast (message_id: %s, tamaño: %s bytes)",
+            message_id,
+            len(message_bytes),
         )
 
         retry_count = 0
@@ -1594,33 +2838,40 @@ class Peer:
         while retry_count <= max_retries and not success:
 
             if retry_count > 0:
-                logger.info(
-                    f"Reintento {retry_count}/{max_retries} para mensaje broadcast..."
+                message_logger.info(
+                    "Reintento %s/%s para mensaje broadcast...",
+                    retry_count,
+                    max_retries,
                 )
 
             try:
                 # Fase 1: Enviar header con destino broadcast
-                logger.info(
-                    f"FASE 1: Enviando header LCP broadcast (intento {retry_count+1})"
+                message_logger.info(
+                    "FASE 1: Enviando header LCP broadcast (intento %s)",
+                    retry_count + 1,
                 )
                 phase1_success = False
 
                 with self._udp_socket_lock:
                     for broadcast_addr in broadcast_addresses:
                         try:
-                            self.udp_socket.sendto(header, (broadcast_addr, UDP_PORT))
-                            logger.info(
-                                f"Header broadcast enviado a {broadcast_addr}:{UDP_PORT}"
+                            self.udp_socket.sendto(header, (broadcast_addr, udp_port))
+                            self._count_sent(header)
+                            message_logger.info(
+                                "Header broadcast enviado a %s:%s",
+                                broadcast_addr,
+                                udp_port,
                             )
                             phase1_success = True
                         except Exception as e:
-                            logger.error(
-                                f"Error enviando header a {broadcast_addr}: {e}"
+                            message_logger.error(
+                                "Error enviando header a %s: %s", broadcast_addr, e
                             )
 
                     if not phase1_success:
-                        logger.error(
-                            f"No se pudo enviar el header a ninguna dirección de broadcast (intento {retry_count+1})"
+                        message_logger.error(
+                            "No se pudo enviar el header a ninguna dirección de broadcast (intento %s)",
+                            retry_count + 1,
                         )
                         retry_count += 1
                         if retry_count <= max_retries:
@@ -1628,38 +2879,46 @@ class Peer:
                         continue
 
                 # Fase 2: Enviar cuerpo del mensaje a broadcast
-                logger.info(
-                    f"FASE 2: Enviando cuerpo del mensaje broadcast ({len(body)} bytes) (intento {retry_count+1})"
+                message_logger.info(
+                    "FASE 2: Enviando cuerpo del mensaje broadcast (%s bytes) (intento %s)",
+                    len(body),
+                    retry_count + 1,
                 )
                 phase2_success = False
 
                 with self._udp_socket_lock:
                     for broadcast_addr in broadcast_addresses:
                         try:
-                            self.udp_socket.sendto(body, (broadcast_addr, UDP_PORT))
-                            logger.info(
-                                f"Cuerpo broadcast enviado a {broadcast_addr}:{UDP_PORT}"
+                            self.udp_socket.sendto(body, (broadcast_addr, udp_port))
+                            self._count_sent(body)
+                            message_logger.info(
+                                "Cuerpo broadcast enviado a %s:%s",
+                                broadcast_addr,
+                                udp_port,
                             )
                             phase2_success = True
                         except Exception as e:
-                            logger.error(
-                                f"Error enviando cuerpo a {broadcast_addr}: {e}"
+                            message_logger.error(
+                                "Error enviando cuerpo a %s: %s", broadcast_addr, e
                             )
 
                 if phase2_success:
                     success = True
                     break
                 else:
-                    logger.warning(
-                        f"Falló el envío de cuerpo del mensaje broadcast (intento {retry_count+1})"
+                    message_logger.warning(
+                        "Falló el envío de cuerpo del mensaje broadcast (intento %s)",
+                        retry_count + 1,
                     )
                     retry_count += 1
                     if retry_count <= max_retries:
                         time.sleep(retry_delay)
 
             except Exception as e:
-                logger.error(
-                    f"Error enviando mensaje broadcast (intento {retry_count+1}): {e}",
+                message_logger.error(
+                    "Error enviando mensaje broadcast (intento %s): %s",
+                    retry_count + 1,
+                    e,
                     exc_info=True,
                 )
                 retry_count += 1
@@ -1667,35 +2926,50 @@ class Peer:
                     time.sleep(retry_delay)
 
         if success:
-            logger.info(
-                f"Mensaje broadcast enviado correctamente después de {retry_count} reintentos"
+            message_logger.info(
+                "Mensaje broadcast enviado correctamente después de %s reintentos",
+                retry_count,
             )
 
             # Guardar el mensaje broadcast en el historial de cada peer conocido
             with self._peers_lock:
                 for peer_id in self.peers.keys():
-                    self._store_message_in_history(peer_id, message, is_outgoing=True)
+                    self._store_message_in_history(
+                        peer_id, message, is_outgoing=True, broadcast=True
+                    )
 
             return True
         else:
-            logger.error(
-                f"No se pudo enviar el mensaje broadcast después de {max_retries} reintentos"
+            message_logger.error(
+                "No se pudo enviar el mensaje broadcast después de %s reintentos",
+                max_retries,
             )
             return False
 
-    def register_message_callback(self, callback):
-        """Registra una función para recibir mensajes"""
-        self.message_callbacks.append(callback)
-
-    def register_file_callback(self, callback):
-        """Registra una función para recibir archivos"""
-        self.file_callbacks.append(callback)
-
-    def register_peer_discovery_callback(self, callback):
-        """Registra una función para notificar cambios en pares"""
-        self.peer_discovery_callbacks.append(callback)
-
-    def register_file_progress_callback(self, callback):
+    # Todos los callbacks se entregan a través de self._events: cada uno tiene su
+    # propia cola acotada y su hilo, así que no bloquean al hilo que publica
+    # (con 'block', como mucho block_timeout si la cola está llena).
+    # Las opciones admitidas son las de EventBus.subscribe(): maxsize, overflow
+    # ('drop_oldest', 'drop_newest' o 'block'), batch y max_batch. Con batch=True
+    # el callback recibe una lista de tuplas de argumentos por llamada.
+    # Mensajes y archivos recibidos no se pueden perder por un suscriptor lento,
+    # así que por defecto usan 'block' en lugar de 'drop_oldest'.
+
+    def register_message_callback(self, callback, **options):
+        """Registra una función para recibir mensajes (user_from, message)"""
+        options.setdefault("overflow", BLOCK)
+        return self._events.subscribe("message", callback, **options)
+
+    def register_file_callback(self, callback, **options):
+        """Registra una función para recibir archivos (user_from, file_path)"""
+        options.setdefault("overflow", BLOCK)
+        return self._events.subscribe("file", callback, **options)
+
+    def register_peer_discovery_callback(self, callback, **options):
+        """Registra una función para notificar cambios en pares (user_id, added)"""
+        return self._events.subscribe("peer", callback, **options)
+
+    def register_file_progress_callback(self, callback, **options):
         """Registra una función para recibir actualizaciones del progreso de transferencias de archivos.
         El callback debe aceptar (user_id, file_path, progress, status) donde:
         - user_id: ID del usuario remoto
@@ -1703,7 +2977,400 @@ class Peer:
         - progress: porcentaje de progreso (0-100) o -1 si hay error
         - status: cadena con el estado ('iniciando', 'progreso', 'completado', 'error')
         """
-        self.file_progress_callbacks.append(callback)
+        return self._events.subscribe("file_progress", callback, **options)
+
+    def register_progress_event_callback(self, callback, **options):
+        """Registra una función que recibe lotes de eventos de progreso.
+
+        El callback recibe una lista de diccionarios (uno por transferencia que
+        cambió, en ambas direcciones) con bytes_done, total, progress, rate
+        (bytes/s), eta (segundos o None) y state. ProgressMonitor publica como
+        máximo 10 lotes por segundo.
+        """
+        return self._events.subscribe("progress", callback, **options)
+
+    def _init_metrics(self):
+        """Crea el registro de métricas y las series que se actualizan en las
+        rutas calientes (ver stats())"""
+        self.metrics = MetricsRegistry(prefix="lcp_")
+        self._metrics_server = None
+
+        self._m_datagrams_in = self.metrics.counter(
+            "udp_datagrams_received_total", "Datagramas UDP recibidos en el puerto LCP"
+        )
+        self._m_bytes_in = self.metrics.counter(
+            "udp_bytes_received_total", "Bytes UDP recibidos en el puerto LCP"
+        )
+        self._m_datagrams_out = self.metrics.counter(
+            "udp_datagrams_sent_total", "Datagramas UDP enviados"
+        )
+        self._m_bytes_out = self.metrics.counter(
+            "udp_bytes_sent_total", "Bytes UDP enviados"
+        )
+        self._m_messages_sent = self.metrics.counter(
+            "messages_sent_total", "Mensajes entregados y confirmados por el peer"
+        )
+        self._m_messages_received = self.metrics.counter(
+            "messages_received_total", "Mensajes recibidos (sin duplicados)"
+        )
+        self._m_timeouts = self.metrics.counter(
+            "timeouts_total", "Esperas de respuesta agotadas", ("operation",)
+        )
+        self._m_handshake = self.metrics.histogram(
+            "message_handshake_seconds",
+            "Latencia del envío de mensajes por fase (header, body y total)",
+            ("phase",),
+        )
+        self._m_task_time = self.metrics.histogram(
+            "task_processing_seconds",
+            "Tiempo de procesamiento de las tareas de los workers de mensajes",
+            ("type",),
+        )
+        self._m_transfer_bytes = self.metrics.counter(
+            "file_bytes_total", "Bytes de archivos transferidos", ("direction",)
+        )
+        self._m_transfer_rate = self.metrics.gauge(
+            "file_transfer_rate_bytes",
+            "Velocidad agregada de las transferencias activas (bytes/s)",
+            ("direction",),
+        )
+        self._m_transfers_finished = self.metrics.counter(
+            "file_transfers_total",
+            "Transferencias finalizadas por dirección y estado final",
+            ("direction", "state"),
+        )
+        self.metrics.gauge(
+            "message_queue_depth",
+            "Tareas pendientes en la cola de mensajes",
+            fn=lambda: self.message_queue.qsize(),
+        )
+        self.metrics.gauge(
+            "file_send_queue_depth",
+            "Envíos de archivos en espera",
+            fn=lambda: self.file_send_queue.qsize(),
+        )
+        self.metrics.gauge(
+            "incoming_transfers_active",
+            "Transferencias entrantes sin estado final",
+            fn=lambda: len(self._incoming_transfers),
+        )
+        self.metrics.gauge(
+            "outgoing_transfers_active",
+            "Transferencias salientes sin estado final",
+            fn=lambda: len(self._outgoing_transfers),
+        )
+        self.metrics.gauge(
+            "peers_known", "Peers descubiertos", fn=lambda: len(self.peers)
+        )
+
+    def _count_sent(self, datagram):
+        self._m_datagrams_out.inc()
+        self._m_bytes_out.inc(len(datagram))
+
+    def _count_transfer(self, transfer):
+        """Suma a las métricas una transferencia que llegó a su estado final
+
+        Se llama desde el envío o la recepción al terminar, así que cuenta
+        también las que empiezan y acaban entre dos muestreos de progreso.
+        """
+        if not transfer.finished:
+            return
+        if transfer.bytes_done:
+            self._m_transfer_bytes.labels(transfer.direction).inc(transfer.bytes_done)
+        self._m_transfers_finished.labels(transfer.direction, transfer.state).inc()
+
+    def _update_transfer_metrics(self, events):
+        """Actualiza la velocidad de archivos a partir de un lote de
+        ProgressMonitor, fuera de los bucles de copia"""
+        rates = {
+            self._incoming_transfers.direction: 0.0,
+            self._outgoing_transfers.direction: 0.0,
+        }
+        for event in events:
+            if event["state"] not in (COMPLETED, FAILED, EXPIRED):
+                direction = event["direction"]
+                rates[direction] = rates.get(direction, 0.0) + event["rate"]
+        for direction, rate in rates.items():
+            self._m_transfer_rate.labels(direction).set(rate)
+
+    def stats(self):
+        """Métricas actuales del peer.
+
+        Returns:
+            dict: {métrica: valor}; las métricas con etiquetas dan un diccionario
+                por combinación de etiquetas y los histogramas un resumen con
+                count, sum y los percentiles p50, p90 y p99 estimados
+        """
+        return self.metrics.snapshot()
+
+    def start_metrics_server(self, port=9464, host="127.0.0.1"):
+        """Expone las métricas en formato Prometheus en http://host:port/metrics
+
+        Returns:
+            int: Puerto en el que escucha (útil con port=0)
+        """
+        if self._metrics_server is None:
+            self._metrics_server = MetricsServer(self.metrics, port, host)
+            self._metrics_server.start()
+        return self._metrics_server.port
+
+    def stop_metrics_server(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+    def start_tracing(self, max_spans=None):
+        """Empieza a registrar las fases de send_message, _process_message y
+        de los envíos y recepciones de archivos (ver export_trace())"""
+        self._tracer.start(max_spans)
+
+    def stop_tracing(self):
+        self._tracer.stop()
+
+    def export_trace(self, path=None, clear=False):
+        """Vuelca las fases registradas en formato de traza de Chrome/Perfetto
+
+        Args:
+            path: Archivo JSON donde escribir la traza (opcional)
+            clear: Si es True descarta los spans exportados
+
+        Returns:
+            dict: Traza con la lista traceEvents
+        """
+        trace = self._tracer.export_chrome(path)
+        if clear:
+            self._tracer.clear()
+        return trace
+
+    def start_profiler(self, interval=0.01, threads=None, merge_threads=True):
+        """Inicia el perfilador por muestreo en caliente
+
+        Args:
+            interval: Segundos entre muestras
+            threads: Prefijos de los hilos a muestrear (p. ej. ["Worker-",
+                "FileSender-", "UDP-Listener", "MainThread"]); None para todos
+            merge_threads: Agrupa los hilos de un mismo pool ('Worker-N')
+
+        Un perfil anterior se descarta al iniciar uno nuevo.
+        """
+        if self._profiler is not None:
+            self._profiler.stop()
+        self._profiler = SamplingProfiler(interval, threads, merge_threads)
+        self._profiler.start()
+
+    def stop_profiler(self, path=None):
+        """Detiene el perfilador
+
+        Args:
+            path: Archivo donde guardar las pilas en formato collapsed (opcional)
+
+        Returns:
+            str: Pilas en formato collapsed ('' si no se había iniciado)
+        """
+        if self._profiler is None:
+            return ""
+        self._profiler.stop()
+        if path:
+            self._profiler.save(path)
+        return self._profiler.collapsed()
+
+    def get_profile(self):
+        """Pilas acumuladas hasta ahora sin detener el perfilador"""
+        return self._profiler.collapsed() if self._profiler else ""
+
+    def get_profiler_stats(self):
+        """Muestras, duración y coste del perfilador (None si no se inició)"""
+        return self._profiler.stats() if self._profiler else None
+
+    def _new_lock(self, name):
+        """Lock global del peer: InstrumentedLock si se pidió instrumentarlos"""
+        if self._instrumented_locks is None:
+            return threading.Lock()
+        lock = InstrumentedLock(name)
+        self._instrumented_locks.append(lock)
+        return lock
+
+    def get_lock_contention(self, top_sites=5):
+        """Resumen de contención de los locks globales, del que más espera
+        acumula al que menos
+
+        Returns:
+            dict: {lock: {acquisitions, contended, contention_ratio, wait_total,
+                wait_p50, wait_p99, hold_total, hold_p50, hold_p99, sites}}, donde
+                sites son los puntos de código que más tiempo retienen el lock.
+                Vacío si el peer se creó sin instrument_locks
+        """
+        if self._instrumented_locks is None:
+            return {}
+        return contention_summary(self._instrumented_locks, top_sites)
+
+    def reset_lock_contention(self):
+        for lock in self._instrumented_locks or ():
+            lock.reset()
+
+    def get_memory_usage(self):
+        """Entradas y bytes aproximados de cada estructura interna del peer
+
+        Los tamaños son estimaciones (ver utils.memory.container_usage); sirven
+        para ver qué estructura crece entre dos llamadas, no como cifra exacta.
+
+        Returns:
+            dict: {estructura: {"entries": n, "bytes": estimación}} más
+                process_rss (memoria residente del proceso) y, si está activo,
+                tracemalloc ((actual, pico) en bytes)
+        """
+        with self._expected_bodies_lock:
+            expected_bodies = container_usage(self._expected_message_bodies)
+            cutoff = time.time() - 30
+            expected_bodies["stale"] = sum(
+                1
+                for entry in self._expected_message_bodies.values()
+                if entry["timestamp"] < cutoff
+            )
+        with self._conversation_locks_lock:
+            conversation_locks = container_usage(self._conversation_locks)
+        with self._peers_lock:
+            peers = container_usage(self.peers)
+        with self.message_queue.mutex:
+            message_queue = container_usage(self.message_queue.queue)
+
+        history = self._message_history.stats()
+        events = self._events.stats()
+        transfers = self.list_transfers(include_finished=True)
+        profile = self._profiler.stats() if self._profiler else {"unique_stacks": 0}
+        usage = {
+            "expected_message_bodies": expected_bodies,
+            "conversation_locks": conversation_locks,
+            "peers": peers,
+            "message_queue": message_queue,
+            "file_send_queue": {"entries": self.file_send_queue.qsize()},
+            "event_queues": {"entries": sum(s["queued"] for s in events)},
+            "message_history": {
+                "entries": history["resident_messages"],
+                "bytes": history["estimated_bytes"],
+            },
+            "history_marks": container_usage(self._history_marks),
+            "ordinal_windows": container_usage(self._ordinal_windows),
+            "next_ordinals": container_usage(self._next_ordinals),
+            "last_history_sync": container_usage(self._last_history_sync),
+            "transfers": container_usage(transfers),
+            "idle_connections": {"entries": self._connection_pool.stats()["idle"]},
+            "trace_spans": {"entries": len(self._tracer)},
+            "profile_stacks": {"entries": profile["unique_stacks"]},
+            "process_rss": process_memory(),
+        }
+        if self._allocations.active:
+            usage["tracemalloc"] = self._allocations.traced()
+        return usage
+
+    def start_allocation_tracking(self, nframes=10):
+        """Activa tracemalloc y toma la instantánea base para
+        get_allocation_diff(). Ralentiza las asignaciones mientras está activo"""
+        self._allocations.start(nframes)
+
+    def get_allocation_diff(self, top=20, group_by="lineno", rebase=False):
+        """Líneas de código cuya memoria más ha crecido desde la instantánea base
+
+        Args:
+            top: Número de entradas
+            group_by: 'lineno', 'filename' o 'traceback'
+            rebase: Si es True la instantánea actual pasa a ser la nueva base
+
+        Raises:
+            RuntimeError: Si no se llamó antes a start_allocation_tracking()
+        """
+        return self._allocations.diff(top, group_by, rebase)
+
+    def stop_allocation_tracking(self):
+        self._allocations.stop()
+
+    def watchdog_tick(self, name, interval, threshold=None):
+        """Latido de un bucle periódico externo vigilado por el watchdog, como
+        el bucle 'after' de la GUI
+
+        Args:
+            name: Nombre del bucle
+            interval: Segundos con los que se programó esta iteración
+            threshold: Segundos de retraso a partir de los que se considera
+                bloqueado (por defecto, watchdog_threshold)
+
+        Returns:
+            float: Retraso de esta iteración respecto a interval
+        """
+        return self._watchdog.tick(name, interval, threshold)
+
+    def get_watchdog_status(self):
+        """Estado de cada hilo o bucle vigilado: tiempo ocupado, tarea en
+        curso, bloqueado o no, bloqueos detectados y retraso máximo"""
+        return self._watchdog.status()
+
+    def get_event_stats(self):
+        """Métricas por suscriptor del bus de eventos: cola, entregados,
+        descartados, errores y retraso de entrega"""
+        return self._events.stats()
+
+    def _publish_progress(self, events):
+        """Publica en el bus los eventos de ProgressMonitor"""
+        self._events.publish("progress", events)
+        self._update_transfer_metrics(events)
+
+        # Los callbacks clásicos solo reciben el progreso de los envíos en curso;
+        # inicio, fin y error se siguen notificando desde el envío
+        for event in events:
+            if event["direction"] != self._outgoing_transfers.direction:
+                continue
+            if event["state"] != ACTIVE or event["progress"] >= 100:
+                continue
+            self._events.publish(
+                "file_progress",
+                event["user_id"],
+                event["file_path"],
+                event["progress"],
+                "progreso",
+            )
+
+    def set_bandwidth_limits(self, **limits):
+        """Configura en caliente los límites del tráfico de archivos saliente.
+
+        Args (todos en bytes/s, None = sin límite; los omitidos no cambian):
+            global_rate: Límite para todas las transferencias salientes
+            per_peer_rate: Límite por defecto para cada peer
+            peer_rates: Diccionario {ip: rate} con límites específicos
+            link_rate: Capacidad estimada del enlace
+            chat_share: Fracción de link_rate permitida a archivos mientras hay
+                chat activo (p. ej. 0.7 para dejar el 30% al chat)
+        """
+        self._bandwidth.set_limits(**limits)
+
+    def set_max_concurrent_transfers(self, max_transfers):
+        """Cambia en caliente el número máximo de envíos de archivos simultáneos
+
+        Si el nuevo límite supera los FileSender existentes se arrancan los que
+        falten; al bajarlo, los que sobran esperan en file_send_queue sin
+        admitir más envíos que el límite.
+        """
+        self._start_file_workers(max_transfers)
+        self.max_concurrent_transfers = max_transfers
+        self.file_send_queue.set_max_concurrent(max_transfers)
+
+    def get_bandwidth_limits(self):
+        """Devuelve los límites de ancho de banda actuales"""
+        return self._bandwidth.get_limits()
+
+    def list_transfers(self, include_finished=False):
+        """Devuelve las transferencias de archivos en curso (entrantes y salientes).
+
+        Args:
+            include_finished: Si es True incluye también las transferencias recientes
+                ya finalizadas (completadas, fallidas o expiradas)
+
+        Returns:
+            list: Diccionarios con peer_ip, file_id, direction, user_id, file_size,
+                  state, bytes_done, created, updated y error
+        """
+        return self._incoming_transfers.list_transfers(
+            include_finished
+        ) + self._outgoing_transfers.list_transfers(include_finished)
 
     def get_peers(self):
         """Devuelve la lista de pares conocidos"""
@@ -1792,124 +3459,496 @@ class Peer:
 
         return result_str, result_bytes
 
-    def get_message_history(self, user_id):
+    def get_message_history(self, user_id, before=None, limit=None):
         """Obtiene el historial de mensajes con un usuario específico
 
+        Sin before ni limit devuelve los últimos mensajes, que se mantienen en
+        memoria. Con ellos se lee del almacén solo la página pedida, lo que
+        permite recorrer hacia atrás una conversación larga.
+
         Args:
             user_id: ID del usuario del que se quiere recuperar el historial
+            before: datetime; solo mensajes anteriores a ese instante
+            limit: Número máximo de mensajes (los más recientes de la página);
+                por defecto el tamaño de la ventana en memoria
 
         Returns:
-            list: Lista de diccionarios con los mensajes intercambiados. Cada mensaje tiene:
+            list: Lista de diccionarios con los mensajes intercambiados, en orden
+                cronológico. Cada mensaje tiene:
                  - 'from': ID del remitente ('self' para mensajes propios)
                  - 'text': Contenido del mensaje
                  - 'timestamp': Marca de tiempo en formato datetime
         """
         normalized_id = self._normalize_user_id(user_id)
-        with self._message_history_lock:
-            return self._message_history.get(normalized_id, [])[:]
-
-    def _store_message_in_history(self, user_id, message, is_outgoing=False):
+        if before is None and limit is None:
+            records = self._message_history.get(normalized_id)
+            return [record.to_dict() for record in records]
+
+        limit = self._MAX_MESSAGE_HISTORY if limit is None else limit
+        before_ts = before.timestamp() if before is not None else None
+        if self.history_backend == "journal":
+            # El diario no está indexado: solo se pagina la ventana en memoria
+            records = [
+                record
+                for record in self._message_history.get(normalized_id)
+                if before_ts is None or record.ts < before_ts
+            ]
+            records = records[-limit:] if limit else []
+            return [record.to_dict() for record in records]
+
+        if self._history_store.has_pending(normalized_id):
+            self._history_store.flush()
+        return [
+            HistoryRecord.from_record(record).to_dict()
+            for record in self._history_store.recent_records(
+                normalized_id, limit, before_ts
+            )
+        ]
+
+    def get_history_peers(self):
+        """Devuelve los IDs de los peers con historial, estén o no en memoria"""
+        peers = set(self._message_history.peers())
+        if self.history_backend != "journal":
+            peers.update(self._history_store.peers())
+        return sorted(peers)
+
+    def get_history_stats(self):
+        """Estadísticas del historial en memoria (conversaciones, bytes, desalojos)"""
+        return self._message_history.stats()
+
+    def _store_message_in_history(
+        self,
+        user_id,
+        message,
+        is_outgoing=False,
+        ordinal=None,
+        broadcast=False,
+        timestamp=None,
+    ):
         """Almacena un mensaje en el historial
 
         Args:
             user_id: ID del usuario con el que se intercambió el mensaje
             message: Contenido del mensaje
             is_outgoing: True si el mensaje fue enviado por este peer, False si fue recibido
+            ordinal: Ordinal del mensaje dentro de la conversación para su autor
+            broadcast: True si es un mensaje broadcast (no se sincroniza)
+            timestamp: Marca de tiempo original (por defecto, ahora)
+
+        Returns:
+            bool | None: True si se guardó, False si el ordinal ya se conocía
+            (mensaje duplicado) y None si es demasiado antiguo para saberlo
         """
         normalized_id = self._normalize_user_id(user_id)
-        timestamp = datetime.now()
+        timestamp = timestamp or datetime.now()
+        sender = "self" if is_outgoing else normalized_id
 
-        with self._message_history_lock:
-            if normalized_id not in self._message_history:
-                self._message_history[normalized_id] = []
+        if ordinal is not None:
+            history_lock = self._history_locked(normalized_id)
+        else:
+            history_lock = self._message_history_lock
+        with history_lock:
+            if ordinal is not None:
+                accepted = accept_ordinal(
+                    self._history_marks,
+                    self._ordinal_windows,
+                    normalized_id,
+                    "self" if is_outgoing else "peer",
+                    ordinal,
+                )
+                if not accepted:
+                    return accepted
+            self._history_seq += 1
+            record = HistoryRecord(
+                self._history_seq,
+                sender,
+                message,
+                timestamp.timestamp(),
+                ordinal,
+                broadcast,
+            )
+            # El almacén escribe en segundo plano: aquí solo se encola el
+            # registro. Se encola antes de añadirlo a la caché para que una
+            # conversación desalojada que se recupere del almacén lo incluya
+            self._history_store.append({"peer": normalized_id, **record.to_record()})
+            self._message_history.append(normalized_id, record)
+
+        # Las conversaciones que el presupuesto haya desalojado se escriben ya
+        # sin ningún lock del historial tomado
+        self._message_history.write_spills()
+        return True
 
-            self._message_history[normalized_id].append(
-                {
-                    "from": "self" if is_outgoing else normalized_id,
-                    "text": message,
-                    "timestamp": timestamp,
-                }
+    def _allocate_ordinal(self, user_id):
+        """Reserva el siguiente ordinal para un mensaje propio a un peer
+
+        Un envío fallido deja su ordinal sin usar, así que un reintento nunca
+        reutiliza el de un mensaje que el otro extremo pudo llegar a recibir.
+        """
+        normalized_id = self._normalize_user_id(user_id)
+        with self._history_locked(normalized_id):
+            stored = self._history_marks[normalized_id]["self"]
+            ordinal = max(self._next_ordinals.get(normalized_id, 0), stored) + 1
+            self._next_ordinals[normalized_id] = ordinal
+            return ordinal
+
+    def _read_marks(self, peer_id):
+        """Lee de disco las marcas de una conversación
+
+        Con 'segments' y 'sqlite' se consultan en el almacén; con el diario, en
+        el archivo de desalojo donde las guardó _drop_cold_history_state().
+        """
+        if self.history_backend == "journal":
+            state = self._message_history.load_state(peer_id) or {}
+            marks = state.get("marks")
+        else:
+            if self._history_store.has_pending(peer_id):
+                self._history_store.flush()
+            marks = self._history_store.ordinal_marks(peer_id).get(peer_id)
+        marks = marks or {}
+        return {"self": marks.get("self", 0), "peer": marks.get("peer", 0)}
+
+    @contextlib.contextmanager
+    def _history_locked(self, peer_id):
+        """Toma _message_history_lock con las marcas de peer_id en memoria
+
+        Las marcas de una conversación que no estaba en uso se leen antes de
+        tomar el lock, para que esa lectura no retrase el historial de los
+        demás peers.
+        """
+        while True:
+            with self._message_history_lock:
+                if peer_id in self._history_marks:
+                    yield
+                    return
+            marks = self._read_marks(peer_id)
+            with self._message_history_lock:
+                self._history_marks.setdefault(peer_id, marks)
+
+    def _drop_cold_history_state(self):
+        """Descarta el estado por peer de las conversaciones fuera de memoria
+
+        Se llama tras HistoryCache.evict_idle(): las marcas, ventanas de
+        ordinales y ordinales reservados de los peers cuya conversación ya no
+        está en memoria se vuelven a leer con _read_marks() al usarlas, así que
+        con muchos peers de paso la memoria no crece con cada uno.
+        """
+        now = time.monotonic()
+        with self._message_history_lock:
+            resident = set(self._message_history.resident_peers())
+            for peer_id in [p for p in self._history_marks if p not in resident]:
+                marks = self._history_marks[peer_id]
+                # Un envío fallido reservó un ordinal que no está guardado y
+                # que no se debe volver a usar
+                if self._next_ordinals.get(peer_id, 0) > marks["self"]:
+                    continue
+                if self.history_backend == "journal":
+                    self._message_history.save_state(peer_id, {"marks": marks})
+                del self._history_marks[peer_id]
+                self._next_ordinals.pop(peer_id, None)
+                self._ordinal_windows.pop((peer_id, "self"), None)
+                self._ordinal_windows.pop((peer_id, "peer"), None)
+            for peer_id, last_sync in list(self._last_history_sync.items()):
+                if now - last_sync >= self._HISTORY_SYNC_INTERVAL:
+                    del self._last_history_sync[peer_id]
+
+    def _load_conversation(self, peer_id):
+        """Recupera del almacén de historial (SQLite o segmentos) una
+        conversación desalojada de memoria"""
+        # Los mensajes del lote pendiente también deben estar en la consulta
+        if self._history_store.has_pending(peer_id):
+            self._history_store.flush()
+        return [
+            HistoryRecord.from_record(record)
+            for record in self._history_store.recent_records(
+                peer_id, self._MAX_MESSAGE_HISTORY
             )
+        ]
+
+    def _import_json_history(self, history_file):
+        """Importa al almacén de historial (SQLite o segmentos) el historial
+        guardado en JSON y en el diario"""
+        snapshot, records = read_history(history_file, f"{history_file}.journal")
+        records = snapshot_records(snapshot) + records
+        if not records:
+            return
+        for seq, record in enumerate(records, 1):
+            self._history_store.append(dict(record, seq=seq))
+        self._history_store.flush()
+        logger.info(
+            f"Importados {len(records)} mensajes de {history_file} al backend "
+            f"'{self.history_backend}'"
+        )
 
-            if len(self._message_history[normalized_id]) > self._MAX_MESSAGE_HISTORY:
-                self._message_history[normalized_id] = self._message_history[
-                    normalized_id
-                ][-self._MAX_MESSAGE_HISTORY :]
+    def _history_file_path(self):
+        normalized_id = self._normalize_user_id(self.user_id_str)
+        return f"lcp_history_{normalized_id.strip().replace(' ', '_')}.json"
 
-        self.save_message_history()
+    def _history_snapshot(self):
+        """Instantánea serializable del historial para la compactación del diario"""
+        with self._message_history_lock:
+            # Solo las conversaciones residentes: las desalojadas ya están
+            # guardadas en su archivo del directorio de desalojo
+            peers = {}
+            for peer_id, records in self._message_history.items():
+                messages = peers[peer_id] = []
+                for record in records:
+                    msg = record.to_record()
+                    timestamp = datetime.fromtimestamp(msg.pop("ts"))
+                    msg["timestamp"] = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+                    messages.append(msg)
+            # Las marcas se guardan aparte porque el historial en memoria está
+            # recortado y puede no contener el último ordinal de cada autor
+            marks = {
+                peer_id: dict(conversation)
+                for peer_id, conversation in self._history_marks.items()
+            }
+            return {
+                "version": 2,
+                "seq": self._history_seq,
+                "peers": peers,
+                "marks": marks,
+            }
 
     def save_message_history(self):
         """Guarda el historial de mensajes en un archivo para persistencia
 
-        Se guarda en un archivo JSON en el directorio actual con el nombre basado
-        en el ID del usuario.
+        Con el backend 'journal' escribe una instantánea completa en el archivo
+        JSON del usuario y vacía el diario; con 'segments' y 'sqlite' escribe los
+        mensajes pendientes. No hace falta llamarlo tras cada mensaje: todos los
+        almacenes escriben solos en segundo plano.
         """
         try:
-            normalized_id = self._normalize_user_id(self.user_id_str)
-            history_file = f"lcp_history_{normalized_id.strip().replace(' ', '_')}.json"
-
-            serializable_history = {}
-            with self._message_history_lock:
-                for peer_id, messages in self._message_history.items():
-                    serializable_history[peer_id] = []
-                    for msg in messages:
-                        serializable_msg = msg.copy()
-                        serializable_msg["timestamp"] = serializable_msg[
-                            "timestamp"
-                        ].strftime("%Y-%m-%d %H:%M:%S")
-                        serializable_history[peer_id].append(serializable_msg)
-
-            with open(history_file, "w") as f:
-                json.dump(serializable_history, f)
-
-            logger.debug(f"Historial de mensajes guardado en {history_file}")
+            if self.history_backend == "journal":
+                self._history_store.compact()
+            else:
+                self._history_store.flush()
+            logger.debug("Historial de mensajes guardado")
             return True
         except Exception as e:
             logger.error(f"Error guardando historial de mensajes: {e}", exc_info=True)
             return False
 
     def load_message_history(self):
-        """Carga el historial de mensajes desde un archivo
+        """Carga el historial de mensajes desde disco
 
-        Se carga desde un archivo JSON en el directorio actual con el nombre basado
-        en el ID del usuario.
+        Con el backend 'journal' se carga la instantánea JSON del directorio
+        actual (nombre basado en el ID del usuario) y se reaplican los registros
+        del diario posteriores a ella. Con 'segments' y 'sqlite' no se carga
+        nada por adelantado: cada conversación se lee del almacén al accederla.
+        Las conversaciones desalojadas de memoria se recuperan del mismo modo.
 
         Returns:
             bool: True si se pudo cargar el historial, False en caso contrario
         """
         try:
-            normalized_id = self._normalize_user_id(self.user_id_str)
-            history_file = f"lcp_history_{normalized_id.strip().replace(' ', '_')}.json"
-
-            if not os.path.exists(history_file):
-                logger.info(
-                    f"No existe archivo de historial de mensajes: {history_file}"
+            if self.history_backend != "journal":
+                source = (
+                    self._history_store.db_path
+                    if self.history_backend == "sqlite"
+                    else self._history_store.directory
                 )
+                if self._history_store.is_empty():
+                    logger.info(f"No existe historial de mensajes en {source}")
+                    return False
+                logger.info(f"Historial de mensajes disponible en {source}")
+                return True
+
+            source = self._history_store.snapshot_path
+            snapshot, records = self._history_store.load()
+            # Los registros ya presentes en un archivo de desalojo (mismo seq o
+            # anterior) se descartan al añadirlos
+            records = sorted(
+                snapshot_records(snapshot) + records, key=lambda r: r["seq"]
+            )
+            if not records and not self._message_history.peers():
+                logger.info(f"No existe historial de mensajes en {source}")
                 return False
 
-            with open(history_file, "r") as f:
-                serialized_history = json.load(f)
-
-            # Convertimos las cadenas de timestamp a objetos datetime
-            with self._message_history_lock:
-                for peer_id, messages in serialized_history.items():
-                    if peer_id not in self._message_history:
-                        self._message_history[peer_id] = []
-
-                    for msg in messages:
-                        # Convertimos el timestamp de string a datetime
-                        msg["timestamp"] = datetime.strptime(
-                            msg["timestamp"], "%Y-%m-%d %H:%M:%S"
+            for start in range(0, len(records), 1000):
+                with self._message_history_lock:
+                    for record in records[start : start + 1000]:
+                        self._message_history.append(
+                            record["peer"], HistoryRecord.from_record(record)
                         )
-                        self._message_history[peer_id].append(msg)
+                self._message_history.write_spills()
 
-            logger.info(f"Historial de mensajes cargado desde {history_file}")
+            logger.info(
+                f"Historial de mensajes cargado desde {source} ({len(records)} mensajes)"
+            )
             return True
         except Exception as e:
             logger.error(f"Error cargando historial de mensajes: {e}", exc_info=True)
             return False
 
+    def search_history(self, query, peer=None, limit=50):
+        """Busca mensajes del historial que contengan todos los términos de query
+
+        Args:
+            query: Texto a buscar (términos separados por espacios)
+            peer: ID del peer para limitar la búsqueda a esa conversación
+            limit: Número máximo de resultados
+
+        Returns:
+            list: Mensajes, del más reciente al más antiguo, con 'peer', 'from',
+                'text' y 'timestamp'. Con el backend 'journal' solo se busca en
+                las conversaciones residentes en memoria.
+        """
+        peer_id = self._normalize_user_id(peer) if peer else None
+
+        if self.history_backend != "journal":
+            # Los mensajes recién recibidos pueden estar aún en el lote pendiente
+            self._history_store.flush()
+            return self._history_store.search(query, peer_id, limit)
+
+        terms = [term.lower() for term in query.split()]
+        if not terms:
+            return []
+        matches = [
+            {"peer": pid, **record.to_dict()}
+            for pid, records in self._message_history.items()
+            if peer_id is None or pid == peer_id
+            for record in records
+            if all(term in record.text.lower() for term in terms)
+        ]
+        matches.sort(key=lambda msg: msg["timestamp"], reverse=True)
+        return matches[:limit]
+
+    def _on_peer_discovered(self, user_id, added):
+        """Sincroniza el historial con un peer recién (re)descubierto"""
+        if not added:
+            return
+        peer_id = self._normalize_user_id(user_id)
+        with self._message_history_lock:
+            last_sync = self._last_history_sync.get(peer_id)
+        # Si ambos extremos se descubren a la vez, el segundo intento se omite
+        if last_sync and time.monotonic() - last_sync < self._HISTORY_SYNC_INTERVAL:
+            return
+        self.sync_history(peer_id)
+
+    def _conversation_sync_state(self, peer_id):
+        """Marcas y copia del historial en memoria de una conversación
+
+        También anota la sincronización para no repetirla con el mismo peer
+        durante _HISTORY_SYNC_INTERVAL segundos.
+        """
+        with self._history_locked(peer_id):
+            self._last_history_sync[peer_id] = time.monotonic()
+            marks = dict(self._history_marks[peer_id])
+        # Recuperar una conversación desalojada puede leer de disco
+        entries = [record.to_dict() for record in self._message_history.get(peer_id)]
+        return marks, entries
+
+    def _merge_synced_messages(self, peer_id, messages):
+        """Guarda los mensajes recibidos en una sincronización
+
+        Returns:
+            int: Número de mensajes que no se conocían
+        """
+        stored = 0
+        entries = remote_to_entries(messages, peer_id)
+        for entry in sorted(entries, key=lambda e: e["ord"]):
+            is_outgoing = entry["from"] == "self"
+            if not self._store_message_in_history(
+                peer_id,
+                entry["text"],
+                is_outgoing=is_outgoing,
+                ordinal=entry["ord"],
+                timestamp=entry["timestamp"],
+            ):
+                continue
+            stored += 1
+            if not is_outgoing:
+                self._events.publish("message", peer_id, entry["text"])
+        return stored
+
+    def sync_history(self, user_to):
+        """Sincroniza el historial de la conversación con un peer
+
+        Ambos extremos intercambian sus marcas de agua (el mayor ordinal que
+        tienen de cada autor) en una sola conexión TCP y se envían solo los
+        mensajes que le faltan al otro. Los broadcasts no se sincronizan.
+
+        Args:
+            user_to: ID del peer
+
+        Returns:
+            bool: True si la sincronización se completó
+        """
+        found_peer, peer_addr = self._resolve_peer(user_to)
+        if not found_peer:
+            logger.error(
+                f"No se puede sincronizar historial: peer '{user_to}' no encontrado"
+            )
+            return False
+
+        peer_id = self._normalize_user_id(found_peer)
+        marks, entries = self._conversation_sync_state(peer_id)
+        try:
+            with self._transport.connect(peer_addr[0], timeout=5) as sock:
+                sock.sendall(SYNC_MAGIC)
+                send_frame(
+                    sock,
+                    {"user": self._normalize_user_id(self.user_id_str), "have": marks},
+                )
+                reply = recv_frame(lambda size: self._recv_exact(sock, size))
+                received = self._merge_synced_messages(
+                    peer_id, reply.get("messages", [])
+                )
+                outgoing = missing_for_remote(entries, reply.get("have", {}))
+                send_frame(sock, {"messages": outgoing})
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Error sincronizando historial con {peer_id}: {e}")
+            return False
+
+        logger.info(
+            f"Historial sincronizado con {peer_id}: {received} mensajes recibidos, {len(outgoing)} enviados"
+        )
+        return True
+
+    def _handle_history_sync(self, conn, addr):
+        """Atiende una sincronización de historial iniciada por otro peer"""
+        worker_name = threading.current_thread().name
+        conn.settimeout(5)
+        try:
+            request = recv_frame(lambda size: self._recv_exact(conn, size))
+            peer_id = self._normalize_user_id(str(request.get("user", "")))
+
+            found_peer, peer_addr = self._resolve_peer(peer_id)
+            if not found_peer or peer_addr[0] != addr[0]:
+                logger.warning(
+                    f"{worker_name} sincronización rechazada: '{peer_id}' no es un peer conocido en {addr[0]}"
+                )
+                return
+
+            marks, entries = self._conversation_sync_state(peer_id)
+            send_frame(
+                conn,
+                {
+                    "have": marks,
+                    "messages": missing_for_remote(entries, request.get("have", {})),
+                },
+            )
+            reply = recv_frame(lambda size: self._recv_exact(conn, size))
+            received = self._merge_synced_messages(peer_id, reply.get("messages", []))
+            logger.info(
+                f"{worker_name} historial sincronizado con {peer_id}: {received} mensajes recibidos"
+            )
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(
+                f"{worker_name} error en sincronización de historial con {addr[0]}: {e}"
+            )
+
     def close(self):
         """Cierra las conexiones"""
+        self._closed.set()
+        self.stop_metrics_server()
+        self._watchdog.stop()
+        if self._profiler is not None:
+            self._profiler.stop()
+        self._connection_pool.close_all()
+        self._progress.stop()
+        self._events.close()
+        self._message_history.write_spills()
+        self._history_store.close()
         self.udp_socket.close()
         self.tcp_socket.close()
@@ -15,3 +15,35 @@ FILE = 2
 RESPONSE_OK = 0
 RESPONSE_BAD_REQUEST = 1
 RESPONSE_INTERNAL_ERROR = 2
+RESPONSE_CHUNKS_CORRUPT = 3
+
+# Extensiones en el campo Reserved del header (50 bytes a partir del offset 50)
+HEADER_FLAGS_OFFSET = 50
+FLAG_INTEGRITY = 0x01
+
+ROOT_HASH_OFFSET = 51
+ROOT_HASH_SIZE = 32
+
+INTEGRITY_CHUNK_SIZE = 256 * 1024
+MAX_REPAIR_ROUNDS = 3
+
+FILE_CHUNK_SIZE = 64 * 1024
+FLAG_ARCHIVE = 0x02
+
+MAX_MANIFEST_SIZE = 64 * 1024 * 1024
+
+# Conexiones TCP persistentes: el emisor abre la conexión con este preámbulo en
+# lugar de un file_id (los file_id válidos empiezan por bytes nulos)
+KEEPALIVE_MAGIC = b"LCPKALV1"
+KEEPALIVE_IDLE_TIMEOUT = 120
+
+# Ordinal por autor de cada mensaje directo, para sincronizar historiales. Va
+# detrás de la raíz de Merkle para que un header pueda llevar ambos
+FLAG_ORDINAL = 0x04
+ORDINAL_OFFSET = ROOT_HASH_OFFSET + ROOT_HASH_SIZE
+ORDINAL_SIZE = 8
+
+# Sincronización de historial: preámbulo de la conexión TCP y límites
+SYNC_MAGIC = b"LCPSYNC1"
+SYNC_MAX_MESSAGES = 200
+MAX_SYNC_FRAME = 4 * 1024 * 1024
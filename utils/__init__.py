@@ -1,8 +1,92 @@
 from .network import get_network_info
 from .system_info import get_available_resources, get_optimal_thread_count
+from .integrity import (
+    ChunkVerifier,
+    build_file_tree,
+    chunk_count,
+    decode_leaves,
+    encode_leaves,
+    merkle_root,
+)
+from .transfers import TransferRegistry
+from .bandwidth import BandwidthShaper, TokenBucket
+from .scheduler import TransferScheduler
+from .disk_writer import BackgroundFileWriter
+from .connection_pool import ConnectionPool
+from .progress import ProgressMonitor
+from .event_bus import EventBus
+from .history_journal import HistoryJournal
+from .history_sqlite import SQLiteHistoryStore
+from .history_segments import SegmentHistoryStore
+from .history_cache import HistoryCache, HistoryRecord
+from .archive import (
+    ArchivePatcher,
+    ArchiveReader,
+    build_archive_tree,
+    build_manifest,
+    collect_directory,
+    collect_files,
+    manifest_length,
+    parse_manifest,
+)
+from .log_config import configure_logging, logging_stats, shutdown_logging
+from .metrics import Counter, Gauge, Histogram, MetricsRegistry, MetricsServer
+from .tracing import Tracer
+from .profiler import SamplingProfiler
+from .lock_stats import InstrumentedLock, contention_summary
+from .memory import AllocationTracker, container_usage, deep_sizeof, process_memory
+from .watchdog import Watchdog
+from .transport import LoopbackNetwork, LoopbackTransport, SocketTransport
 
 __all__ = [
     "get_network_info",
     "get_available_resources",
     "get_optimal_thread_count",
+    "ChunkVerifier",
+    "build_file_tree",
+    "chunk_count",
+    "decode_leaves",
+    "encode_leaves",
+    "merkle_root",
+    "TransferRegistry",
+    "BandwidthShaper",
+    "TokenBucket",
+    "TransferScheduler",
+    "BackgroundFileWriter",
+    "ConnectionPool",
+    "ProgressMonitor",
+    "EventBus",
+    "HistoryJournal",
+    "SQLiteHistoryStore",
+    "SegmentHistoryStore",
+    "HistoryCache",
+    "HistoryRecord",
+    "ArchivePatcher",
+    "ArchiveReader",
+    "build_archive_tree",
+    "build_manifest",
+    "collect_directory",
+    "collect_files",
+    "manifest_length",
+    "parse_manifest",
+    "configure_logging",
+    "logging_stats",
+    "shutdown_logging",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "MetricsServer",
+    "Tracer",
+    "SamplingProfiler",
+    "InstrumentedLock",
+    "contention_summary",
+    "AllocationTracker",
+    "container_usage",
+    "deep_sizeof",
+    "process_memory",
+    "Watchdog",
+    "LoopbackNetwork",
+    "LoopbackTransport",
+    "SocketTransport",
 ]
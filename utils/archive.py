@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+
+from protocol import INTEGRITY_CHUNK_SIZE, MAX_MANIFEST_SIZE
+
+from .integrity import ChunkHasher, merkle_root
+
+logger = logging.getLogger("LCP")
+
+MANIFEST_VERSION = 1
+
+
+def collect_directory(dir_path):
+    """Lista los archivos regulares de un directorio de forma recursiva.
+
+    Returns:
+        list: Tuplas (ruta local, ruta relativa con '/') ordenadas por ruta
+    """
+    base = os.path.abspath(dir_path)
+    entries = []
+    for root, dirs, files in os.walk(base):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            relative = os.path.relpath(path, base).replace(os.sep, "/")
+            entries.append((path, relative))
+    return entries
+
+
+def collect_files(paths):
+    """Prepara una lista de archivos y directorios sueltos para un mismo envío.
+
+    Los archivos se colocan en la raíz del archivo empaquetado y los directorios
+    conservan su nombre como subcarpeta.
+
+    Raises:
+        ValueError: Si una ruta no existe o dos entradas acaban con el mismo nombre
+    """
+    entries = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            name = os.path.basename(os.path.normpath(path))
+            items = [(p, f"{name}/{rel}") for p, rel in collect_directory(path)]
+        elif os.path.isfile(path):
+            items = [(os.path.abspath(path), os.path.basename(path))]
+        else:
+            raise ValueError(f"'{path}' no existe")
+
+        for local, relative in items:
+            if relative in seen:
+                raise ValueError(f"Entrada duplicada en el envío: {relative}")
+            seen.add(relative)
+            entries.append((local, relative))
+    return entries
+
+
+def build_manifest(name, entries):
+    """Serializa el manifiesto: 4 bytes de longitud + JSON con nombre y archivos.
+
+    Los tamaños se toman en este momento; el emisor envía exactamente esos bytes
+    de cada archivo a continuación del manifiesto, en el mismo orden.
+
+    Returns:
+        Tuple[bytes, list]: (manifiesto serializado, tamaños de cada entrada)
+    """
+    sizes = [os.path.getsize(local) for local, _ in entries]
+    files = [
+        {"path": relative, "size": size}
+        for (_, relative), size in zip(entries, sizes)
+    ]
+    payload = json.dumps(
+        {"version": MANIFEST_VERSION, "name": name, "files": files},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return len(payload).to_bytes(4, "big") + payload, sizes
+
+
+def safe_relative_path(path):
+    """Convierte una ruta del manifiesto en una ruta relativa local segura.
+
+    Raises:
+        ValueError: Si la ruta es absoluta, está vacía o sale del directorio destino
+    """
+    parts = path.replace("\\", "/").split("/")
+    if not path or path.startswith("/") or any(
+        part in ("", ".", "..") or ":" in part for part in parts
+    ):
+        raise ValueError(f"Ruta inválida en el manifiesto: {path!r}")
+    return os.path.join(*parts)
+
+
+def parse_manifest(data):
+    """Valida y deserializa el JSON del manifiesto (sin el prefijo de longitud).
+
+    Returns:
+        Tuple[str, list]: (nombre seguro del envío, lista de (ruta local relativa, tamaño))
+
+    Raises:
+        ValueError: Si el manifiesto está mal formado
+    """
+    try:
+        manifest = json.loads(bytes(data).decode("utf-8"))
+        name = str(manifest.get("name") or "archivos")
+        raw_files = manifest["files"]
+    except (UnicodeDecodeError, json.JSONDecodeError, KeyError, AttributeError) as e:
+        raise ValueError(f"Manifiesto inválido: {e}")
+
+    name = safe_relative_path(os.path.basename(name.replace("\\", "/")) or "archivos")
+
+    files = []
+    seen = set()
+    for item in raw_files:
+        size = item.get("size")
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f"Tamaño inválido en el manifiesto: {size!r}")
+        relative = safe_relative_path(str(item.get("path", "")))
+        if relative in seen:
+            raise ValueError(f"Entrada duplicada en el manifiesto: {relative}")
+        seen.add(relative)
+        files.append((relative, size))
+    return name, files
+
+
+def manifest_length(prefix):
+    """Lee el prefijo de 4 bytes del manifiesto
+
+    Raises:
+        ValueError: Si supera MAX_MANIFEST_SIZE
+    """
+    length = int.from_bytes(prefix, "big")
+    if length > MAX_MANIFEST_SIZE:
+        raise ValueError(f"Manifiesto demasiado grande: {length} bytes")
+    return length
+
+
+def build_archive_tree(manifest, paths, sizes, chunk_size=INTEGRITY_CHUNK_SIZE):
+    """Calcula las hojas y la raíz del flujo de un envío: el manifiesto
+    serializado seguido de los sizes primeros bytes de cada archivo.
+
+    Returns:
+        Tuple[list, bytes]: (hojas, raíz)
+
+    Raises:
+        ValueError: Si un archivo es más corto que su tamaño en el manifiesto
+    """
+    builder = ChunkHasher(chunk_size)
+    builder.update(manifest)
+    for path, size in zip(paths, sizes):
+        remaining = size
+        with open(path, "rb") as f:
+            while remaining:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    raise ValueError(f"'{path}' cambió de tamaño durante el envío")
+                builder.update(data)
+                remaining -= len(data)
+    leaves = builder.finish()
+    return leaves, merkle_root(leaves)
+
+
+class _ArchiveStream:
+    """Correspondencia entre posiciones del flujo de un envío y sus archivos"""
+
+    def __init__(self, manifest, paths, sizes):
+        self.manifest = manifest
+        self.paths = paths
+        self._starts = []
+        position = len(manifest)
+        for size in sizes:
+            self._starts.append((position, size))
+            position += size
+
+    def _spans(self, offset, length):
+        """Tramos (ruta, posición en el archivo, inicio en el rango, bytes)"""
+        end = offset + length
+        for path, (start, size) in zip(self.paths, self._starts):
+            first = max(offset, start)
+            last = min(end, start + size)
+            if first < last:
+                yield path, first - start, first - offset, last - first
+
+
+class ArchiveReader(_ArchiveStream):
+    """Lee rangos del flujo de un envío para reenviar chunks corruptos"""
+
+    def read(self, offset, length):
+        data = bytearray(self.manifest[offset : offset + length])
+        for path, position, _, count in self._spans(offset, length):
+            with open(path, "rb") as f:
+                f.seek(position)
+                data += f.read(count)
+        return bytes(data)
+
+
+class ArchivePatcher(_ArchiveStream):
+    """Escribe chunks reenviados sobre los archivos ya recibidos de un envío.
+
+    Tiene la interfaz de BackgroundFileWriter que usa la reparación
+    (write_at y drain), pero escribe directamente en los archivos.
+    """
+
+    def write_at(self, offset, data):
+        """
+        Raises:
+            ValueError: Si el chunk cambia el manifiesto, que ya se usó para
+                crear los archivos
+        """
+        overlap = self.manifest[offset : offset + len(data)]
+        if overlap != data[: len(overlap)]:
+            raise ValueError("El manifiesto recibido estaba corrupto")
+        view = memoryview(data)
+        for path, position, start, count in self._spans(offset, len(data)):
+            with open(path, "r+b") as f:
+                f.seek(position)
+                f.write(view[start : start + count])
+
+    def drain(self):
+        pass
@@ -0,0 +1,246 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+_UNCHANGED = object()
+
+
+class TokenBucket:
+    """Token bucket clásico: rate bytes/s con ráfagas de hasta burst bytes"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate / 4, 64 * 1024)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def set_rate(self, rate, burst=None):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = burst or max(rate / 4, 64 * 1024)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay_for(self, nbytes, now):
+        """Segundos que faltan para poder enviar nbytes (0 si ya se puede).
+
+        Un envío mayor que la capacidad se permite con el bucket lleno, dejando
+        los tokens en negativo.
+        """
+        self._refill(now)
+        needed = min(nbytes, self.capacity)
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, nbytes):
+        self.tokens -= nbytes
+
+
+class _Flow:
+    def __init__(self, peer, quantum):
+        self.peer = peer
+        self.deficit = quantum
+        self.pending = 0
+        self.bytes_sent = 0
+
+
+class BandwidthShaper:
+    """Limita el tráfico de archivos salientes con reparto justo entre transferencias.
+
+    Combina un token bucket global, token buckets por peer y Deficit Round Robin
+    entre los flujos abiertos: en su turno cada transferencia puede enviar hasta un
+    quantum de bytes y después pasa al final de la ronda. Así una transferencia
+    grande no puede acaparar el enlace frente a otras más pequeñas.
+
+    Los límites se pueden cambiar en caliente con set_limits(). Con link_rate y
+    chat_share se reserva parte del enlace para el chat: mientras haya actividad
+    de chat reciente, el tráfico de archivos se limita a link_rate * chat_share.
+    Sin límites configurados throttle() retorna inmediatamente.
+    """
+
+    def __init__(
+        self,
+        global_rate=None,
+        per_peer_rate=None,
+        quantum=64 * 1024,
+        chat_window=5.0,
+    ):
+        self.quantum = quantum
+        self.chat_window = chat_window
+        self.global_rate = global_rate
+        self.per_peer_rate = per_peer_rate
+        self.peer_rates = {}
+        self.link_rate = None
+        self.chat_share = None
+
+        self._chat_active_until = 0.0
+        self._global_bucket = None
+        self._peer_buckets = {}
+        self._flows = collections.deque()
+        self._cond = threading.Condition()
+
+    def set_limits(
+        self,
+        global_rate=_UNCHANGED,
+        per_peer_rate=_UNCHANGED,
+        peer_rates=_UNCHANGED,
+        link_rate=_UNCHANGED,
+        chat_share=_UNCHANGED,
+    ):
+        """Actualiza los límites en bytes/s (None = sin límite).
+
+        Args:
+            global_rate: Límite para todo el tráfico de archivos saliente
+            per_peer_rate: Límite por defecto para cada peer
+            peer_rates: Diccionario {ip: rate} con límites específicos por peer
+            link_rate: Capacidad estimada del enlace
+            chat_share: Fracción de link_rate permitida a archivos con chat activo
+        """
+        with self._cond:
+            if global_rate is not _UNCHANGED:
+                self.global_rate = global_rate
+            if per_peer_rate is not _UNCHANGED:
+                self.per_peer_rate = per_peer_rate
+                self._peer_buckets.clear()
+            if peer_rates is not _UNCHANGED:
+                self.peer_rates = dict(peer_rates or {})
+                self._peer_buckets.clear()
+            if link_rate is not _UNCHANGED:
+                self.link_rate = link_rate
+            if chat_share is not _UNCHANGED:
+                self.chat_share = chat_share
+            self._cond.notify_all()
+
+        logger.info(f"Límites de ancho de banda actualizados: {self.get_limits()}")
+
+    def get_limits(self):
+        return {
+            "global_rate": self.global_rate,
+            "per_peer_rate": self.per_peer_rate,
+            "peer_rates": dict(self.peer_rates),
+            "link_rate": self.link_rate,
+            "chat_share": self.chat_share,
+            "chat_active": time.monotonic() < self._chat_active_until,
+        }
+
+    def note_chat_activity(self):
+        """Registra actividad de chat; activa la reserva de enlace si está configurada"""
+        self._chat_active_until = time.monotonic() + self.chat_window
+
+    def open_flow(self, peer):
+        """Registra un flujo de envío hacia peer; debe cerrarse con close_flow()"""
+        flow = _Flow(peer, self.quantum)
+        with self._cond:
+            self._flows.append(flow)
+        return flow
+
+    def close_flow(self, flow):
+        with self._cond:
+            if flow in self._flows:
+                self._flows.remove(flow)
+                self._cond.notify_all()
+
+    def _effective_global_rate(self, now):
+        rate = self.global_rate
+        if self.link_rate and self.chat_share and now < self._chat_active_until:
+            chat_rate = self.link_rate * self.chat_share
+            rate = chat_rate if rate is None else min(rate, chat_rate)
+        return rate
+
+    def _peer_rate(self, peer):
+        return self.peer_rates.get(peer, self.per_peer_rate)
+
+    def _is_unlimited(self, peer, now):
+        return self._effective_global_rate(now) is None and self._peer_rate(peer) is None
+
+    def _bucket_for_global(self, now):
+        rate = self._effective_global_rate(now)
+        if rate is None:
+            self._global_bucket = None
+        elif self._global_bucket is None:
+            self._global_bucket = TokenBucket(rate)
+        elif self._global_bucket.rate != rate:
+            self._global_bucket.set_rate(rate)
+        return self._global_bucket
+
+    def _bucket_for_peer(self, peer):
+        rate = self._peer_rate(peer)
+        if rate is None:
+            return None
+        bucket = self._peer_buckets.get(peer)
+        if bucket is None:
+            bucket = self._peer_buckets[peer] = TokenBucket(rate)
+        return bucket
+
+    def _pick(self, now):
+        """Elige el siguiente flujo que puede enviar, en orden Deficit Round Robin.
+
+        Returns:
+            Tuple[_Flow, float]: (flujo elegido o None, segundos hasta reintentar)
+        """
+        global_bucket = self._bucket_for_global(now)
+        blocked_peers = set()
+        min_wait = None
+
+        for flow in self._flows:
+            if not flow.pending or flow.peer in blocked_peers:
+                continue
+
+            wait = global_bucket.delay_for(flow.pending, now) if global_bucket else 0
+            if wait > 0:
+                # Los tokens globales quedan reservados al primer flujo en espera
+                return None, wait if min_wait is None else min(wait, min_wait)
+
+            peer_bucket = self._bucket_for_peer(flow.peer)
+            wait = peer_bucket.delay_for(flow.pending, now) if peer_bucket else 0
+            if wait == 0:
+                return flow, 0
+
+            # Los flujos posteriores del mismo peer no pueden adelantar a este
+            blocked_peers.add(flow.peer)
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+
+        return None, min_wait
+
+    def throttle(self, flow, nbytes):
+        """Bloquea hasta que el flujo pueda enviar nbytes respetando límites y turnos"""
+        if self._is_unlimited(flow.peer, time.monotonic()):
+            flow.bytes_sent += nbytes
+            return
+
+        with self._cond:
+            flow.pending = nbytes
+            self._cond.notify_all()
+            try:
+                while True:
+                    now = time.monotonic()
+                    chosen, wait = self._pick(now)
+                    if chosen is flow:
+                        break
+                    self._cond.wait(wait if wait else 1.0)
+
+                global_bucket = self._bucket_for_global(now)
+                if global_bucket:
+                    global_bucket.consume(nbytes)
+                peer_bucket = self._bucket_for_peer(flow.peer)
+                if peer_bucket:
+                    peer_bucket.consume(nbytes)
+
+                flow.bytes_sent += nbytes
+                flow.deficit -= nbytes
+                if flow.deficit <= 0:
+                    # Fin del turno: pasa al final de la ronda con un nuevo quantum
+                    flow.deficit += self.quantum
+                    if flow in self._flows:
+                        self._flows.remove(flow)
+                        self._flows.append(flow)
+            finally:
+                flow.pending = 0
+                self._cond.notify_all()
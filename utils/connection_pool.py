@@ -0,0 +1,189 @@
+import collections
+import contextlib
+import logging
+import socket
+import threading
+import time
+
+from protocol import KEEPALIVE_MAGIC, RESPONSE_OK, RESPONSE_SIZE, TCP_PORT
+
+logger = logging.getLogger("LCP")
+
+
+class ConnectionPool:
+    """Pool de conexiones TCP persistentes por peer para transferencias de archivos.
+
+    Cada conexión nueva empieza con KEEPALIVE_MAGIC y espera la confirmación del
+    receptor; a partir de ahí puede llevar varias transferencias seguidas, cada
+    una con su file_id, datos y respuesta como en una conexión normal. Un peer
+    que no entiende el preámbulo se recuerda como 'legacy' y recibe conexiones
+    de un solo uso.
+
+    Solo vuelven al pool las conexiones marcadas con mark_reusable() (la
+    transferencia terminó con OK y el flujo está sincronizado). Las conexiones
+    inactivas más de idle_timeout segundos, o que el peer ha cerrado, se
+    descartan; idle_timeout debe ser menor que KEEPALIVE_IDLE_TIMEOUT para que
+    sea siempre el emisor quien cierra primero.
+
+    Las conexiones se abren con connect(ip, timeout) si se indica (p. ej. el
+    connect() de un transporte) o con una conexión TCP directa a port.
+    """
+
+    def __init__(
+        self,
+        port=TCP_PORT,
+        idle_timeout=30,
+        max_idle_per_peer=4,
+        connect_timeout=5,
+        connect=None,
+    ):
+        self.port = port
+        self._connect_fn = connect
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self.connect_timeout = connect_timeout
+
+        self._idle = collections.defaultdict(collections.deque)
+        self._reusable = set()
+        self._legacy_peers = set()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.opened = 0
+
+    @contextlib.contextmanager
+    def connection(self, peer_ip):
+        """Presta una conexión con el peer; al salir vuelve al pool o se cierra"""
+        sock = self._acquire(peer_ip)
+        try:
+            yield sock
+        except BaseException:
+            with self._lock:
+                self._reusable.discard(sock)
+            sock.close()
+            raise
+        self._release(peer_ip, sock)
+
+    def mark_reusable(self, sock):
+        """Indica que la transferencia terminó limpia y la conexión puede reutilizarse"""
+        with self._lock:
+            self._reusable.add(sock)
+
+    def _acquire(self, peer_ip):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(peer_ip)
+            while idle:
+                sock, since = idle.pop()
+                if now - since < self.idle_timeout and self._is_alive(sock):
+                    self.reused += 1
+                    logger.debug(f"Reutilizando conexión TCP con {peer_ip}")
+                    return sock
+                sock.close()
+            legacy = peer_ip in self._legacy_peers
+
+        sock = self._connect(peer_ip)
+        if legacy:
+            return sock
+
+        try:
+            sock.settimeout(self.connect_timeout)
+            sock.sendall(KEEPALIVE_MAGIC)
+            response = sock.recv(RESPONSE_SIZE)
+            sock.settimeout(None)
+        except OSError:
+            response = b""
+
+        if response[:1] == bytes([RESPONSE_OK]):
+            self.opened += 1
+            logger.debug(f"Conexión TCP persistente abierta con {peer_ip}")
+            return sock
+
+        sock.close()
+        logger.info(
+            f"{peer_ip} no admite conexiones persistentes, usando una conexión por transferencia"
+        )
+        with self._lock:
+            self._legacy_peers.add(peer_ip)
+        return self._connect(peer_ip)
+
+    def _connect(self, peer_ip):
+        if self._connect_fn is not None:
+            sock = self._connect_fn(peer_ip, self.connect_timeout)
+        else:
+            sock = socket.create_connection((peer_ip, self.port), self.connect_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        return sock
+
+    def _release(self, peer_ip, sock):
+        with self._lock:
+            reusable = sock in self._reusable
+            self._reusable.discard(sock)
+            idle = self._idle[peer_ip]
+            if (
+                reusable
+                and peer_ip not in self._legacy_peers
+                and len(idle) < self.max_idle_per_peer
+            ):
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    @staticmethod
+    def _is_alive(sock):
+        """Comprueba sin bloquear que el peer no ha cerrado la conexión"""
+        try:
+            sock.setblocking(False)
+            # Un receptor en espera no envía nada: datos o EOF indican un
+            # flujo desincronizado o una conexión cerrada
+            sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.setblocking(True)
+            except OSError:
+                pass
+
+    def close_idle(self):
+        """Cierra las conexiones inactivas que superaron idle_timeout"""
+        now = time.monotonic()
+        closed = 0
+        with self._lock:
+            for peer_ip, idle in list(self._idle.items()):
+                keep = collections.deque(
+                    (sock, since)
+                    for sock, since in idle
+                    if now - since < self.idle_timeout
+                )
+                for sock, since in idle:
+                    if now - since >= self.idle_timeout:
+                        sock.close()
+                        closed += 1
+                if keep:
+                    self._idle[peer_ip] = keep
+                else:
+                    del self._idle[peer_ip]
+        if closed:
+            logger.debug(f"Cerradas {closed} conexiones TCP inactivas")
+        return closed
+
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for sock, _ in idle:
+                    sock.close()
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {
+            "idle": idle,
+            "opened": self.opened,
+            "reused": self.reused,
+            "legacy_peers": sorted(self._legacy_peers),
+        }
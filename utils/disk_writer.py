@@ -0,0 +1,231 @@
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger("LCP")
+
+FSYNC_NEVER = "never"
+FSYNC_END = "end"
+FSYNC_INTERVAL = "interval"
+FSYNC_ALWAYS = "always"
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_END, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+# Marca de las entradas de la cola que cambian de archivo (ver next_file())
+_NEXT_FILE = object()
+
+
+def reserve_path(path, directory=False):
+    """Reserva path o, si ya existe, la primera variante 'nombre (n).ext' libre
+
+    El nombre se reserva creando en exclusiva un archivo vacío (o un directorio
+    vacío si directory es True), así dos transferencias simultáneas nunca
+    eligen el mismo. El llamador lo sustituye después con os.replace().
+
+    Returns:
+        str: Ruta reservada
+    """
+    base, ext = os.path.splitext(path)
+    candidate = path
+    n = 0
+    while True:
+        try:
+            if directory:
+                os.mkdir(candidate)
+            else:
+                os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return candidate
+        except FileExistsError:
+            n += 1
+            candidate = f"{base} ({n}){ext}"
+
+
+class BackgroundFileWriter:
+    """Escribe un archivo recibido desde un hilo dedicado.
+
+    El hilo de red pide un buffer libre con acquire_buffer(), lo llena con
+    recv_into() y lo entrega con submit(); el hilo escritor lo vuelca a disco y
+    lo devuelve al pool. Con varios buffers la red sigue leyendo mientras el disco
+    escribe, y si el disco se queda atrás acquire_buffer() bloquea (backpressure)
+    en lugar de acumular memoria.
+
+    Los datos se escriben en un archivo temporal '.part' del mismo directorio y
+    finish() lo renombra atómicamente al nombre final. Con next_file() un mismo
+    escritor (hilo y buffers) sirve para varios archivos seguidos, como los de
+    un envío de muchos archivos pequeños.
+    """
+
+    def __init__(
+        self,
+        final_path,
+        buffer_size=256 * 1024,
+        buffer_count=4,
+        fsync_policy=FSYNC_END,
+        fsync_interval=64 * 1024 * 1024,
+        hasher=None,
+    ):
+        """
+        Args:
+            final_path: Ruta final del archivo
+            buffer_size: Tamaño de cada buffer del pool
+            buffer_count: Número de buffers del pool
+            fsync_policy: 'never', 'end', 'interval' o 'always'
+            fsync_interval: Bytes entre fsync con la política 'interval'
+            hasher: Objeto opcional con update(data) que recibe los datos
+                secuenciales en el hilo escritor (p. ej. un ChunkVerifier)
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync desconocida: {fsync_policy}")
+
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.hasher = hasher
+        self.bytes_written = 0
+        self.finished_paths = []
+
+        self._error = None
+        self._since_fsync = 0
+        self._free = queue.Queue()
+        for _ in range(buffer_count):
+            self._free.put(bytearray(buffer_size))
+        self._pending = queue.Queue()
+
+        self._open(final_path)
+        self._thread = threading.Thread(
+            target=self._run,
+            daemon=True,
+            name=f"DiskWriter-{os.path.basename(final_path)}",
+        )
+        self._thread.start()
+
+    def _open(self, final_path):
+        self.final_path = final_path
+        directory, name = os.path.split(final_path)
+        self.temp_path = os.path.join(
+            directory, f".{name}.{threading.get_ident()}.part"
+        )
+        os.makedirs(directory or ".", exist_ok=True)
+        self._file = open(self.temp_path, "wb")
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def acquire_buffer(self):
+        """Obtiene un buffer libre del pool; bloquea si todos están en uso"""
+        self._raise_if_failed()
+        return self._free.get()
+
+    def release_buffer(self, buffer):
+        """Devuelve al pool un buffer que no se llegó a usar"""
+        self._free.put(buffer)
+
+    def submit(self, buffer, length):
+        """Encola los primeros length bytes del buffer para escritura secuencial"""
+        self._raise_if_failed()
+        self._pending.put((buffer, length, None))
+
+    def write_at(self, offset, data):
+        """Encola una escritura posicional (p. ej. un chunk reparado)"""
+        self._raise_if_failed()
+        self._pending.put((data, len(data), offset))
+
+    def next_file(self, final_path):
+        """Termina el archivo actual (como finish()) y sigue escribiendo en otro
+
+        Se encola detrás de los datos ya enviados, así que no hace falta
+        esperar a que se escriban: lo que se entregue después va al nuevo
+        archivo. Las rutas finales quedan en finished_paths.
+        """
+        self._raise_if_failed()
+        self._pending.put((final_path, None, _NEXT_FILE))
+
+    def drain(self):
+        """Espera a que se hayan escrito todos los datos encolados"""
+        self._pending.join()
+        self._raise_if_failed()
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is None:
+                    return
+                buffer, length, offset = item
+                if self._error is not None:
+                    continue
+                if offset is _NEXT_FILE:
+                    self._close()
+                    self._open(buffer)
+                else:
+                    self._write(buffer, length, offset)
+            except Exception as e:
+                logger.error(f"Error escribiendo en {self.temp_path}: {e}")
+                self._error = e
+            finally:
+                if item is not None and item[2] is None:
+                    self._free.put(item[0])
+                self._pending.task_done()
+
+    def _write(self, buffer, length, offset):
+        data = memoryview(buffer)[:length]
+        if offset is None:
+            self._file.write(data)
+            self.bytes_written += length
+            if self.hasher:
+                self.hasher.update(data)
+        else:
+            position = self._file.tell()
+            self._file.seek(offset)
+            self._file.write(data)
+            self._file.seek(position)
+
+        self._since_fsync += length
+        if self.fsync_policy == FSYNC_ALWAYS or (
+            self.fsync_policy == FSYNC_INTERVAL
+            and self._since_fsync >= self.fsync_interval
+        ):
+            self._fsync()
+
+    def _fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._since_fsync = 0
+
+    def _stop(self):
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+
+    def _close(self):
+        """Aplica fsync según la política, cierra y renombra el archivo actual"""
+        if self.fsync_policy != FSYNC_NEVER:
+            self._fsync()
+        self._file.close()
+        self.final_path = reserve_path(self.final_path)
+        try:
+            os.replace(self.temp_path, self.final_path)
+        except OSError:
+            os.remove(self.final_path)
+            raise
+        self.finished_paths.append(self.final_path)
+
+    def finish(self):
+        """Vuelca lo pendiente, aplica fsync según la política y renombra.
+
+        Returns:
+            str: Ruta final del archivo (puede llevar sufijo ' (n)' si ya existía)
+        """
+        self.drain()
+        self._stop()
+        self._close()
+        return self.final_path
+
+    def abort(self):
+        """Descarta la escritura y elimina el archivo temporal"""
+        self._stop()
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
@@ -0,0 +1,224 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# Se avisa en el log del primer descarte de cada suscriptor y luego cada tantos
+_DROP_LOG_EVERY = 1000
+
+
+class Subscription:
+    """Suscriptor del bus con su propia cola acotada y su hilo de entrega.
+
+    Con batch=True el callback recibe una lista de tuplas de argumentos con
+    todos los eventos acumulados (hasta max_batch) en lugar de una llamada por
+    evento.
+    """
+
+    def __init__(
+        self,
+        topic,
+        callback,
+        maxsize=1000,
+        overflow=DROP_OLDEST,
+        batch=False,
+        max_batch=100,
+        name=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desbordamiento desconocida: {overflow}")
+
+        self.topic = topic
+        self.callback = callback
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.batch = batch
+        self.max_batch = max_batch
+        self.name = name or getattr(callback, "__qualname__", repr(callback))
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name=f"EventBus-{topic}-{self.name}"
+        )
+        self._thread.start()
+
+    def offer(self, args, block_timeout=None):
+        """Encola un evento aplicando la política de desbordamiento
+
+        Returns:
+            bool: False si el evento se descartó
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == DROP_NEWEST:
+                    self._count_drop()
+                    return False
+                if self.overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._count_drop()
+                else:
+                    deadline = None
+                    if block_timeout is not None:
+                        deadline = time.monotonic() + block_timeout
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        remaining = None
+                        if deadline is not None:
+                            remaining = deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self._count_drop()
+                            return False
+                        self._cond.wait(remaining)
+            self._queue.append((time.monotonic(), args))
+            self._cond.notify_all()
+            return True
+
+    def _count_drop(self):
+        self.dropped += 1
+        if self.dropped % _DROP_LOG_EVERY == 1:
+            logger.warning(
+                f"Suscriptor '{self.name}' de '{self.topic}' no da abasto: "
+                f"{self.dropped} eventos descartados (cola de {self.maxsize}, "
+                f"política {self.overflow})"
+            )
+
+    def _take(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            count = min(len(self._queue), self.max_batch) if self.batch else 1
+            items = [self._queue.popleft() for _ in range(count)]
+            self._cond.notify_all()
+            return items
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items is None:
+                return
+
+            lag = time.monotonic() - items[0][0]
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            try:
+                if self.batch:
+                    self.callback([args for _, args in items])
+                else:
+                    self.callback(*items[0][1])
+            except Exception as e:
+                self.errors += 1
+                logger.error(
+                    f"Error en suscriptor '{self.name}' de '{self.topic}': {e}",
+                    exc_info=True,
+                )
+            self.delivered += len(items)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "topic": self.topic,
+            "name": self.name,
+            "queued": queued,
+            "maxsize": self.maxsize,
+            "overflow": self.overflow,
+            "batch": self.batch,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+
+class EventBus:
+    """Bus de eventos que desacopla a quien publica de los callbacks.
+
+    publish() solo encola el evento en la cola de cada suscriptor del tema y
+    retorna; cada suscriptor se atiende en su propio hilo, en orden, así que un
+    callback lento solo retrasa sus propios eventos. Con la política 'block' el
+    publicador espera como mucho block_timeout segundos a que haya hueco.
+    """
+
+    def __init__(self, block_timeout=1.0):
+        self.block_timeout = block_timeout
+        self._subscriptions = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, callback, **options):
+        """Suscribe un callback a un tema
+
+        Args:
+            topic: Nombre del tema
+            callback: Función a invocar con los argumentos de cada evento
+            **options: maxsize, overflow, batch, max_batch y name de Subscription
+
+        Returns:
+            Subscription: La suscripción creada
+        """
+        subscription = Subscription(topic, callback, **options)
+        with self._lock:
+            self._subscriptions[topic].append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.topic, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+        subscription.close()
+
+    def has_subscribers(self, topic):
+        with self._lock:
+            return bool(self._subscriptions.get(topic))
+
+    def publish(self, topic, *args):
+        """Publica un evento para todos los suscriptores del tema sin esperar a
+        que se entregue
+
+        Returns:
+            int: Número de suscriptores que aceptaron el evento
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        accepted = 0
+        for subscription in subscriptions:
+            if subscription.offer(args, self.block_timeout):
+                accepted += 1
+        return accepted
+
+    def stats(self):
+        """Métricas por suscriptor: cola, entregados, descartados y retraso"""
+        with self._lock:
+            subscriptions = [s for subs in self._subscriptions.values() for s in subs]
+        return [s.stats() for s in subscriptions]
+
+    def close(self):
+        with self._lock:
+            subscriptions = [s for subs in self._subscriptions.values() for s in subs]
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            subscription.close()
@@ -0,0 +1,479 @@
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("LCP")
+
+# Coste aproximado de un registro sin contar el texto (objeto con __slots__,
+# float de la marca de tiempo, enteros y la casilla del deque) y de una
+# conversación vacía (bloque del deque, entrada del OrderedDict y clave)
+_RECORD_OVERHEAD = 170
+_CONVERSATION_OVERHEAD = 1000
+
+
+class HistoryRecord:
+    """Mensaje del historial en memoria.
+
+    Usa __slots__ y guarda la marca de tiempo como float para que miles de
+    mensajes residentes ocupen lo mínimo; to_dict() da el formato público.
+    """
+
+    __slots__ = ("seq", "sender", "text", "ts", "ord", "broadcast")
+
+    def __init__(self, seq, sender, text, ts, ordinal=None, broadcast=False):
+        self.seq = seq
+        self.sender = sender
+        self.text = text
+        self.ts = ts
+        self.ord = ordinal
+        self.broadcast = broadcast
+
+    @classmethod
+    def from_record(cls, record):
+        """Crea un registro a partir del formato del diario (from, text, ts...)"""
+        return cls(
+            record.get("seq", 0),
+            record["from"],
+            record["text"],
+            record["ts"],
+            record.get("ord"),
+            bool(record.get("broadcast", False)),
+        )
+
+    def to_record(self):
+        """Formato serializable del diario y de los archivos de desalojo"""
+        record = {
+            "seq": self.seq,
+            "from": self.sender,
+            "text": self.text,
+            "ts": self.ts,
+        }
+        if self.ord is not None:
+            record["ord"] = self.ord
+        if self.broadcast:
+            record["broadcast"] = True
+        return record
+
+    def to_dict(self):
+        """Formato público: from, text, timestamp (datetime) y ord/broadcast"""
+        message = {
+            "from": self.sender,
+            "text": self.text,
+            "timestamp": datetime.fromtimestamp(self.ts),
+        }
+        if self.ord is not None:
+            message["ord"] = self.ord
+        if self.broadcast:
+            message["broadcast"] = True
+        return message
+
+    def size(self):
+        return _RECORD_OVERHEAD + sys.getsizeof(self.text)
+
+
+class _Conversation:
+    __slots__ = ("records", "size", "last_access", "max_seq", "loaded")
+
+    def __init__(self, max_messages, loaded=True):
+        self.records = collections.deque(maxlen=max_messages)
+        self.size = _CONVERSATION_OVERHEAD
+        self.last_access = time.monotonic()
+        self.max_seq = 0
+        # False si solo contiene lo añadido desde que se desalojó: lo anterior
+        # sigue en disco y se incorpora en el siguiente get()
+        self.loaded = loaded
+
+    def insert(self, record):
+        """Inserta un registro en orden cronológico; False si ya estaba"""
+        records = self.records
+        if record.seq and record.seq <= self.max_seq:
+            return False
+
+        index = len(records)
+        while index and records[index - 1].ts > record.ts:
+            index -= 1
+        if len(records) == records.maxlen:
+            if index == 0:
+                # Anterior a todo lo que cabe en la ventana
+                return False
+            self.size -= records.popleft().size()
+            index -= 1
+        records.insert(index, record)
+
+        self.size += record.size()
+        self.max_seq = max(self.max_seq, record.seq)
+        return True
+
+
+def _merge(records, max_messages):
+    """Ventana de una conversación con registros de varias fuentes"""
+    conversation = _Conversation(max_messages)
+    # Por seq, para que la deduplicación no descarte mensajes
+    # sincronizados, que tienen un seq posterior a su marca de tiempo
+    for record in sorted(records, key=lambda r: r.seq):
+        conversation.insert(record)
+    return conversation
+
+
+class HistoryCache:
+    """Historial en memoria por peer con presupuesto global y desalojo a disco.
+
+    Cada conversación es un buffer circular (deque con maxlen) de HistoryRecord.
+    Las conversaciones se mantienen en orden LRU: cuando el tamaño estimado de
+    todas supera memory_budget, o una lleva más de idle_timeout segundos sin
+    usarse (evict_idle()), se desaloja. Una conversación desalojada se recupera
+    de forma transparente en el siguiente get().
+
+    append() nunca lee de disco: un mensaje para una conversación desalojada
+    abre una conversación parcial que se completa en el siguiente get(). Así
+    el camino de cada mensaje no espera a E/S aunque el llamante tenga tomado
+    un lock global.
+
+    Con spill_dir, las conversaciones desalojadas se escriben en un archivo por
+    peer en ese directorio. La escritura la hace write_spills() fuera del lock
+    de la caché; hasta entonces siguen en memoria. Con loader, en cambio, se
+    descartan y se vuelven a pedir a loader(peer), útil cuando ya hay un
+    almacén consultable.
+    """
+
+    def __init__(
+        self,
+        max_messages,
+        memory_budget=8 * 1024 * 1024,
+        idle_timeout=600,
+        spill_dir=None,
+        loader=None,
+    ):
+        """
+        Args:
+            max_messages: Mensajes que se conservan por conversación
+            memory_budget: Bytes estimados máximos de todas las conversaciones
+            idle_timeout: Segundos sin acceso tras los que se desaloja una
+                conversación
+            spill_dir: Directorio donde se escriben las conversaciones desalojadas
+            loader: Función (peer) -> lista de HistoryRecord para recuperar una
+                conversación no residente
+        """
+        self.max_messages = max_messages
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.spill_dir = spill_dir
+        self.loader = loader
+
+        self._conversations = collections.OrderedDict()
+        self._size = 0
+        self._evictions = 0
+        self._faults = 0
+        self._lock = threading.RLock()
+
+        # Desalojos pendientes de escribir: {peer: {"records": [...], "state": ...}}
+        self._spilling = {}
+        self._spilling_size = 0
+        # Entrada de _spilling que write_spills() está escribiendo
+        self._writing = None
+        self._spill_io_lock = threading.Lock()
+        self._spill_files = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spill_files = sum(
+                1
+                for name in os.listdir(spill_dir)
+                if self._peer_from_spill_name(name) is not None
+            )
+
+    def _spill_path(self, peer_id):
+        name = peer_id.encode("utf-8").hex()
+        return os.path.join(self.spill_dir, f"{name}.json")
+
+    @staticmethod
+    def _peer_from_spill_name(name):
+        base, ext = os.path.splitext(name)
+        if ext != ".json":
+            return None
+        try:
+            return bytes.fromhex(base).decode("utf-8")
+        except ValueError:
+            return None
+
+    def _spilled_entries(self, peer_id):
+        """Desalojos de peer_id aún no escritos (en curso y pendientes)"""
+        entries = []
+        if self._writing is not None and self._writing[0] == peer_id:
+            entries.append(self._writing[1])
+        if peer_id in self._spilling:
+            entries.append(self._spilling[peer_id])
+        return entries
+
+    def _read_spill(self, peer_id):
+        """Contenido del archivo de desalojo de un peer (None si no existe)"""
+        try:
+            with open(self._spill_path(peer_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error recuperando historial desalojado de {peer_id}: {e}")
+            return {}
+
+    def _spill_records(self, peer_id, data):
+        """Registros de un archivo de desalojo leído con _read_spill()"""
+        try:
+            return [HistoryRecord.from_record(r) for r in data.get("records", ())]
+        except (KeyError, TypeError) as e:
+            logger.error(f"Error recuperando historial desalojado de {peer_id}: {e}")
+            return []
+
+    def _conversation(self, peer_id):
+        """Devuelve la conversación residente, recuperándola si se desalojó"""
+        conversation = self._conversations.get(peer_id)
+        if conversation is None or not conversation.loaded:
+            records = self._fault_in(peer_id)
+            if records is None and conversation is None:
+                return None
+            partial = conversation
+            conversation = _merge(
+                (records or []) + list(partial.records if partial else ()),
+                self.max_messages,
+            )
+            self._size += conversation.size - (partial.size if partial else 0)
+            self._conversations[peer_id] = conversation
+        conversation.last_access = time.monotonic()
+        self._conversations.move_to_end(peer_id)
+        return conversation
+
+    def _fault_in(self, peer_id):
+        records = None
+        if self.loader is not None:
+            records = self.loader(peer_id)
+        elif self.spill_dir:
+            data = self._read_spill(peer_id)
+            pending = self._spilled_entries(peer_id)
+            if data is not None or pending:
+                records = self._spill_records(peer_id, data or {})
+                for entry in pending:
+                    records.extend(entry["records"])
+        if records:
+            self._faults += 1
+            logger.debug(f"Historial de {peer_id} recuperado ({len(records)} mensajes)")
+        return records
+
+    def _insert(self, conversation, record):
+        size = conversation.size
+        inserted = conversation.insert(record)
+        self._size += conversation.size - size
+        return inserted
+
+    def append(self, peer_id, record):
+        """Añade un mensaje a la conversación con peer_id
+
+        No lee de disco: si la conversación no está en memoria se abre una
+        parcial con este mensaje.
+
+        Returns:
+            bool: False si el registro ya estaba entre los residentes (mismo
+            seq o anterior)
+        """
+        with self._lock:
+            conversation = self._conversations.get(peer_id)
+            if conversation is None:
+                conversation = _Conversation(self.max_messages, loaded=False)
+                self._conversations[peer_id] = conversation
+                self._size += conversation.size
+            conversation.last_access = time.monotonic()
+            self._conversations.move_to_end(peer_id)
+            inserted = self._insert(conversation, record)
+            self._enforce_budget()
+            return inserted
+
+    def get(self, peer_id):
+        """Mensajes de una conversación en orden cronológico"""
+        with self._lock:
+            conversation = self._conversation(peer_id)
+            return list(conversation.records) if conversation else []
+
+    def items(self):
+        """Conversaciones en memoria como lista de (peer, [HistoryRecord])
+
+        Incluye las desalojadas que aún no se han escrito en disco.
+        """
+        with self._lock:
+            conversations = {}
+            pending = set(self._spilling)
+            if self._writing is not None:
+                pending.add(self._writing[0])
+            for peer_id in pending:
+                conversation = self._conversations.get(peer_id)
+                # Una conversación recuperada ya incluye lo pendiente
+                if conversation is None or not conversation.loaded:
+                    conversations[peer_id] = [
+                        record
+                        for entry in self._spilled_entries(peer_id)
+                        for record in entry["records"]
+                    ]
+            for peer_id, conversation in self._conversations.items():
+                conversations.setdefault(peer_id, []).extend(conversation.records)
+            return list(conversations.items())
+
+    def resident_peers(self):
+        """Peers cuya conversación está en memoria (completa o parcial)"""
+        with self._lock:
+            return list(self._conversations.keys())
+
+    def peers(self):
+        """Peers con historial, residentes o desalojados a disco"""
+        spilled = set()
+        if self.spill_dir:
+            for name in os.listdir(self.spill_dir):
+                peer_id = self._peer_from_spill_name(name)
+                if peer_id is not None:
+                    spilled.add(peer_id)
+        with self._lock:
+            return list(self._conversations.keys() | self._spilling.keys() | spilled)
+
+    def __contains__(self, peer_id):
+        with self._lock:
+            if peer_id in self._conversations or self._spilled_entries(peer_id):
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(peer_id))
+
+    def _pending_spill(self, peer_id):
+        entry = self._spilling.get(peer_id)
+        if entry is None:
+            entry = self._spilling[peer_id] = {"records": [], "state": None, "size": 0}
+        return entry
+
+    def _evict(self, peer_id):
+        conversation = self._conversations.pop(peer_id)
+        self._size -= conversation.size
+        self._evictions += 1
+        if self.spill_dir and self.loader is None:
+            # Se escribe en write_spills(), fuera del lock
+            entry = self._pending_spill(peer_id)
+            entry["records"].extend(conversation.records)
+            entry["size"] += conversation.size
+            self._spilling_size += conversation.size
+        logger.debug(
+            f"Historial de {peer_id} desalojado ({len(conversation.records)} mensajes)"
+        )
+
+    def _enforce_budget(self):
+        # Nunca se desaloja la conversación recién usada (la última del LRU)
+        while self._size > self.memory_budget and len(self._conversations) > 1:
+            self._evict(next(iter(self._conversations)))
+
+    def evict_idle(self):
+        """Desaloja las conversaciones sin acceso desde hace idle_timeout segundos
+
+        Returns:
+            int: Número de conversaciones desalojadas
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = 0
+        with self._lock:
+            while self._conversations:
+                peer_id, conversation = next(iter(self._conversations.items()))
+                if conversation.last_access > cutoff:
+                    break
+                self._evict(peer_id)
+                evicted += 1
+        if evicted:
+            logger.info(f"{evicted} conversaciones inactivas desalojadas de memoria")
+        return evicted
+
+    def save_state(self, peer_id, state):
+        """Guarda datos serializables de un peer junto a su conversación desalojada
+
+        Solo con spill_dir: se escriben con write_spills() y se leen con
+        load_state(). Permite al llamante descartar de memoria el estado de las
+        conversaciones que no se usan.
+        """
+        if not self.spill_dir or self.loader is not None:
+            return
+        with self._lock:
+            self._pending_spill(peer_id)["state"] = state
+
+    def load_state(self, peer_id):
+        """Datos guardados con save_state() (None si no hay). Puede leer de disco"""
+        if not self.spill_dir or self.loader is not None:
+            return None
+        with self._lock:
+            for entry in reversed(self._spilled_entries(peer_id)):
+                if entry["state"] is not None:
+                    return entry["state"]
+        data = self._read_spill(peer_id)
+        return data.get("state") if data else None
+
+    def _write_spill(self, peer_id, entry):
+        """Combina un desalojo pendiente con el archivo del peer y lo reescribe"""
+        path = self._spill_path(peer_id)
+        data = self._read_spill(peer_id)
+        created = data is None
+        data = data or {}
+        records = self._spill_records(peer_id, data) + entry["records"]
+        state = entry["state"] if entry["state"] is not None else data.get("state")
+
+        merged = {
+            "peer": peer_id,
+            "records": [
+                r.to_record() for r in _merge(records, self.max_messages).records
+            ],
+        }
+        if state is not None:
+            merged["state"] = state
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        return created
+
+    def write_spills(self):
+        """Escribe en disco las conversaciones desalojadas pendientes
+
+        La lectura y escritura de los archivos se hacen sin el lock de la
+        caché. Si otro hilo ya está escribiendo, vuelve enseguida: ese hilo
+        recoge también lo que quede pendiente.
+        """
+        while self._spilling:
+            if not self._spill_io_lock.acquire(blocking=False):
+                return
+            try:
+                while True:
+                    with self._lock:
+                        if not self._spilling:
+                            break
+                        peer_id = next(iter(self._spilling))
+                        entry = self._spilling.pop(peer_id)
+                        self._writing = (peer_id, entry)
+                    try:
+                        created = self._write_spill(peer_id, entry)
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        created = False
+                        logger.error(
+                            f"Error escribiendo historial desalojado de {peer_id}: {e}"
+                        )
+                    with self._lock:
+                        self._writing = None
+                        self._spilling_size -= entry["size"]
+                        self._spill_files += created
+            finally:
+                self._spill_io_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident_peers": len(self._conversations),
+                "spilled_peers": self._spill_files,
+                "pending_spills": len(self._spilling),
+                "resident_messages": sum(
+                    len(c.records) for c in self._conversations.values()
+                ),
+                "estimated_bytes": self._size + self._spilling_size,
+                "memory_budget": self.memory_budget,
+                "evictions": self._evictions,
+                "faults": self._faults,
+            }
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from .history_sync import advance_mark
+
+logger = logging.getLogger("LCP")
+
+
+def encode_record(record):
+    """Serializa un registro del diario: 4 bytes de longitud + JSON en UTF-8"""
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    return len(payload).to_bytes(4, "big") + payload
+
+
+def read_records(path):
+    """Lee los registros de un diario.
+
+    Un registro final incompleto (p. ej. por un corte de luz a mitad de
+    escritura) se ignora.
+
+    Returns:
+        list: Registros en orden de escritura
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    offset = 0
+    while offset + 4 <= len(data):
+        length = int.from_bytes(data[offset : offset + 4], "big")
+        end = offset + 4 + length
+        if end > len(data):
+            logger.warning(f"Registro incompleto al final de {path}, ignorado")
+            break
+        try:
+            records.append(json.loads(data[offset + 4 : end].decode("utf-8")))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.warning(f"Registro corrupto en {path}: {e}")
+            break
+        offset = end
+    return records
+
+
+def read_history(snapshot_path, journal_path):
+    """Lee una instantánea y los registros del diario posteriores a ella
+
+    Returns:
+        Tuple[dict, list]: (instantánea o None, registros pendientes de aplicar)
+    """
+    snapshot = None
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    records = read_records(journal_path)
+
+    snapshot_seq = 0
+    if isinstance(snapshot, dict) and isinstance(snapshot.get("seq"), int):
+        snapshot_seq = snapshot["seq"]
+    newer = [r for r in records if r.get("seq", 0) > snapshot_seq]
+    return snapshot, sorted(newer, key=lambda r: r["seq"])
+
+
+def snapshot_records(snapshot):
+    """Convierte una instantánea (formato actual o el JSON antiguo por peer) en
+    una lista de registros con el mismo formato que los del diario"""
+    if not snapshot:
+        return []
+    peers = snapshot["peers"] if snapshot.get("version") == 2 else snapshot
+    records = []
+    for peer_id, messages in peers.items():
+        for msg in messages:
+            timestamp = datetime.strptime(msg["timestamp"], "%Y-%m-%d %H:%M:%S")
+            record = {
+                "seq": msg.get("seq", 0),
+                "peer": peer_id,
+                "from": msg["from"],
+                "text": msg["text"],
+                "ts": timestamp.timestamp(),
+            }
+            for key in ("ord", "broadcast"):
+                if key in msg:
+                    record[key] = msg[key]
+            records.append(record)
+    return records
+
+
+class HistoryJournal:
+    """Persistencia del historial con diario de solo-añadir y escritura diferida.
+
+    append() solo encola el registro; un hilo escritor vuelca los pendientes en
+    una única escritura cuando superan flush_bytes o pasan flush_interval
+    segundos. Cada compact_every registros se escribe una instantánea completa
+    (obtenida con snapshot_provider) y se vacía el diario, así que ni el coste
+    de cada mensaje ni el tamaño del diario dependen del tamaño del historial.
+
+    Los registros llevan un número de secuencia 'seq' y la instantánea guarda el
+    último incluido, de modo que al cargar solo se reaplican los registros
+    posteriores.
+    """
+
+    def __init__(
+        self,
+        journal_path,
+        snapshot_path,
+        snapshot_provider,
+        flush_bytes=64 * 1024,
+        flush_interval=1.0,
+        compact_every=5000,
+    ):
+        """
+        Args:
+            journal_path: Ruta del diario
+            snapshot_path: Ruta de la instantánea JSON
+            snapshot_provider: Función sin argumentos que devuelve la instantánea
+                serializable (debe incluir la clave 'seq')
+            flush_bytes: Bytes pendientes que fuerzan un volcado
+            flush_interval: Segundos máximos que un registro espera en memoria
+            compact_every: Registros escritos entre compactaciones
+        """
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_provider = snapshot_provider
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+
+        self._pending = []
+        self._pending_bytes = 0
+        self._enqueued = 0
+        self._written = 0
+        self._written_since_compaction = 0
+        self._compact_requested = False
+        self._compacting = False
+        self._compactions = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="HistoryJournal"
+        )
+        self._thread.start()
+
+    def append(self, record):
+        """Encola un registro para escribirlo en el diario"""
+        data = encode_record(record)
+        with self._cond:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            self._enqueued += 1
+            if self._pending_bytes >= self.flush_bytes:
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (
+                    not self._closed
+                    and not self._compact_requested
+                    and self._pending_bytes < self.flush_bytes
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                closed = self._closed
+                batch = self._pending
+                self._pending = []
+                self._pending_bytes = 0
+                compact = (
+                    self._compact_requested
+                    or self._written_since_compaction + len(batch)
+                    >= self.compact_every
+                )
+                self._compact_requested = False
+                self._compacting = compact
+
+            try:
+                self._write(batch)
+                if compact:
+                    self._compact()
+            except Exception as e:
+                logger.error(
+                    f"Error escribiendo el diario de historial: {e}", exc_info=True
+                )
+
+            with self._cond:
+                self._written += len(batch)
+                if compact:
+                    self._compactions += 1
+                    self._compacting = False
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._io_lock:
+            with open(self.journal_path, "ab") as f:
+                f.write(b"".join(batch))
+        self._written_since_compaction += len(batch)
+        logger.debug(f"Diario de historial: {len(batch)} registros escritos")
+
+    def _compact(self):
+        snapshot = self.snapshot_provider()
+        temp_path = f"{self.snapshot_path}.tmp"
+        with self._io_lock:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(temp_path, self.snapshot_path)
+            # Se conservan los registros añadidos mientras se tomaba la
+            # instantánea (seq posterior al que ella incluye)
+            kept = [
+                encode_record(r)
+                for r in read_records(self.journal_path)
+                if r.get("seq", 0) > snapshot.get("seq", 0)
+            ]
+            with open(self.journal_path, "wb") as f:
+                f.write(b"".join(kept))
+        self._written_since_compaction = len(kept)
+        logger.info(f"Historial compactado en {self.snapshot_path}")
+
+    def flush(self):
+        """Espera a que todos los registros encolados hasta ahora estén escritos"""
+        with self._cond:
+            target = self._enqueued
+            # Forzamos el volcado aunque no se haya llegado a flush_bytes
+            self._pending_bytes = max(self._pending_bytes, self.flush_bytes)
+            self._cond.notify_all()
+            while self._written < target and self._thread.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    def compact(self):
+        """Escribe una instantánea y vacía el diario"""
+        with self._cond:
+            # Una compactación ya en marcha pudo tomar la instantánea antes
+            target = self._compactions + (2 if self._compacting else 1)
+            self._compact_requested = True
+            self._cond.notify_all()
+            while self._compactions < target and self._thread.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    def load(self):
+        """Lee la instantánea y los registros del diario posteriores a ella
+
+        Returns:
+            Tuple[dict, list]: (instantánea o None, registros pendientes de aplicar)
+        """
+        with self._io_lock:
+            return read_history(self.snapshot_path, self.journal_path)
+
+    def last_seq(self):
+        """Último número de secuencia persistido (0 si no hay historial)"""
+        snapshot, records = self.load()
+        seq = 0
+        if isinstance(snapshot, dict) and isinstance(snapshot.get("seq"), int):
+            seq = snapshot["seq"]
+        return max([seq] + [r.get("seq", 0) for r in records])
+
+    def ordinal_marks(self):
+        """Mayor ordinal guardado de cada autor por conversación
+
+        Returns:
+            dict: {peer: {"self": n, "peer": m}}
+        """
+        snapshot, records = self.load()
+        marks = {}
+        if isinstance(snapshot, dict) and snapshot.get("version") == 2:
+            for peer_id, conversation in snapshot.get("marks", {}).items():
+                marks[peer_id] = {
+                    "self": conversation.get("self", 0),
+                    "peer": conversation.get("peer", 0),
+                }
+        for record in snapshot_records(snapshot) + records:
+            if record.get("ord") is not None and not record.get("broadcast"):
+                author = "self" if record["from"] == "self" else "peer"
+                advance_mark(marks, record["peer"], author, record["ord"])
+        return marks
+
+    def close(self):
+        """Vuelca lo pendiente y detiene el hilo escritor"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
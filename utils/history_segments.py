@@ -0,0 +1,379 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("LCP")
+
+# Cabecera del índice: magia, versión, mayor seq y marcas de agua por autor
+_INDEX_MAGIC = b"LCPI"
+_INDEX_VERSION = 1
+_HEADER = struct.Struct(">4sB3xQQQ")
+# Entrada del índice: marca de tiempo, offset del registro en el .dat y seq
+_ENTRY = struct.Struct(">dQQ")
+# Registro del .dat (tras 4 bytes de longitud): seq, ts, ordinal (-1 = sin
+# ordinal) y flags; a continuación el texto en UTF-8
+_RECORD = struct.Struct(">QdqB")
+_LENGTH = struct.Struct(">I")
+
+_FLAG_OUTGOING = 0x01
+_FLAG_BROADCAST = 0x02
+
+
+def _encode_record(record):
+    flags = _FLAG_OUTGOING if record["from"] == "self" else 0
+    if record.get("broadcast"):
+        flags |= _FLAG_BROADCAST
+    ordinal = record.get("ord")
+    payload = _RECORD.pack(
+        record["seq"], record["ts"], -1 if ordinal is None else ordinal, flags
+    ) + record["text"].encode("utf-8")
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _decode_record(data, offset, peer):
+    (length,) = _LENGTH.unpack_from(data, offset)
+    start = offset + _LENGTH.size
+    seq, ts, ordinal, flags = _RECORD.unpack_from(data, start)
+    text = bytes(data[start + _RECORD.size : start + length]).decode(
+        "utf-8", errors="replace"
+    )
+    record = {
+        "seq": seq,
+        "peer": peer,
+        "from": "self" if flags & _FLAG_OUTGOING else peer,
+        "text": text,
+        "ts": ts,
+    }
+    if ordinal >= 0:
+        record["ord"] = ordinal
+    if flags & _FLAG_BROADCAST:
+        record["broadcast"] = True
+    return record
+
+
+def _map(f):
+    """mmap de solo lectura de un archivo (None si está vacío)"""
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SegmentHistoryStore:
+    """Historial en archivos binarios por peer con índice de offsets.
+
+    Cada conversación tiene un archivo de registros '<peer>.dat' de solo-añadir
+    y un índice '<peer>.idx' con una cabecera fija (mayor seq y marcas de agua)
+    seguida de entradas de tamaño fijo (ts, offset, seq) ordenadas por marca de
+    tiempo. Una página de mensajes se obtiene con una búsqueda binaria en el
+    índice mapeado en memoria y lecturas directas de los registros que pide, así
+    que ni el arranque ni la lectura de una conversación dependen del tamaño
+    total del historial.
+
+    Como los otros almacenes, append() solo encola y un hilo escritor vuelca los
+    registros por lotes cada flush_interval segundos o batch_size registros.
+    """
+
+    def __init__(self, directory, batch_size=200, flush_interval=0.5):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._closed = False
+        self._flush_requested = False
+        self._enqueued = 0
+        self._written = 0
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="HistorySegments"
+        )
+        self._thread.start()
+
+    def _path(self, peer, ext):
+        name = peer.encode("utf-8").hex()
+        return os.path.join(self.directory, f"{name}{ext}")
+
+    def append(self, record):
+        """Encola un registro (seq, peer, from, text, ts y opcionalmente ord y
+        broadcast) para escribirlo"""
+        with self._cond:
+            self._pending.append(record)
+            self._enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def append_many(self, records):
+        for record in records:
+            self.append(record)
+
+    def has_pending(self, peer):
+        """Indica si hay mensajes de peer encolados y aún sin escribir"""
+        with self._cond:
+            return any(record["peer"] == peer for record in self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (
+                    not self._closed
+                    and not self._flush_requested
+                    and len(self._pending) < self.batch_size
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                self._flush_requested = False
+                closed = self._closed
+
+            by_peer = {}
+            for record in batch:
+                by_peer.setdefault(record["peer"], []).append(record)
+            for peer, records in by_peer.items():
+                try:
+                    with self._io_lock:
+                        self._write_peer(peer, records)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error escribiendo historial de {peer}: {e}")
+            if batch:
+                logger.debug(f"Historial binario: {len(batch)} mensajes escritos")
+
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _write_peer(self, peer, records):
+        with open(self._path(peer, ".dat"), "ab") as data_file:
+            offsets = []
+            for record in records:
+                offsets.append(data_file.tell())
+                data_file.write(_encode_record(record))
+
+        index_path = self._path(peer, ".idx")
+        if not os.path.exists(index_path):
+            with open(index_path, "wb") as f:
+                f.write(_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, 0, 0, 0))
+
+        with open(index_path, "r+b") as f:
+            magic, version, max_seq, self_mark, peer_mark = _HEADER.unpack(
+                f.read(_HEADER.size)
+            )
+            if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+                raise ValueError(f"Índice de historial inválido: {index_path}")
+            size = os.fstat(f.fileno()).st_size
+            # Una entrada final incompleta (escritura interrumpida) se descarta
+            count = (size - _HEADER.size) // _ENTRY.size
+
+            for record, offset in zip(records, offsets):
+                self._insert_entry(f, count, record["ts"], offset, record["seq"])
+                count += 1
+                max_seq = max(max_seq, record["seq"])
+                ordinal = record.get("ord")
+                if ordinal is not None and not record.get("broadcast"):
+                    if record["from"] == "self":
+                        self_mark = max(self_mark, ordinal)
+                    else:
+                        peer_mark = max(peer_mark, ordinal)
+
+            f.seek(0)
+            f.write(
+                _HEADER.pack(
+                    _INDEX_MAGIC, _INDEX_VERSION, max_seq, self_mark, peer_mark
+                )
+            )
+
+    def _insert_entry(self, f, count, ts, offset, seq):
+        """Inserta una entrada manteniendo el índice ordenado por marca de tiempo
+
+        Casi siempre es un añadido al final; un mensaje sincronizado anterior a
+        los últimos solo desplaza las pocas entradas posteriores a él.
+        """
+        position = count
+        while position:
+            f.seek(_HEADER.size + (position - 1) * _ENTRY.size)
+            (previous_ts,) = struct.unpack(">d", f.read(8))
+            if previous_ts <= ts:
+                break
+            position -= 1
+
+        f.seek(_HEADER.size + position * _ENTRY.size)
+        tail = f.read((count - position) * _ENTRY.size)
+        f.seek(_HEADER.size + position * _ENTRY.size)
+        f.write(_ENTRY.pack(ts, offset, seq) + tail)
+        f.truncate()
+
+    def flush(self):
+        """Espera a que los registros encolados hasta ahora estén escritos"""
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._written < target and self._thread.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    def _read_header(self, peer):
+        try:
+            with open(self._path(peer, ".idx"), "rb") as f:
+                data = f.read(_HEADER.size)
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, max_seq, self_mark, peer_mark = _HEADER.unpack(data)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            logger.warning(f"Índice de historial inválido para {peer}")
+            return None
+        return max_seq, self_mark, peer_mark
+
+    def _read_entries(self, peer, before=None, limit=None):
+        """Lee del índice las entradas de una página
+
+        Returns:
+            list: Tuplas (ts, offset, seq) en orden cronológico
+        """
+        try:
+            f = open(self._path(peer, ".idx"), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            index = _map(f)
+            if index is None:
+                return []
+            with index:
+                count = (len(index) - _HEADER.size) // _ENTRY.size
+                end = count
+                if before is not None:
+                    # Primera entrada con ts >= before
+                    low, high = 0, count
+                    while low < high:
+                        middle = (low + high) // 2
+                        (ts,) = struct.unpack_from(
+                            ">d", index, _HEADER.size + middle * _ENTRY.size
+                        )
+                        if ts < before:
+                            low = middle + 1
+                        else:
+                            high = middle
+                    end = low
+                start = 0 if limit is None else max(0, end - limit)
+                return [
+                    _ENTRY.unpack_from(index, _HEADER.size + i * _ENTRY.size)
+                    for i in range(start, end)
+                ]
+
+    def _read_records(self, peer, entries):
+        if not entries:
+            return []
+        with open(self._path(peer, ".dat"), "rb") as f:
+            data = _map(f)
+            if data is None:
+                return []
+            with data:
+                return [_decode_record(data, offset, peer) for _, offset, _ in entries]
+
+    def recent_records(self, peer, limit, before=None):
+        """Mensajes con un peer como registros del diario, en orden cronológico
+
+        Args:
+            peer: ID normalizado del peer
+            limit: Número máximo de mensajes (los más recientes de la página)
+            before: Marca de tiempo (float); solo mensajes anteriores a ella
+        """
+        with self._io_lock:
+            entries = self._read_entries(peer, before, limit)
+            return self._read_records(peer, entries)
+
+    def peers(self):
+        """Peers con historial (los nombres de los índices del directorio)"""
+        peers = []
+        for name in os.listdir(self.directory):
+            base, ext = os.path.splitext(name)
+            if ext != ".idx":
+                continue
+            try:
+                peers.append(bytes.fromhex(base).decode("utf-8"))
+            except ValueError:
+                continue
+        return peers
+
+    def search(self, query, peer=None, limit=50):
+        """Busca mensajes que contengan todos los términos de query
+
+        Recorre los registros de las conversaciones afectadas, así que su coste
+        sí depende del tamaño del historial.
+
+        Returns:
+            list: Mensajes (más recientes primero) con peer, from, text y timestamp
+        """
+        terms = [term.lower() for term in query.split()]
+        if not terms:
+            return []
+
+        matches = []
+        for peer_id in [peer] if peer is not None else self.peers():
+            with self._io_lock:
+                records = self._read_records(peer_id, self._read_entries(peer_id))
+            matches.extend(
+                record
+                for record in records
+                if all(term in record["text"].lower() for term in terms)
+            )
+        matches.sort(key=lambda record: record["ts"], reverse=True)
+
+        messages = []
+        for record in matches[:limit]:
+            message = {
+                "peer": record["peer"],
+                "from": record["from"],
+                "text": record["text"],
+                "timestamp": datetime.fromtimestamp(record["ts"]),
+            }
+            for key in ("ord", "broadcast"):
+                if key in record:
+                    message[key] = record[key]
+            messages.append(message)
+        return messages
+
+    def last_seq(self):
+        headers = [self._read_header(peer) for peer in self.peers()]
+        return max([0] + [header[0] for header in headers if header])
+
+    def ordinal_marks(self, peer=None):
+        """Mayor ordinal guardado de cada autor por conversación
+
+        Args:
+            peer: ID normalizado de un peer para leer solo la cabecera de su
+                índice en lugar de la de todos
+
+        Returns:
+            dict: {peer: {"self": n, "peer": m}}
+        """
+        marks = {}
+        for peer_id in self.peers() if peer is None else [peer]:
+            header = self._read_header(peer_id)
+            if header and (header[1] or header[2]):
+                marks[peer_id] = {"self": header[1], "peer": header[2]}
+        return marks
+
+    def is_empty(self):
+        return not self.peers()
+
+    def close(self):
+        """Escribe lo pendiente y detiene el hilo escritor"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
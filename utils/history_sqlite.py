@@ -0,0 +1,307 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("LCP")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    peer TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL,
+    ts REAL NOT NULL,
+    ord INTEGER,
+    broadcast INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_peer_ts ON messages (peer, ts);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(text, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+# Columnas añadidas después de la primera versión del esquema
+_MIGRATIONS = {
+    "ord": "ALTER TABLE messages ADD COLUMN ord INTEGER",
+    "broadcast": (
+        "ALTER TABLE messages ADD COLUMN broadcast INTEGER NOT NULL DEFAULT 0"
+    ),
+}
+
+
+def _fts_query(query):
+    """Convierte texto libre en una consulta FTS5 de términos literales"""
+    terms = query.split()
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _row_to_message(row):
+    peer, sender, text, ts, ordinal, broadcast = row
+    message = {
+        "peer": peer,
+        "from": sender,
+        "text": text,
+        "timestamp": datetime.fromtimestamp(ts),
+    }
+    if ordinal is not None:
+        message["ord"] = ordinal
+    if broadcast:
+        message["broadcast"] = True
+    return message
+
+
+class SQLiteHistoryStore:
+    """Historial de mensajes en SQLite (modo WAL) con búsqueda de texto completo.
+
+    Los registros se insertan por lotes desde un hilo escritor propio: append()
+    solo encola, y el hilo hace un executemany en una transacción cuando hay
+    batch_size registros o pasan flush_interval segundos. Las lecturas usan otra
+    conexión, que en modo WAL no espera a las escrituras.
+
+    Si SQLite no se compiló con FTS5, search() recurre a LIKE.
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=0.5):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._closed = False
+        self._flush_requested = False
+        self._enqueued = 0
+        self._written = 0
+        self._cond = threading.Condition()
+
+        self._write_conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        self._write_conn.executescript(_SCHEMA)
+        columns = {
+            row[1] for row in self._write_conn.execute("PRAGMA table_info(messages)")
+        }
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                self._write_conn.execute(statement)
+        try:
+            self._write_conn.executescript(_FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 no disponible, la búsqueda usará LIKE: {e}")
+            self.has_fts = False
+        self._write_conn.commit()
+
+        self._read_conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="HistorySQLite"
+        )
+        self._thread.start()
+
+    def append(self, record):
+        """Encola un registro (seq, peer, from, text, ts y opcionalmente ord y
+        broadcast) para insertarlo"""
+        with self._cond:
+            self._pending.append(
+                (
+                    record["seq"],
+                    record["peer"],
+                    record["from"],
+                    record["text"],
+                    record["ts"],
+                    record.get("ord"),
+                    int(record.get("broadcast", False)),
+                )
+            )
+            self._enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def append_many(self, records):
+        for record in records:
+            self.append(record)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (
+                    not self._closed
+                    and not self._flush_requested
+                    and len(self._pending) < self.batch_size
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                self._flush_requested = False
+                closed = self._closed
+
+            if batch:
+                try:
+                    with self._write_conn:
+                        self._write_conn.executemany(
+                            "INSERT INTO messages "
+                            "(seq, peer, sender, text, ts, ord, broadcast) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            batch,
+                        )
+                    logger.debug(f"Historial SQLite: {len(batch)} mensajes insertados")
+                except sqlite3.Error as e:
+                    logger.error(f"Error insertando historial en SQLite: {e}")
+
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+            if closed:
+                self._write_conn.close()
+                return
+
+    def flush(self):
+        """Espera a que los registros encolados hasta ahora estén insertados"""
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._written < target and self._thread.is_alive():
+                self._cond.wait(self.flush_interval)
+
+    def has_pending(self, peer):
+        """Indica si hay mensajes de peer encolados y aún sin insertar"""
+        with self._cond:
+            return any(row[1] == peer for row in self._pending)
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            return self._read_conn.execute(sql, params).fetchall()
+
+    def recent(self, peer, limit):
+        """Últimos limit mensajes con un peer, en orden cronológico"""
+        rows = self._query(
+            "SELECT peer, sender, text, ts, ord, broadcast FROM messages "
+            "WHERE peer = ? "
+            "ORDER BY ts DESC, id DESC LIMIT ?",
+            (peer, limit),
+        )
+        return [_row_to_message(row) for row in reversed(rows)]
+
+    def recent_records(self, peer, limit, before=None):
+        """Mensajes con un peer como registros del diario, en orden cronológico
+
+        Args:
+            peer: ID normalizado del peer
+            limit: Número máximo de mensajes (los más recientes de la página)
+            before: Marca de tiempo (float); solo mensajes anteriores a ella
+        """
+        before_filter = " AND ts < ?" if before is not None else ""
+        before_params = (before,) if before is not None else ()
+        rows = self._query(
+            "SELECT seq, sender, text, ts, ord, broadcast FROM messages "
+            f"WHERE peer = ?{before_filter} ORDER BY ts DESC, id DESC LIMIT ?",
+            (peer,) + before_params + (limit,),
+        )
+        records = []
+        for seq, sender, text, ts, ordinal, broadcast in reversed(rows):
+            record = {"seq": seq, "peer": peer, "from": sender, "text": text, "ts": ts}
+            if ordinal is not None:
+                record["ord"] = ordinal
+            if broadcast:
+                record["broadcast"] = True
+            records.append(record)
+        return records
+
+    def peers(self):
+        return [row[0] for row in self._query("SELECT DISTINCT peer FROM messages", ())]
+
+    def search(self, query, peer=None, limit=50):
+        """Busca mensajes que contengan todos los términos de query
+
+        Returns:
+            list: Mensajes (más recientes primero) con peer, from, text y timestamp
+        """
+        if not query.strip():
+            return []
+
+        peer_filter = " AND m.peer = ?" if peer is not None else ""
+        peer_params = (peer,) if peer is not None else ()
+
+        if self.has_fts:
+            sql = (
+                "SELECT m.peer, m.sender, m.text, m.ts, m.ord, m.broadcast "
+                "FROM messages_fts f "
+                "JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?"
+                f"{peer_filter} ORDER BY m.ts DESC LIMIT ?"
+            )
+            params = (_fts_query(query),) + peer_params + (limit,)
+        else:
+            terms = query.split()
+            like = " AND ".join("m.text LIKE ? ESCAPE '\\'" for _ in terms)
+            sql = (
+                "SELECT m.peer, m.sender, m.text, m.ts, m.ord, m.broadcast "
+                f"FROM messages m WHERE {like}"
+                f"{peer_filter} ORDER BY m.ts DESC LIMIT ?"
+            )
+            escaped = [
+                "%"
+                + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                + "%"
+                for t in terms
+            ]
+            params = tuple(escaped) + peer_params + (limit,)
+
+        return [_row_to_message(row) for row in self._query(sql, params)]
+
+    def last_seq(self):
+        row = self._query("SELECT MAX(seq) FROM messages", ())[0]
+        return row[0] or 0
+
+    def ordinal_marks(self, peer=None):
+        """Mayor ordinal guardado de cada autor por conversación
+
+        Args:
+            peer: ID normalizado de un peer para consultar solo su conversación
+
+        Returns:
+            dict: {peer: {"self": n, "peer": m}}
+        """
+        marks = {}
+        peer_filter = " AND peer = ?" if peer is not None else ""
+        peer_params = (peer,) if peer is not None else ()
+        rows = self._query(
+            "SELECT peer, sender = 'self', MAX(ord) FROM messages "
+            f"WHERE ord IS NOT NULL AND broadcast = 0{peer_filter} "
+            "GROUP BY peer, sender = 'self'",
+            peer_params,
+        )
+        for peer_id, own, ordinal in rows:
+            author = "self" if own else "peer"
+            marks.setdefault(peer_id, {"self": 0, "peer": 0})[author] = ordinal
+        return marks
+
+    def is_empty(self):
+        return not self._query("SELECT 1 FROM messages LIMIT 1", ())
+
+    def close(self):
+        """Inserta lo pendiente y cierra las conexiones"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        with self._read_lock:
+            self._read_conn.close()
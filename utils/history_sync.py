@@ -0,0 +1,151 @@
+import json
+import logging
+from datetime import datetime
+
+from protocol import MAX_SYNC_FRAME, SYNC_MAX_MESSAGES
+
+logger = logging.getLogger("LCP")
+
+# Ordinales por debajo de la marca que se recuerdan para deduplicar
+ORDINAL_WINDOW = 1024
+
+
+def send_frame(sock, obj):
+    """Envía un objeto JSON con prefijo de longitud de 4 bytes"""
+    payload = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    sock.sendall(len(payload).to_bytes(4, "big") + payload)
+
+
+def recv_frame(recv_exact):
+    """Recibe un objeto enviado con send_frame()
+
+    Args:
+        recv_exact: Función (size) -> bytes que lee exactamente size bytes
+
+    Raises:
+        ValueError: Si la trama supera MAX_SYNC_FRAME o no es JSON válido
+    """
+    length = int.from_bytes(recv_exact(4), "big")
+    if length > MAX_SYNC_FRAME:
+        raise ValueError(f"Trama de sincronización demasiado grande: {length} bytes")
+    try:
+        return json.loads(recv_exact(length).decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Trama de sincronización inválida: {e}")
+
+
+def advance_mark(marks, peer_id, author, ordinal):
+    """Avanza la marca de agua de un autor en una conversación.
+
+    Args:
+        marks: Diccionario {peer: {"self": n, "peer": m}} a actualizar
+        peer_id: ID normalizado del peer de la conversación
+        author: "self" o "peer"
+        ordinal: Ordinal del mensaje
+
+    Returns:
+        bool: False si el ordinal no supera la marca (mensaje ya conocido)
+    """
+    conversation = marks.setdefault(peer_id, {"self": 0, "peer": 0})
+    if ordinal <= conversation[author]:
+        return False
+    conversation[author] = ordinal
+    return True
+
+
+def accept_ordinal(marks, windows, peer_id, author, ordinal, size=ORDINAL_WINDOW):
+    """Registra un ordinal recibido con una ventana deslizante de vistos.
+
+    A diferencia de advance_mark() acepta ordinales por debajo de la marca
+    que aún no se habían visto, porque los mensajes de un mismo autor pueden
+    llegar desordenados. La ventana de cada autor empieza en la marca que
+    había al crearla: lo guardado antes se da por conocido.
+
+    Args:
+        marks: Diccionario {peer: {"self": n, "peer": m}} a actualizar
+        windows: Diccionario {(peer, author): ventana} a actualizar
+        peer_id: ID normalizado del peer de la conversación
+        author: "self" o "peer"
+        ordinal: Ordinal del mensaje
+        size: Número de ordinales por debajo de la marca que se recuerdan
+
+    Returns:
+        bool | None: True si el ordinal es nuevo, False si ya se conocía y
+        None si queda por debajo de la ventana y no se puede saber
+    """
+    conversation = marks.setdefault(peer_id, {"self": 0, "peer": 0})
+    window = windows.get((peer_id, author))
+    if window is None:
+        window = windows[(peer_id, author)] = {
+            "known": conversation[author],
+            "floor": conversation[author],
+            "seen": set(),
+        }
+    if ordinal <= window["known"] or ordinal in window["seen"]:
+        return False
+    if ordinal <= window["floor"]:
+        return None
+    window["seen"].add(ordinal)
+    if ordinal > conversation[author]:
+        conversation[author] = ordinal
+        if ordinal - size > window["floor"]:
+            window["floor"] = ordinal - size
+            window["seen"] = {seen for seen in window["seen"] if seen > window["floor"]}
+    return True
+
+
+def missing_for_remote(entries, remote_marks, limit=SYNC_MAX_MESSAGES):
+    """Selecciona los mensajes que el otro extremo no tiene según sus marcas.
+
+    Args:
+        entries: Entradas del historial local con ese peer
+        remote_marks: Marcas de agua del otro extremo, en su perspectiva: su
+            "self" es el mayor ordinal que tiene de sus propios mensajes (los de
+            nuestro "peer") y su "peer" el mayor que tiene de los nuestros
+        limit: Número máximo de mensajes a enviar (los más recientes)
+
+    Returns:
+        list: Mensajes serializables con author ("self" = nosotros), ord, text, ts
+    """
+    their_own = int(remote_marks.get("self", 0))
+    ours = int(remote_marks.get("peer", 0))
+    missing = []
+    for entry in entries:
+        ordinal = entry.get("ord")
+        if ordinal is None or entry.get("broadcast"):
+            continue
+        mine = entry["from"] == "self"
+        if ordinal > (ours if mine else their_own):
+            missing.append(
+                {
+                    "author": "self" if mine else "peer",
+                    "ord": ordinal,
+                    "text": entry["text"],
+                    "ts": entry["timestamp"].timestamp(),
+                }
+            )
+    return missing[-limit:]
+
+
+def remote_to_entries(messages, peer_id):
+    """Convierte mensajes recibidos en una sincronización a entradas locales.
+
+    El author de los mensajes viene en la perspectiva del remitente, así que su
+    "self" es el peer y su "peer" somos nosotros.
+    """
+    entries = []
+    for message in messages:
+        try:
+            entries.append(
+                {
+                    "from": peer_id if message["author"] == "self" else "self",
+                    "text": str(message["text"]),
+                    "timestamp": datetime.fromtimestamp(float(message["ts"])),
+                    "ord": int(message["ord"]),
+                }
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Mensaje de sincronización ignorado: {e}")
+    return entries
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+
+from protocol import INTEGRITY_CHUNK_SIZE, ROOT_HASH_SIZE
+
+logger = logging.getLogger("LCP")
+
+_LEAF_PERSON = b"lcp-leaf"
+_NODE_PERSON = b"lcp-node"
+
+
+def hash_chunk(data):
+    """Calcula el hash BLAKE2b de un chunk (hoja del árbol)"""
+    return hashlib.blake2b(
+        data, digest_size=ROOT_HASH_SIZE, person=_LEAF_PERSON
+    ).digest()
+
+
+def _hash_node(left, right):
+    return hashlib.blake2b(
+        left + right, digest_size=ROOT_HASH_SIZE, person=_NODE_PERSON
+    ).digest()
+
+
+def merkle_root(leaves):
+    """Calcula la raíz del árbol de Merkle a partir de la lista de hojas.
+
+    Args:
+        leaves: Lista de hashes de chunks (bytes de ROOT_HASH_SIZE)
+
+    Returns:
+        bytes: Hash raíz. Para una lista vacía se devuelve el hash de b"".
+    """
+    if not leaves:
+        return hash_chunk(b"")
+
+    level = list(leaves)
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            next_level.append(_hash_node(level[i], level[i + 1]))
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+def chunk_count(total_size, chunk_size=INTEGRITY_CHUNK_SIZE):
+    """Número de chunks en que se divide un archivo de total_size bytes"""
+    return (total_size + chunk_size - 1) // chunk_size
+
+
+def encode_leaves(leaves):
+    """Serializa la tabla de hojas: 4 bytes de cantidad + hashes concatenados"""
+    return len(leaves).to_bytes(4, "big") + b"".join(leaves)
+
+
+def decode_leaves(count, data):
+    """Deserializa los hashes de la tabla de hojas (sin el prefijo de cantidad)"""
+    return [
+        bytes(data[i * ROOT_HASH_SIZE : (i + 1) * ROOT_HASH_SIZE])
+        for i in range(count)
+    ]
+
+
+def build_file_tree(file_path, chunk_size=INTEGRITY_CHUNK_SIZE):
+    """Calcula las hojas y la raíz de un archivo local.
+
+    Returns:
+        Tuple[list, bytes]: (hojas, raíz)
+    """
+    builder = ChunkHasher(chunk_size)
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            builder.update(data)
+    leaves = builder.finish()
+    return leaves, merkle_root(leaves)
+
+
+class ChunkHasher:
+    """Calcula los hashes por chunk de forma incremental mientras llegan los datos.
+
+    Los datos pueden llegar en fragmentos de cualquier tamaño; cada vez que se
+    completa un chunk se cierra su hash y se añade a la lista de hojas, por lo
+    que no hace falta volver a leer el archivo al final.
+    """
+
+    def __init__(self, chunk_size=INTEGRITY_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.leaves = []
+        self._hasher = None
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            if self._hasher is None:
+                self._hasher = hashlib.blake2b(
+                    digest_size=ROOT_HASH_SIZE, person=_LEAF_PERSON
+                )
+            take = min(len(view), self.chunk_size - self._filled)
+            self._hasher.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.chunk_size:
+                self._close_chunk()
+
+    def _close_chunk(self):
+        self.leaves.append(self._hasher.digest())
+        self._hasher = None
+        self._filled = 0
+
+    def finish(self):
+        """Cierra el último chunk parcial y devuelve la lista de hojas"""
+        if self._hasher is not None:
+            self._close_chunk()
+        return self.leaves
+
+
+class ChunkVerifier(ChunkHasher):
+    """Verifica chunks recibidos contra la raíz anunciada por el emisor.
+
+    Durante la recepción solo se calculan las hojas locales; si la raíz resultante
+    no coincide con la anunciada, se comparan con las hojas del emisor para
+    identificar exactamente los chunks corruptos.
+    """
+
+    def __init__(self, expected_root, total_size, chunk_size=INTEGRITY_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        self.expected_root = expected_root
+        self.total_size = total_size
+
+    def chunk_length(self, index):
+        """Longitud en bytes del chunk con índice dado"""
+        start = index * self.chunk_size
+        return max(0, min(self.chunk_size, self.total_size - start))
+
+    def root_matches(self):
+        return merkle_root(self.finish()) == self.expected_root
+
+    def find_corrupt_chunks(self, remote_leaves):
+        """Compara las hojas locales con las del emisor.
+
+        Args:
+            remote_leaves: Hojas enviadas por el emisor
+
+        Returns:
+            list: Índices de los chunks corruptos
+
+        Raises:
+            ValueError: Si las hojas del emisor no corresponden a la raíz anunciada
+        """
+        expected_count = chunk_count(self.total_size, self.chunk_size)
+        if (
+            len(remote_leaves) != expected_count
+            or merkle_root(remote_leaves) != self.expected_root
+        ):
+            raise ValueError("La tabla de hojas no coincide con la raíz anunciada")
+
+        local = self.finish()
+        local = local + [b""] * (expected_count - len(local))
+        self.leaves = local[:expected_count]
+        return [i for i in range(expected_count) if local[i] != remote_leaves[i]]
+
+    def replace_chunk(self, index, data, remote_leaves):
+        """Recalcula el hash de un chunk reenviado y actualiza su hoja.
+
+        Returns:
+            bool: True si el chunk coincide ahora con la hoja del emisor
+        """
+        self.leaves[index] = hash_chunk(data)
+        return self.leaves[index] == remote_leaves[index]
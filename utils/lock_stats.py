@@ -0,0 +1,156 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from .metrics import Histogram
+
+logger = logging.getLogger("LCP")
+
+# Límites (en segundos) de los histogramas de espera y retención: de 1 µs a 5 s
+LOCK_BUCKETS = (
+    0.000001,
+    0.00001,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+
+
+class InstrumentedLock:
+    """Lock con estadísticas de contención.
+
+    Se usa igual que threading.Lock. Cada adquisición registra el tiempo de
+    espera y cada liberación el tiempo de retención en histogramas, junto con
+    el punto del código (archivo:línea función) que tomó el lock, así que se
+    puede ver qué lock y qué sección crítica bloquean más. Las estadísticas se
+    modifican mientras se tiene el propio lock, por lo que no necesitan otro.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self._site = None
+        self._sites = {}
+        self._labels = {}
+        self.reset()
+
+    def reset(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait = Histogram(f"{self.name}_wait", buckets=LOCK_BUCKETS)
+        self.hold = Histogram(f"{self.name}_hold", buckets=LOCK_BUCKETS)
+        self._sites = {}
+
+    def _call_site(self, depth):
+        frame = sys._getframe(depth)
+        key = (frame.f_code, frame.f_lineno)
+        label = self._labels.get(key)
+        if label is None:
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            label = self._labels[key] = f"{filename}:{frame.f_lineno} {code.co_name}"
+        return label
+
+    def _acquire(self, blocking, timeout, depth):
+        started = time.perf_counter()
+        if self._lock.acquire(False):
+            contended = False
+        else:
+            if not blocking or not self._lock.acquire(True, timeout):
+                return False
+            contended = True
+        now = time.perf_counter()
+
+        self.acquisitions += 1
+        if contended:
+            self.contended += 1
+        self.wait.observe(now - started)
+        self._acquired_at = now
+        self._site = self._call_site(depth + 1)
+        site = self._sites.get(self._site)
+        if site is None:
+            # [adquisiciones, con espera, espera total, retención total y máxima]
+            site = self._sites[self._site] = [0, 0, 0.0, 0.0, 0.0]
+        site[0] += 1
+        site[1] += contended
+        site[2] += now - started
+        return True
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._acquire(blocking, timeout, 2)
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self.hold.observe(held)
+        site = self._sites.get(self._site)
+        if site is not None:
+            site[3] += held
+            site[4] = max(site[4], held)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self._acquire(True, -1, 2)
+        return True
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def summary(self, top_sites=5):
+        """Resumen de contención del lock
+
+        Returns:
+            dict: Adquisiciones, fracción con espera, tiempos totales y
+                percentiles de espera y retención, y los puntos de código que
+                más tiempo lo retienen
+        """
+        sites = sorted(
+            self._sites.items(), key=lambda item: item[1][3], reverse=True
+        )
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "contention_ratio": (
+                self.contended / self.acquisitions if self.acquisitions else 0.0
+            ),
+            "wait_total": self.wait.sum,
+            "wait_p50": self.wait.quantile(0.5),
+            "wait_p99": self.wait.quantile(0.99),
+            "hold_total": self.hold.sum,
+            "hold_p50": self.hold.quantile(0.5),
+            "hold_p99": self.hold.quantile(0.99),
+            "sites": [
+                {
+                    "site": label,
+                    "acquisitions": site[0],
+                    "contended": site[1],
+                    "wait_total": site[2],
+                    "hold_total": site[3],
+                    "hold_max": site[4],
+                }
+                for label, site in sites[:top_sites]
+            ],
+        }
+
+
+def contention_summary(locks, top_sites=5):
+    """Resumen de varios InstrumentedLock, del que más espera acumula al que menos
+
+    Returns:
+        dict: {nombre del lock: summary()}
+    """
+    summaries = [(lock.name, lock.summary(top_sites)) for lock in locks]
+    summaries.sort(key=lambda item: item[1]["wait_total"], reverse=True)
+    return dict(summaries)
@@ -0,0 +1,187 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+DEVELOPMENT = "development"
+PRODUCTION = "production"
+
+# Niveles por subsistema del modo producción: los registros por paquete de UDP,
+# mensajes y descubrimiento solo se emiten a partir de WARNING
+PRODUCTION_LEVELS = {
+    "LCP": logging.INFO,
+    "LCP.udp": logging.WARNING,
+    "LCP.messages": logging.WARNING,
+    "LCP.discovery": logging.WARNING,
+}
+
+# Subsistemas cuyos registros por paquete se muestrean
+SAMPLED_LOGGERS = ("LCP.udp", "LCP.messages", "LCP.discovery")
+
+_state = {"listener": None, "handler": None, "previous_handlers": None}
+
+
+class SamplingFilter(logging.Filter):
+    """Limita la frecuencia de los registros repetitivos.
+
+    Cada plantilla de mensaje (record.msg, sin formatear) de los loggers
+    indicados tiene un token bucket de rate registros/s con ráfagas de burst. Los
+    registros que no caben se descartan sin formatearlos, y el siguiente que
+    pasa indica cuántos se omitieron. También se muestrean los WARNING, que es
+    el nivel por defecto de esos subsistemas en producción (p. ej. una ráfaga
+    de headers malformados); ERROR y superiores nunca se descartan.
+    """
+
+    def __init__(self, names=SAMPLED_LOGGERS, rate=5.0, burst=20, max_keys=1000):
+        super().__init__()
+        self.names = tuple(names)
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.suppressed_total = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _sampled(self, name):
+        return any(name == n or name.startswith(n + ".") for n in self.names)
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self._sampled(record.name):
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                # [tokens, última actualización, omitidos desde el último emitido]
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed_total += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} [{suppressed} similares omitidos]"
+            record.args = None
+        return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no bloquea ni formatea en el hilo que registra.
+
+    El mensaje se formatea en el hilo del QueueListener; aquí solo se resuelve
+    el texto de la excepción, que depende del estado actual de la pila. Si la
+    cola está llena el registro se descarta y se cuenta.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(
+    mode=PRODUCTION,
+    levels=None,
+    sample_rate=5.0,
+    sample_burst=20,
+    queue_size=10000,
+    handlers=None,
+):
+    """Configura el registro de LCP.
+
+    En modo 'production' los handlers actuales del logger raíz (o los indicados)
+    pasan a un QueueListener con hilo propio, y en su lugar se instala un
+    AsyncQueueHandler con un SamplingFilter para los registros por paquete.
+    En modo 'development' solo se aplican los niveles indicados y el registro
+    sigue siendo síncrono.
+
+    Args:
+        mode: 'production' o 'development'
+        levels: Diccionario {logger: nivel} que se aplica sobre los niveles
+            por defecto del modo (p. ej. {"LCP.udp": logging.DEBUG})
+        sample_rate: Registros/s permitidos por plantilla en los subsistemas
+            muestreados
+        sample_burst: Ráfaga máxima por plantilla
+        queue_size: Registros pendientes máximos antes de descartar
+        handlers: Handlers de destino (por defecto, los del logger raíz)
+
+    Returns:
+        logging.handlers.QueueListener o None en modo 'development'
+    """
+    if mode not in (DEVELOPMENT, PRODUCTION):
+        raise ValueError(f"Modo de registro desconocido: {mode}")
+
+    shutdown_logging()
+
+    effective_levels = dict(PRODUCTION_LEVELS) if mode == PRODUCTION else {}
+    effective_levels.update(levels or {})
+    for name, level in effective_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    if mode == DEVELOPMENT:
+        return None
+
+    root = logging.getLogger()
+    targets = list(handlers) if handlers is not None else list(root.handlers)
+    log_queue = queue.Queue(queue_size)
+    handler = AsyncQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(rate=sample_rate, burst=sample_burst))
+    listener = logging.handlers.QueueListener(
+        log_queue, *targets, respect_handler_level=True
+    )
+
+    _state["previous_handlers"] = list(root.handlers)
+    root.handlers = [handler]
+    listener.start()
+    _state["listener"] = listener
+    _state["handler"] = handler
+    logger.debug("Registro asíncrono activado (%d handlers)", len(targets))
+    return listener
+
+
+def shutdown_logging():
+    """Vacía la cola del registro asíncrono y restaura los handlers originales"""
+    listener = _state["listener"]
+    if listener is None:
+        return
+    listener.stop()
+    root = logging.getLogger()
+    root.handlers = _state["previous_handlers"]
+    _state.update(listener=None, handler=None, previous_handlers=None)
+
+
+def logging_stats():
+    """Registros descartados por cola llena y omitidos por muestreo"""
+    handler = _state["handler"]
+    if handler is None:
+        return {"mode": DEVELOPMENT, "dropped": 0, "suppressed": 0}
+    suppressed = sum(
+        f.suppressed_total for f in handler.filters if isinstance(f, SamplingFilter)
+    )
+    return {"mode": PRODUCTION, "dropped": handler.dropped, "suppressed": suppressed}
+
+
+atexit.register(shutdown_logging)
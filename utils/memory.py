@@ -0,0 +1,160 @@
+import collections
+import logging
+import os
+import sys
+import tracemalloc
+
+logger = logging.getLogger("LCP")
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, collections.deque)
+
+
+def deep_sizeof(obj, max_depth=4, _seen=None):
+    """Tamaño aproximado en bytes de obj y de lo que contiene.
+
+    Recorre diccionarios, listas, tuplas, conjuntos, deques y los __dict__ o
+    __slots__ de los objetos hasta max_depth niveles, contando cada objeto una
+    sola vez. Es una estimación: no sigue referencias más profundas ni cuenta
+    la memoria que reservan las extensiones en C.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if max_depth <= 0 or isinstance(obj, (str, bytes, bytearray, int, float)):
+        return size
+
+    depth = max_depth - 1
+    if isinstance(obj, dict):
+        for key, value in list(obj.items()):
+            size += deep_sizeof(key, depth, _seen) + deep_sizeof(value, depth, _seen)
+    elif isinstance(obj, _CONTAINERS):
+        for item in list(obj):
+            size += deep_sizeof(item, depth, _seen)
+    else:
+        attributes = getattr(obj, "__dict__", None)
+        if attributes is not None:
+            size += deep_sizeof(attributes, depth, _seen)
+        for name in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, name):
+                size += deep_sizeof(getattr(obj, name), depth, _seen)
+    return size
+
+
+def container_usage(container, sample=200, max_depth=4):
+    """Entradas y bytes aproximados de un contenedor
+
+    Con más de sample entradas solo se miden las primeras sample y se
+    extrapola, para que el coste de la medida no dependa del tamaño.
+
+    Returns:
+        dict: {"entries": n, "bytes": estimación}
+    """
+    entries = len(container)
+    size = sys.getsizeof(container, 0)
+    if isinstance(container, dict):
+        items = list(container.items())[:sample]
+    else:
+        items = list(container)[:sample]
+    if items:
+        measured = sum(deep_sizeof(item, max_depth) for item in items)
+        size += measured * entries // len(items)
+    return {"entries": entries, "bytes": size}
+
+
+def process_memory():
+    """Memoria residente del proceso en bytes (None si no se puede obtener)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+
+        # ru_maxrss es el máximo, en KiB en Linux y en bytes en macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class AllocationTracker:
+    """Diferencias de asignaciones entre instantáneas de tracemalloc.
+
+    start() activa tracemalloc (que ralentiza las asignaciones mientras está
+    activo) y toma la instantánea base; diff() compara el estado actual con la
+    base y devuelve las líneas de código que más memoria han ganado desde
+    entonces. Sirve para localizar una fuga en un proceso que lleva días
+    funcionando, activándolo solo durante la investigación.
+    """
+
+    def __init__(self):
+        self._baseline = None
+        self._started_tracing = False
+
+    @property
+    def active(self):
+        return self._baseline is not None
+
+    def start(self, nframes=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(nframes)
+            self._started_tracing = True
+        self._baseline = self._snapshot()
+        logger.info(f"Seguimiento de asignaciones activado ({nframes} marcos)")
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    def diff(self, top=20, group_by="lineno", rebase=False):
+        """Asignaciones que más han crecido desde la instantánea base
+
+        Args:
+            top: Número de entradas a devolver
+            group_by: 'lineno', 'filename' o 'traceback'
+            rebase: Si es True la instantánea actual pasa a ser la nueva base
+
+        Returns:
+            list: Diccionarios con location, size, size_diff, count y count_diff
+        """
+        if self._baseline is None:
+            raise RuntimeError("El seguimiento de asignaciones no está activo")
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self._baseline, group_by)
+        if rebase:
+            self._baseline = snapshot
+
+        result = []
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            entry = {
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+            if group_by == "traceback":
+                entry["traceback"] = stat.traceback.format()
+            result.append(entry)
+        return result
+
+    def traced(self):
+        """(actual, pico) de la memoria seguida por tracemalloc en bytes"""
+        return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+    def stop(self):
+        self._baseline = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        logger.info("Seguimiento de asignaciones desactivado")
@@ -0,0 +1,360 @@
+import array
+import bisect
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("LCP")
+
+# Límites (en segundos) de los histogramas de latencia: de 0,5 ms a 10 s
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    """Base de las métricas: nombre, ayuda y, opcionalmente, etiquetas.
+
+    Una métrica con labelnames no guarda valores propios; labels(*valores)
+    devuelve (y crea la primera vez) la serie hija con esos valores.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text="", labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} espera {len(self.labelnames)} etiquetas, "
+                f"recibió {len(values)}"
+            )
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def _series(self):
+        """Pares (valores de etiquetas, serie) a exportar"""
+        if self.labelnames:
+            return sorted(self._children.items())
+        return [((), self)]
+
+
+class Counter(_Metric):
+    """Contador monótono"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text="", labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        if self.labelnames:
+            return {
+                ",".join(values): child.value for values, child in self._series()
+            }
+        return self._value
+
+    def exposition(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} "
+            f"{_format_value(child.value)}"
+            for values, child in self._series()
+        ]
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; con fn se calcula en el momento de leerlo"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text="", labelnames=(), fn=None):
+        super().__init__(name, help_text, labelnames)
+        self._value = 0
+        self._fn = fn
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    @property
+    def value(self):
+        if self._fn is not None:
+            try:
+                return self._fn()
+            except Exception as e:
+                logger.debug(f"Error calculando la métrica {self.name}: {e}")
+                return math.nan
+        return self._value
+
+    def snapshot(self):
+        if self.labelnames:
+            return {
+                ",".join(values): child.value for values, child in self._series()
+            }
+        return self.value
+
+    def exposition(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} "
+            f"{_format_value(child.value)}"
+            for values, child in self._series()
+        ]
+
+
+class Histogram(_Metric):
+    """Histograma de límites fijos con los recuentos en un array.
+
+    observe() solo hace una búsqueda binaria en los límites y un incremento, así
+    que se puede usar en rutas calientes. Los cuantiles se estiman interpolando
+    dentro del bucket correspondiente.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text="", labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Un bucket por límite más el de desbordamiento (+Inf)
+        self._counts = array.array("Q", [0] * (len(self.buckets) + 1))
+        self._sum = 0.0
+        self._count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def quantile(self, q):
+        """Estimación del cuantil q (0..1); None si no hay observaciones"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    # Desbordamiento: el mejor dato es el último límite
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def _summary(self):
+        return {
+            "count": self._count,
+            "sum": self._sum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+    def snapshot(self):
+        if self.labelnames:
+            return {
+                ",".join(values): child._summary() for values, child in self._series()
+            }
+        return self._summary()
+
+    def exposition(self):
+        lines = []
+        for values, child in self._series():
+            with child._lock:
+                counts = list(child._counts)
+                total_sum = child._sum
+                total = child._count
+            cumulative = 0
+            for bound, count in zip(child.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames, values, ("le", _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas con nombre único, exportable como diccionario
+    (snapshot()) o en el formato de texto de Prometheus (to_prometheus())"""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text="", labelnames=()):
+        return self._register(Counter(self.prefix + name, help_text, labelnames))
+
+    def gauge(self, name, help_text="", labelnames=(), fn=None):
+        return self._register(
+            Gauge(self.prefix + name, help_text, labelnames, fn=fn)
+        )
+
+    def histogram(self, name, help_text="", labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(
+            Histogram(self.prefix + name, help_text, labelnames, buckets)
+        )
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        """Valores actuales: {nombre sin prefijo: valor, {etiquetas: valor} o
+        resumen del histograma}"""
+        return {
+            metric.name[len(self.prefix) :]: metric.snapshot()
+            for metric in self.metrics()
+        }
+
+    def to_prometheus(self):
+        lines = []
+        for metric in self.metrics():
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Servidor HTTP local que expone un MetricsRegistry en /metrics.
+
+    Escucha por defecto solo en 127.0.0.1: las métricas incluyen IDs de peers y
+    no deben publicarse en la red sin decidirlo explícitamente.
+    """
+
+    def __init__(self, registry, port=9464, host="127.0.0.1"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Métricas HTTP: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # Con port=0 el sistema asigna un puerto libre
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True, name="MetricsServer"
+        )
+        self._thread.start()
+        logger.info(f"Métricas disponibles en http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
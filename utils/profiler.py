@@ -0,0 +1,158 @@
+import collections
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+_THREAD_NUMBER = re.compile(r"-\d+$")
+
+
+class SamplingProfiler:
+    """Perfilador por muestreo dentro del proceso.
+
+    Un hilo toma cada interval segundos las pilas de todos los hilos con
+    sys._current_frames() y cuenta cuántas veces aparece cada pila. El
+    resultado se exporta en formato 'collapsed' (una línea
+    'hilo;función;...;función N' por pila, de la raíz a la hoja), que aceptan
+    flamegraph.pl, speedscope o Perfetto. No necesita herramientas externas ni
+    reiniciar el proceso, y solo cuesta algo mientras está activo.
+    """
+
+    def __init__(self, interval=0.01, threads=None, merge_threads=True, max_depth=64):
+        """
+        Args:
+            interval: Segundos entre muestras
+            threads: Prefijos de nombre de los hilos a muestrear (p. ej.
+                ["Worker-", "FileSender-"]); None para todos
+            merge_threads: Agrupa los hilos numerados de un mismo pool
+                ('Worker-1', 'Worker-2'...) bajo 'Worker-N'
+            max_depth: Marcos máximos por pila (los más cercanos a la hoja)
+        """
+        self.interval = interval
+        self.threads = tuple(threads) if threads else None
+        self.merge_threads = merge_threads
+        self.max_depth = max_depth
+
+        self._stacks = collections.Counter()
+        self._labels = {}
+        self._samples = 0
+        self._sampling_time = 0.0
+        self._started = None
+        self._elapsed = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="Profiler"
+        )
+        self._thread.start()
+        logger.info(
+            f"Perfilador por muestreo iniciado (intervalo {self.interval * 1000:.1f} ms)"
+        )
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._elapsed += time.monotonic() - self._started
+        self._started = None
+        logger.info(f"Perfilador por muestreo detenido ({self._samples} muestras)")
+
+    def clear(self):
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+            self._sampling_time = 0.0
+            self._elapsed = 0.0
+            if self._started is not None:
+                self._started = time.monotonic()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                self._sample(own_ident)
+            except Exception as e:
+                logger.error(f"Error en el perfilador: {e}", exc_info=True)
+            with self._lock:
+                self._sampling_time += time.perf_counter() - started
+
+    def _thread_label(self, name):
+        if self.threads is not None and not name.startswith(self.threads):
+            return None
+        if self.merge_threads:
+            return _THREAD_NUMBER.sub("-N", name)
+        return name
+
+    def _sample(self, own_ident):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            label = self._thread_label(names.get(ident, f"Thread-{ident}"))
+            if label is None:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                frames.append(self._frame_label(frame.f_code))
+                frame = frame.f_back
+            frames.append(label)
+            stacks.append(";".join(reversed(frames)))
+
+        with self._lock:
+            self._stacks.update(stacks)
+            self._samples += 1
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(
+                ";", ","
+            )
+            self._labels[code] = label
+        return label
+
+    def collapsed(self):
+        """Pilas acumuladas en formato collapsed, de más a menos frecuentes"""
+        with self._lock:
+            items = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def save(self, path):
+        """Escribe las pilas en formato collapsed en path"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        logger.info(f"Perfil guardado en {path}")
+
+    def stats(self):
+        """Muestras tomadas, duración y coste del muestreo"""
+        with self._lock:
+            elapsed = self._elapsed
+            if self._started is not None:
+                elapsed += time.monotonic() - self._started
+            return {
+                "running": self.running,
+                "samples": self._samples,
+                "unique_stacks": len(self._stacks),
+                "elapsed": elapsed,
+                "sampling_time": self._sampling_time,
+                "overhead": self._sampling_time / elapsed if elapsed else 0.0,
+            }
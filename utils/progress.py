@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+
+class _Sample:
+    def __init__(self, transfer, now):
+        self.transfer = transfer
+        self.bytes_done = transfer.bytes_done
+        self.time = now
+        self.rate = None
+        self.progress = None
+
+
+class ProgressMonitor:
+    """Servicio que publica el progreso de las transferencias a ritmo fijo.
+
+    Un hilo muestrea los contadores bytes_done de las transferencias registradas
+    cada interval segundos y publica, en un único lote por muestreo, un evento
+    por transferencia que haya cambiado, con velocidad (media exponencial) y
+    tiempo restante estimado. Los bucles de copia solo actualizan un contador,
+    así que el coste del progreso no depende del número de chunks y un
+    suscriptor lento retrasa los eventos, nunca las transferencias.
+    """
+
+    def __init__(self, registries, interval=0.1, smoothing=0.3):
+        """
+        Args:
+            registries: TransferRegistry a muestrear
+            interval: Segundos entre muestreos (0.1 = 10 Hz)
+            smoothing: Peso de la última medida en la media de velocidad
+        """
+        self.registries = registries
+        self.interval = interval
+        self.smoothing = smoothing
+        self._samples = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """Registra un callback que recibe la lista de eventos de cada muestreo"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="ProgressMonitor"
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                events = self.sample()
+                if events:
+                    self._publish(events)
+            except Exception as e:
+                logger.error(f"Error publicando progreso: {e}", exc_info=True)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"Error en callback de progreso: {e}", exc_info=True)
+
+    def sample(self):
+        """Toma una muestra de todas las transferencias
+
+        Returns:
+            list: Eventos de las transferencias que cambiaron desde la última muestra
+        """
+        now = time.monotonic()
+        current = {}
+        finished = []
+        for registry in self.registries:
+            for transfer in registry.active_transfers():
+                current[id(transfer)] = transfer
+            finished.extend(registry.take_finished())
+        # Una transferencia que termina entre las dos llamadas solo cuenta
+        # como terminada
+        for transfer in finished:
+            current.pop(id(transfer), None)
+
+        events = []
+        reported = set()
+        for key, transfer in current.items():
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = _Sample(transfer, now)
+                events.append(self._event(sample))
+                continue
+            self._update(sample, now)
+            event = self._event(sample)
+            if event["bytes_done"] != sample.bytes_done or event[
+                "progress"
+            ] != sample.progress:
+                events.append(event)
+            sample.bytes_done = event["bytes_done"]
+            sample.progress = event["progress"]
+
+        # Las transferencias que ya no están activas emiten un último evento
+        for key in list(self._samples):
+            if key not in current:
+                sample = self._samples.pop(key)
+                self._update(sample, now)
+                events.append(self._event(sample))
+                reported.add(key)
+
+        # También las que empezaron y terminaron entre dos muestreos, que nunca
+        # llegaron a tener muestra
+        for transfer in finished:
+            if id(transfer) not in reported:
+                events.append(self._event(_Sample(transfer, now)))
+
+        return events
+
+    def _update(self, sample, now):
+        elapsed = now - sample.time
+        if elapsed <= 0:
+            return
+        rate = (sample.transfer.bytes_done - sample.bytes_done) / elapsed
+        if sample.rate is None:
+            sample.rate = rate
+        else:
+            sample.rate += self.smoothing * (rate - sample.rate)
+        sample.time = now
+
+    def _event(self, sample):
+        transfer = sample.transfer
+        bytes_done = transfer.bytes_done
+        total = transfer.file_size
+        progress = min(100, int(bytes_done * 100 / total)) if total else 100
+        eta = None
+        if sample.rate and sample.rate > 0:
+            eta = max(0, total - bytes_done) / sample.rate
+        return {
+            "direction": transfer.direction,
+            "peer_ip": transfer.peer_ip,
+            "file_id": transfer.file_id,
+            "user_id": transfer.user_id,
+            "file_path": transfer.info.get("file_path"),
+            "state": transfer.state,
+            "bytes_done": bytes_done,
+            "total": total,
+            "progress": progress,
+            "rate": sample.rate or 0.0,
+            "eta": eta,
+        }
@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+INTERACTIVE = 0
+BULK = 1
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactiva", BULK: "masiva"}
+
+
+class TransferScheduler:
+    """Cola de envíos de archivos con control de admisión.
+
+    Sustituye a una cola FIFO: get() bloquea hasta que hay una tarea pendiente y
+    un hueco libre por debajo de max_concurrent, sin reintentos con sleep. El
+    orden es Shortest Remaining Processing Time por tamaño, con dos clases de
+    prioridad (interactiva por delante de masiva) y envejecimiento lineal para
+    que las transferencias grandes no esperen indefinidamente.
+
+    La clave de cada tarea es size + penalización de clase + aging_rate * t_encolado,
+    que es constante en el tiempo porque todas las tareas envejecen al mismo ritmo.
+    """
+
+    def __init__(
+        self,
+        max_concurrent,
+        small_file_threshold=1024 * 1024,
+        bulk_penalty=256 * 1024 * 1024,
+        aging_rate=10 * 1024 * 1024,
+    ):
+        """
+        Args:
+            max_concurrent: Número máximo de transferencias admitidas a la vez
+            small_file_threshold: Tamaño hasta el que un archivo es interactivo
+            bulk_penalty: Bytes equivalentes que se suman a las tareas masivas
+            aging_rate: Bytes de prioridad que gana una tarea por segundo de espera
+        """
+        self.max_concurrent = max_concurrent
+        self.small_file_threshold = small_file_threshold
+        self.bulk_penalty = bulk_penalty
+        self.aging_rate = aging_rate
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._active = 0
+        self._start = time.monotonic()
+        self._cond = threading.Condition()
+
+    def classify(self, size):
+        """Clase de prioridad por defecto según el tamaño del archivo"""
+        return INTERACTIVE if size <= self.small_file_threshold else BULK
+
+    def put(self, task, size=0, priority=None):
+        """Encola una tarea.
+
+        Args:
+            task: Tarea a entregar a los workers
+            size: Tamaño en bytes del trabajo (archivo o conjunto de archivos)
+            priority: INTERACTIVE, BULK o None para clasificar por tamaño
+        """
+        if priority is None:
+            priority = self.classify(size)
+
+        waited_since = time.monotonic() - self._start
+        key = size + self.aging_rate * waited_since
+        if priority == BULK:
+            key += self.bulk_penalty
+
+        with self._cond:
+            heapq.heappush(self._heap, (key, next(self._counter), task))
+            self._cond.notify()
+
+        logger.debug(
+            f"Tarea encolada con prioridad {_PRIORITY_NAMES.get(priority, priority)} ({size} bytes)"
+        )
+
+    def get(self):
+        """Espera a que haya una tarea y un hueco libre y la admite.
+
+        Cada tarea obtenida debe liberarse con release() al terminar.
+        """
+        with self._cond:
+            while not self._heap or self._active >= self.max_concurrent:
+                self._cond.wait()
+            self._active += 1
+            _, _, task = heapq.heappop(self._heap)
+            return task
+
+    def release(self):
+        """Libera el hueco de una tarea admitida"""
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def set_max_concurrent(self, max_concurrent):
+        """Cambia en caliente el número máximo de transferencias simultáneas"""
+        with self._cond:
+            self.max_concurrent = max_concurrent
+            self._cond.notify_all()
+
+    @property
+    def active(self):
+        return self._active
+
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
@@ -0,0 +1,241 @@
+import collections
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+# Operación en curso en el contexto actual (hilo o tarea)
+_current = contextvars.ContextVar("lcp_trace_operation", default=None)
+
+
+def _now_us():
+    return time.perf_counter() * 1_000_000
+
+
+class _NullSpan:
+    """Span vacío que se usa cuando la traza está desactivada"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def end(self, **args):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "operation", "name", "start", "args", "depth")
+
+    def __init__(self, tracer, operation, name, args):
+        self.tracer = tracer
+        self.operation = operation
+        self.name = name
+        self.args = args
+        self.depth = len(operation.stack)
+        self.start = _now_us()
+
+    def set(self, **args):
+        """Añade argumentos al span (aparecen en el visor de la traza)"""
+        self.args.update(args)
+
+    def end(self, **args):
+        """Cierra el span; cierra también los hijos que sigan abiertos"""
+        stack = self.operation.stack
+        if self not in stack:
+            return
+        self.args.update(args)
+        while stack:
+            span = stack.pop()
+            span._record()
+            if span is self:
+                break
+
+    def _record(self):
+        self.tracer._record(
+            self.name,
+            self.operation.name,
+            self.start,
+            _now_us() - self.start,
+            self.operation.trace_id,
+            self.depth,
+            self.args,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.end()
+        return False
+
+
+class _Operation(_Span):
+    """Span raíz: fija el contexto al que se asocian las fases siguientes"""
+
+    __slots__ = ("trace_id", "stack", "token")
+
+    def __init__(self, tracer, name, args):
+        self.trace_id = next(tracer._ids)
+        self.stack = []
+        self.token = None
+        super().__init__(tracer, self, name, args)
+        self.stack.append(self)
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            super().__exit__(exc_type, exc, tb)
+        finally:
+            _current.reset(self.token)
+        return False
+
+
+class Tracer:
+    """Traza por fases de las operaciones de un peer.
+
+    operation(nombre) abre el contexto de una operación (enviar un mensaje,
+    recibir un archivo...) en el hilo actual; dentro de él, span(nombre) o
+    begin(nombre)/end() miden sus fases. Los spans terminados se guardan en un
+    buffer circular de max_spans entradas y export_chrome() los vuelca en el
+    formato JSON de Chrome (chrome://tracing) y Perfetto.
+
+    Desactivado (el estado inicial), operation() y span() devuelven un objeto
+    vacío compartido, así que instrumentar las rutas calientes no cuesta casi
+    nada. Las fases abiertas al terminar la operación (p. ej. por una
+    excepción o un return temprano) se cierran con ella.
+    """
+
+    def __init__(self, max_spans=20000):
+        self.enabled = False
+        self._spans = collections.deque(maxlen=max_spans)
+        self._threads = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, max_spans=None):
+        """Activa la traza (y opcionalmente cambia el tamaño del buffer)"""
+        with self._lock:
+            if max_spans is not None and max_spans != self._spans.maxlen:
+                self._spans = collections.deque(self._spans, maxlen=max_spans)
+        self.enabled = True
+        logger.info("Traza de operaciones activada")
+
+    def stop(self):
+        self.enabled = False
+        logger.info("Traza de operaciones desactivada")
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self._threads.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._spans)
+
+    def operation(self, name, **args):
+        """Abre una operación en el contexto actual (usar con 'with')
+
+        Si ya hay una operación abierta, la nueva se registra como una fase de
+        ella.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        if _current.get() is not None:
+            return self.begin(name, **args)
+        return _Operation(self, name, args)
+
+    def begin(self, name, **args):
+        """Abre una fase de la operación actual; se cierra con end() o 'with'"""
+        operation = _current.get() if self.enabled else None
+        if operation is None:
+            return _NULL_SPAN
+        span = _Span(self, operation, name, args)
+        operation.stack.append(span)
+        return span
+
+    def span(self, name, **args):
+        """Alias de begin() para usar con 'with'"""
+        return self.begin(name, **args)
+
+    def annotate(self, **args):
+        """Añade argumentos a la operación actual"""
+        operation = _current.get()
+        if operation is not None:
+            operation.args.update(args)
+
+    def _record(self, name, category, start, duration, trace_id, depth, args):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+            self._spans.append(
+                (name, category, start, duration, thread.ident, trace_id, depth, args)
+            )
+
+    def export_chrome(self, path=None):
+        """Devuelve (y si se indica path, escribe) la traza en formato Chrome
+
+        Cada span es un evento completo ('X') con la operación como categoría
+        y trace_id en los argumentos para agrupar las fases de una misma
+        operación; los hilos aparecen con su nombre.
+
+        Returns:
+            dict: {"traceEvents": [...], "displayTimeUnit": "ms"}
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self._spans)
+            threads = dict(self._threads)
+
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        # Los padres antes que los hijos cuando empiezan a la vez
+        spans.sort(key=lambda span: (span[2], span[6]))
+        for name, category, start, duration, tid, trace_id, depth, args in spans:
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": round(start, 3),
+                    "dur": round(duration, 3),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"trace_id": trace_id, **args},
+                }
+            )
+
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(trace, f, ensure_ascii=False, default=str)
+            logger.info(f"Traza exportada a {path} ({len(spans)} spans)")
+        return trace
@@ -0,0 +1,229 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("LCP")
+
+OFFERED = "ofrecida"
+ACTIVE = "activa"
+VERIFYING = "verificando"
+COMPLETED = "completada"
+FAILED = "fallida"
+EXPIRED = "expirada"
+
+_TRANSITIONS = {
+    OFFERED: {ACTIVE, FAILED, EXPIRED},
+    ACTIVE: {VERIFYING, COMPLETED, FAILED},
+    VERIFYING: {COMPLETED, FAILED},
+}
+_FINAL_STATES = {COMPLETED, FAILED, EXPIRED}
+
+_MAX_FILE_ID = 256
+# Transferencias terminadas que se guardan hasta que alguien las recoja con
+# take_finished()
+_MAX_UNREPORTED = 1000
+
+
+class Transfer:
+    """Estado de una transferencia de archivo identificada por (peer, file_id)"""
+
+    def __init__(self, peer_ip, file_id, direction, user_id, file_size, **info):
+        self.peer_ip = peer_ip
+        self.file_id = file_id
+        self.direction = direction
+        self.user_id = user_id
+        self.file_size = file_size
+        self.info = info
+        self.state = OFFERED
+        self.created = time.time()
+        self.updated = self.created
+        self.bytes_done = 0
+        self.error = None
+
+    @property
+    def key(self):
+        return (self.peer_ip, self.file_id)
+
+    @property
+    def finished(self):
+        return self.state in _FINAL_STATES
+
+    def to_dict(self):
+        info = {
+            key: value.hex() if isinstance(value, bytes) else value
+            for key, value in self.info.items()
+        }
+        return {
+            "peer_ip": self.peer_ip,
+            "file_id": self.file_id,
+            "direction": self.direction,
+            "user_id": self.user_id,
+            "file_size": self.file_size,
+            "state": self.state,
+            "bytes_done": self.bytes_done,
+            "created": self.created,
+            "updated": self.updated,
+            "error": self.error,
+            **info,
+        }
+
+
+class TransferRegistry:
+    """Registro de transferencias en curso indexado por (IP del peer, file_id).
+
+    Permite tener varias transferencias simultáneas con el mismo peer. Cada
+    transferencia sigue la máquina de estados
+    ofrecida -> activa -> verificando -> completada/fallida, y las ofertas que
+    nunca llegan a conectarse expiran pasado offer_ttl segundos.
+    """
+
+    def __init__(self, direction, offer_ttl=60, finished_history=100):
+        self.direction = direction
+        self.offer_ttl = offer_ttl
+        self._transfers = {}
+        self._finished = collections.deque(maxlen=finished_history)
+        self._unreported = collections.deque(maxlen=_MAX_UNREPORTED)
+        self._cond = threading.Condition()
+
+    def create(self, peer_ip, file_id=None, user_id=None, file_size=0, **info):
+        """Registra una nueva transferencia en estado 'ofrecida'.
+
+        Args:
+            peer_ip: IP del peer remoto
+            file_id: ID de archivo; si es None se asigna uno libre para ese peer
+            user_id: ID del usuario remoto
+            file_size: Tamaño anunciado en bytes
+
+        Returns:
+            Transfer: La transferencia registrada
+
+        Raises:
+            ValueError: Si el ID ya está en uso por una transferencia activa o no
+                quedan IDs libres para el peer
+        """
+        with self._cond:
+            if file_id is None:
+                file_id = self._free_file_id(peer_ip)
+
+            existing = self._transfers.get((peer_ip, file_id))
+            if existing is not None:
+                if existing.state != OFFERED:
+                    raise ValueError(
+                        f"Transferencia {file_id} con {peer_ip} ya está en curso"
+                    )
+                # Una oferta repetida sustituye a la anterior
+                self._set_state(existing, EXPIRED)
+
+            transfer = Transfer(
+                peer_ip, file_id, self.direction, user_id, file_size, **info
+            )
+            self._transfers[transfer.key] = transfer
+            self._cond.notify_all()
+            return transfer
+
+    def _free_file_id(self, peer_ip):
+        start = int(time.time() * 1000) % _MAX_FILE_ID
+        for offset in range(_MAX_FILE_ID):
+            candidate = (start + offset) % _MAX_FILE_ID
+            if (peer_ip, candidate) not in self._transfers:
+                return candidate
+        raise ValueError(f"No quedan IDs de archivo libres para {peer_ip}")
+
+    def claim(self, peer_ip, file_id, timeout=0):
+        """Pasa una transferencia ofrecida a 'activa'.
+
+        Espera hasta timeout segundos a que llegue la oferta, ya que la conexión
+        TCP puede adelantarse al procesamiento del header UDP.
+
+        Returns:
+            Transfer o None si no hay una oferta pendiente con esa clave
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                transfer = self._transfers.get((peer_ip, file_id))
+                if transfer is not None and transfer.state == OFFERED:
+                    self._set_state(transfer, ACTIVE)
+                    return transfer
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def transition(self, transfer, state, error=None):
+        """Cambia el estado de una transferencia.
+
+        Raises:
+            ValueError: Si la transición no es válida desde el estado actual
+        """
+        with self._cond:
+            self._set_state(transfer, state, error)
+
+    def fail_if_pending(self, transfer, error):
+        """Marca como fallida una transferencia que no llegó a un estado final"""
+        with self._cond:
+            if not transfer.finished:
+                self._set_state(transfer, FAILED, error)
+
+    def _set_state(self, transfer, state, error=None):
+        if state not in _TRANSITIONS.get(transfer.state, ()):
+            raise ValueError(
+                f"Transición inválida de '{transfer.state}' a '{state}' para {transfer.key}"
+            )
+        transfer.state = state
+        transfer.updated = time.time()
+        if error:
+            transfer.error = error
+        if state in _FINAL_STATES:
+            if self._transfers.get(transfer.key) is transfer:
+                del self._transfers[transfer.key]
+            self._finished.append(transfer)
+            self._unreported.append(transfer)
+
+    def expire_stale(self):
+        """Expira las ofertas que llevan más de offer_ttl segundos sin conexión
+
+        Returns:
+            list: Transferencias expiradas
+        """
+        cutoff = time.time() - self.offer_ttl
+        expired = []
+        with self._cond:
+            for transfer in list(self._transfers.values()):
+                if transfer.state == OFFERED and transfer.updated < cutoff:
+                    self._set_state(transfer, EXPIRED, "Oferta sin conexión TCP")
+                    expired.append(transfer)
+        for transfer in expired:
+            logger.info(
+                f"Oferta de transferencia expirada: {transfer.file_id} con {transfer.user_id} ({transfer.peer_ip})"
+            )
+        return expired
+
+    def active_transfers(self):
+        """Devuelve las transferencias que aún no han llegado a un estado final"""
+        with self._cond:
+            return list(self._transfers.values())
+
+    def take_finished(self):
+        """Devuelve y olvida las transferencias terminadas desde la última llamada
+
+        Permite notificar el final de las que empiezan y terminan entre dos
+        muestreos de active_transfers().
+        """
+        with self._cond:
+            finished = list(self._unreported)
+            self._unreported.clear()
+        return finished
+
+    def list_transfers(self, include_finished=False):
+        """Lista las transferencias registradas como diccionarios"""
+        with self._cond:
+            transfers = [t.to_dict() for t in self._transfers.values()]
+            if include_finished:
+                transfers.extend(t.to_dict() for t in self._finished)
+        return transfers
+
+    def __len__(self):
+        with self._cond:
+            return len(self._transfers)
@@ -0,0 +1,331 @@
+import ipaddress
+import itertools
+import logging
+import os
+import queue
+import socket
+import threading
+
+from protocol import TCP_PORT, UDP_PORT
+
+from .network import get_network_info
+
+logger = logging.getLogger("LCP")
+
+_EPHEMERAL_PORTS = 49152
+
+
+class SocketTransport:
+    """Transporte sobre sockets reales del sistema.
+
+    Peer no crea sockets directamente sino a través de un transporte, que
+    decide en qué dirección y puertos escuchar y cómo llegar a otro peer.
+    Cualquier objeto con la misma interfaz sirve como transporte:
+
+    - host, udp_port, tcp_port: dirección local y puertos LCP (los mismos en
+      todos los peers de la red)
+    - udp_socket(port, broadcast): socket UDP ya enlazado a host:port
+    - tcp_listener(backlog): socket TCP escuchando en host:tcp_port
+    - connect(ip, timeout): conexión TCP con el tcp_port de ip
+    - broadcast_addresses(): destinos a los que enviar los broadcasts
+    """
+
+    def __init__(self, host="0.0.0.0", udp_port=UDP_PORT, tcp_port=TCP_PORT):
+        """
+        Args:
+            host: Dirección local en la que escuchar ('0.0.0.0' para todas)
+            udp_port: Puerto UDP de LCP
+            tcp_port: Puerto TCP de LCP
+        """
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+
+    def udp_socket(self, port=0, broadcast=False):
+        """Socket UDP enlazado a host:port (port=0 para uno efímero)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if broadcast:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind((self.host, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def tcp_listener(self, backlog):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if os.name != "nt":
+                # Permite reiniciar el peer con conexiones aún en TIME_WAIT
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.tcp_port))
+            sock.listen(backlog)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def connect(self, ip, timeout=None):
+        source = None if self.host in ("", "0.0.0.0") else (self.host, 0)
+        sock = socket.create_connection((ip, self.tcp_port), timeout, source)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def broadcast_addresses(self):
+        return get_network_info()
+
+    def __repr__(self):
+        return f"SocketTransport({self.host}, {self.udp_port}, {self.tcp_port})"
+
+
+class LoopbackNetwork:
+    """Red simulada en memoria para ejecutar muchos peers en un mismo proceso.
+
+    Cada transporte creado con transport() recibe una IP virtual propia de la
+    subred, así que todos los peers usan los puertos LCP habituales sin
+    chocar. Los datagramas se entregan copiándolos a la cola del socket de
+    destino (o a todos los enlazados a ese puerto si van a la dirección de
+    broadcast) y se descartan si no hay nadie escuchando, como en UDP. Las
+    conexiones TCP son pares de sockets locales (socket.socketpair), por lo que
+    el código de transferencia funciona sin cambios.
+    """
+
+    def __init__(self, subnet="10.99.0.0/16"):
+        self.subnet = ipaddress.ip_network(subnet)
+        self.broadcast = str(self.subnet.broadcast_address)
+        self._hosts = self.subnet.hosts()
+        self._datagram_sockets = {}
+        self._listeners = {}
+        self._ports = itertools.count(_EPHEMERAL_PORTS)
+        self._lock = threading.Lock()
+        self.datagrams = 0
+        self.dropped = 0
+        self.connections = 0
+
+    def transport(self, ip=None, udp_port=UDP_PORT, tcp_port=TCP_PORT):
+        """Transporte para un nuevo peer (con la siguiente IP libre si ip es None)"""
+        with self._lock:
+            ip = ip or str(next(self._hosts))
+        return LoopbackTransport(self, ip, udp_port, tcp_port)
+
+    def _bind(self, registry, ip, port, endpoint):
+        with self._lock:
+            if port == 0:
+                port = next(self._ports)
+            if (ip, port) in registry:
+                raise OSError(f"Dirección en uso: {ip}:{port}")
+            registry[(ip, port)] = endpoint
+        return port
+
+    def _unbind(self, registry, address, endpoint):
+        with self._lock:
+            if registry.get(address) is endpoint:
+                del registry[address]
+
+    def _route(self, data, source, destination):
+        ip, port = destination
+        data = bytes(data)
+        with self._lock:
+            if ip in (self.broadcast, "255.255.255.255"):
+                targets = [
+                    sock
+                    for (_, bound_port), sock in self._datagram_sockets.items()
+                    if bound_port == port
+                ]
+            else:
+                target = self._datagram_sockets.get((ip, port))
+                targets = [target] if target is not None else []
+            self.datagrams += len(targets)
+            if not targets:
+                self.dropped += 1
+        for sock in targets:
+            sock._deliver(data, source)
+
+    def _connect(self, source_ip, ip, port, timeout):
+        with self._lock:
+            listener = self._listeners.get((ip, port))
+            source_port = next(self._ports)
+        if listener is None:
+            raise ConnectionRefusedError(f"Conexión rechazada por {ip}:{port}")
+        client, server = socket.socketpair()
+        client.settimeout(timeout)
+        try:
+            listener._enqueue(server, (source_ip, source_port))
+        except OSError:
+            client.close()
+            server.close()
+            raise
+        with self._lock:
+            self.connections += 1
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datagram_sockets": len(self._datagram_sockets),
+                "listeners": len(self._listeners),
+                "datagrams": self.datagrams,
+                "dropped": self.dropped,
+                "connections": self.connections,
+            }
+
+
+class LoopbackTransport:
+    """Transporte de un peer sobre una LoopbackNetwork (ver SocketTransport)"""
+
+    def __init__(self, network, ip, udp_port=UDP_PORT, tcp_port=TCP_PORT):
+        self.network = network
+        self.host = ip
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+
+    def udp_socket(self, port=0, broadcast=False):
+        return _LoopbackDatagramSocket(self.network, self.host, port)
+
+    def udp_handler(self, handler, port=None):
+        """Enlaza a port (por defecto udp_port) un manejador de datagramas
+
+        handler(socket, data, source) se ejecuta en el hilo del emisor y puede
+        responder con socket.sendto(). Sirve para simular miles de peers
+        ligeros sin un hilo por peer.
+        """
+        port = self.udp_port if port is None else port
+        return _LoopbackDatagramHandler(self.network, self.host, port, handler)
+
+    def tcp_listener(self, backlog):
+        return _LoopbackListener(self.network, self.host, self.tcp_port, backlog)
+
+    def connect(self, ip, timeout=None):
+        return self.network._connect(self.host, ip, self.tcp_port, timeout)
+
+    def broadcast_addresses(self):
+        return [self.network.broadcast]
+
+    def __repr__(self):
+        return f"LoopbackTransport({self.host}, {self.udp_port}, {self.tcp_port})"
+
+
+class _LoopbackDatagramSocket:
+    """Socket UDP en memoria con la parte de la API de socket que usa Peer"""
+
+    def __init__(self, network, ip, port):
+        self._network = network
+        self._ip = ip
+        self._queue = queue.SimpleQueue()
+        self._timeout = None
+        self._closed = False
+        self._port = network._bind(network._datagram_sockets, ip, port, self)
+
+    def _deliver(self, data, source):
+        if not self._closed:
+            self._queue.put((data, source))
+
+    def sendto(self, data, address):
+        if self._closed:
+            raise OSError("Socket cerrado")
+        self._network._route(data, (self._ip, self._port), address)
+        return len(data)
+
+    def recvfrom(self, bufsize):
+        if self._closed:
+            raise OSError("Socket cerrado")
+        try:
+            item = self._queue.get(timeout=self._timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out") from None
+        if item is None:
+            raise OSError("Socket cerrado")
+        data, source = item
+        # Como en UDP, lo que no cabe en el buffer se pierde
+        return data[:bufsize], source
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def gettimeout(self):
+        return self._timeout
+
+    def setsockopt(self, *args):
+        pass
+
+    def getsockname(self):
+        return (self._ip, self._port)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._network._unbind(
+            self._network._datagram_sockets, (self._ip, self._port), self
+        )
+        # Despierta a quien esté bloqueado en recvfrom()
+        self._queue.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _LoopbackDatagramHandler(_LoopbackDatagramSocket):
+    """Socket UDP en memoria que entrega cada datagrama a un manejador"""
+
+    def __init__(self, network, ip, port, handler):
+        self._handler = handler
+        super().__init__(network, ip, port)
+
+    def _deliver(self, data, source):
+        if self._closed:
+            return
+        try:
+            self._handler(self, data, source)
+        except Exception as e:
+            logger.error(f"Error en manejador UDP de {self._ip}: {e}", exc_info=True)
+
+
+class _LoopbackListener:
+    """Socket TCP en escucha en memoria: accept() devuelve un extremo del par"""
+
+    def __init__(self, network, ip, port, backlog):
+        self._network = network
+        self._address = (ip, port)
+        self._pending = queue.Queue()
+        self._closed = False
+        network._bind(network._listeners, ip, port, self)
+
+    def _enqueue(self, conn, address):
+        if self._closed:
+            raise ConnectionRefusedError("Conexión rechazada")
+        self._pending.put((conn, address))
+
+    def accept(self):
+        if self._closed:
+            raise OSError("Socket cerrado")
+        item = self._pending.get()
+        if item is None:
+            raise OSError("Socket cerrado")
+        return item
+
+    def getsockname(self):
+        return self._address
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._network._unbind(self._network._listeners, self._address, self)
+        while True:
+            try:
+                conn, _ = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        self._pending.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
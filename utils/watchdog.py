@@ -0,0 +1,268 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("LCP")
+
+
+class _Monitor:
+    __slots__ = (
+        "name",
+        "threshold",
+        "interval",
+        "thread_ident",
+        "busy_since",
+        "context",
+        "last_tick",
+        "stalled_since",
+        "stalls",
+        "max_lag",
+    )
+
+    def __init__(self, name, threshold, interval=None):
+        self.name = name
+        self.threshold = threshold
+        # Con interval es un bucle periódico (tick); sin él, un hilo que
+        # alterna entre esperar trabajo (idle) y procesarlo (busy)
+        self.interval = interval
+        self.thread_ident = None
+        self.busy_since = None
+        # (plantilla, argumentos) de la tarea actual, en una sola asignación
+        # para que check() nunca vea la plantilla de una y los de otra
+        self.context = None
+        self.last_tick = None
+        self.stalled_since = None
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def stalled_for(self, now):
+        """Segundos de bloqueo por encima del umbral (None si no está bloqueado)"""
+        if self.interval is not None:
+            if self.last_tick is None:
+                return None
+            elapsed = now - self.last_tick - self.interval
+        else:
+            if self.busy_since is None:
+                return None
+            elapsed = now - self.busy_since
+        return elapsed if elapsed > self.threshold else None
+
+    def describe(self):
+        """Texto del contexto de la tarea actual (None si no hay)"""
+        context = self.context
+        if context is None:
+            return None
+        template, args = context
+        if not template:
+            return None
+        return template % args if args else template
+
+
+class Watchdog:
+    """Detecta hilos bloqueados a partir de latidos.
+
+    Los workers y listeners marcan con busy() que empiezan a procesar algo y
+    con idle() que vuelven a esperar trabajo; si un hilo lleva más de threshold
+    segundos ocupado sin llamar a idle() o heartbeat(), se considera bloqueado.
+    Los bucles periódicos (p. ej. el 'after' de la GUI) llaman a tick() con el
+    intervalo con el que se programaron: el retraso respecto a ese intervalo es
+    su latencia de planificación, y si dejan de llamar se consideran
+    bloqueados.
+
+    Un hilo de comprobación revisa los monitores cada check_interval segundos.
+    Al detectar un bloqueo registra la pila del hilo afectado, incrementa la
+    métrica de bloqueos y llama a on_stall; la recuperación también se
+    registra. El retraso del propio hilo de comprobación al despertar mide la
+    latencia de planificación del proceso.
+    """
+
+    def __init__(self, threshold=30.0, check_interval=1.0, metrics=None, on_stall=None):
+        """
+        Args:
+            threshold: Segundos por defecto a partir de los que un monitor se
+                considera bloqueado
+            check_interval: Segundos entre comprobaciones
+            metrics: MetricsRegistry donde publicar bloqueos y latencias
+            on_stall: Callback (nombre, segundos, pila) al detectar un bloqueo
+        """
+        self.threshold = threshold
+        self.check_interval = check_interval
+        self.on_stall = on_stall
+        self._monitors = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._stall_counter = None
+        self._lag_histogram = None
+        if metrics is not None:
+            self._stall_counter = metrics.counter(
+                "watchdog_stalls_total",
+                "Bloqueos detectados por el watchdog",
+                ("monitor",),
+            )
+            self._lag_histogram = metrics.histogram(
+                "scheduling_lag_seconds",
+                "Retraso de los bucles periódicos respecto a su intervalo",
+                ("monitor",),
+            )
+            metrics.gauge(
+                "watchdog_stalled",
+                "Monitores bloqueados en este momento",
+                fn=lambda: sum(
+                    1 for m in self._monitor_list() if m.stalled_since is not None
+                ),
+            )
+
+    def _monitor(self, name, threshold=None, interval=None):
+        monitor = self._monitors.get(name)
+        if monitor is None:
+            with self._lock:
+                monitor = self._monitors.get(name)
+                if monitor is None:
+                    monitor = self._monitors[name] = _Monitor(
+                        name, threshold or self.threshold, interval
+                    )
+        return monitor
+
+    def _monitor_list(self):
+        with self._lock:
+            return list(self._monitors.values())
+
+    def busy(self, context=None, *args, name=None, threshold=None):
+        """Marca que el hilo actual (o el monitor name) empieza a procesar
+
+        Como en logging, context puede ser una plantilla con % y args sus
+        argumentos: solo se formatea si se informa de un bloqueo o se pide
+        status(), no en cada tarea.
+
+        Args:
+            context: Descripción de la tarea, incluida en el aviso de bloqueo
+            args: Argumentos de la plantilla context
+            name: Nombre del monitor (por defecto, el del hilo actual)
+            threshold: Umbral propio del monitor (solo al crearlo)
+        """
+        monitor = self._monitor(name or threading.current_thread().name, threshold)
+        monitor.thread_ident = threading.get_ident()
+        monitor.context = (context, args)
+        monitor.busy_since = time.monotonic()
+
+    def heartbeat(self, name=None):
+        """Indica que una tarea larga sigue avanzando (reinicia su plazo)"""
+        monitor = self._monitors.get(name or threading.current_thread().name)
+        if monitor is not None and monitor.busy_since is not None:
+            monitor.busy_since = time.monotonic()
+
+    def idle(self, name=None):
+        """Marca que el hilo vuelve (o empieza) a esperar trabajo"""
+        monitor = self._monitor(name or threading.current_thread().name)
+        monitor.thread_ident = threading.get_ident()
+        monitor.busy_since = None
+        monitor.context = None
+
+    def tick(self, name, interval, threshold=None):
+        """Latido de un bucle periódico programado cada interval segundos
+
+        Returns:
+            float: Retraso en segundos respecto al intervalo esperado
+        """
+        now = time.monotonic()
+        monitor = self._monitor(name, threshold, interval)
+        monitor.thread_ident = threading.get_ident()
+        lag = 0.0
+        if monitor.last_tick is not None:
+            lag = max(0.0, now - monitor.last_tick - monitor.interval)
+            monitor.max_lag = max(monitor.max_lag, lag)
+            if self._lag_histogram is not None:
+                self._lag_histogram.labels(name).observe(lag)
+        monitor.interval = interval
+        monitor.last_tick = now
+        return lag
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Watchdog")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            expected = time.monotonic() + self.check_interval
+            if self._stop.wait(self.check_interval):
+                return
+            lag = max(0.0, time.monotonic() - expected)
+            if self._lag_histogram is not None:
+                self._lag_histogram.labels("watchdog").observe(lag)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error en el watchdog: {e}", exc_info=True)
+
+    def check(self):
+        """Revisa todos los monitores; devuelve los que están bloqueados"""
+        now = time.monotonic()
+        stalled = []
+        for monitor in self._monitor_list():
+            elapsed = monitor.stalled_for(now)
+            if elapsed is None:
+                if monitor.stalled_since is not None:
+                    logger.warning(
+                        f"Watchdog: '{monitor.name}' recuperado tras "
+                        f"{now - monitor.stalled_since:.1f} s bloqueado"
+                    )
+                    monitor.stalled_since = None
+                continue
+
+            stalled.append(monitor.name)
+            if monitor.stalled_since is not None:
+                continue
+            # Desde que debió llegar el latido o empezó la tarea bloqueada
+            monitor.stalled_since = now - elapsed
+            monitor.stalls += 1
+            if self._stall_counter is not None:
+                self._stall_counter.labels(monitor.name).inc()
+            stack = self._thread_stack(monitor.thread_ident)
+            description = monitor.describe()
+            context = f" ({description})" if description else ""
+            logger.error(
+                f"Watchdog: '{monitor.name}'{context} lleva {elapsed:.1f} s "
+                f"bloqueado. Pila del hilo:\n{stack}"
+            )
+            if self.on_stall is not None:
+                try:
+                    self.on_stall(monitor.name, elapsed, stack)
+                except Exception as e:
+                    logger.error(f"Error en callback del watchdog: {e}", exc_info=True)
+        return stalled
+
+    @staticmethod
+    def _thread_stack(ident):
+        frame = sys._current_frames().get(ident)
+        if frame is None:
+            return "(hilo no encontrado)"
+        return "".join(traceback.format_stack(frame))
+
+    def status(self):
+        """Estado de cada monitor: ocupado, bloqueado, bloqueos y retraso máximo"""
+        now = time.monotonic()
+        result = {}
+        for monitor in self._monitor_list():
+            busy_for = None
+            if monitor.busy_since is not None:
+                busy_for = now - monitor.busy_since
+            last_tick_age = None
+            if monitor.last_tick is not None:
+                last_tick_age = now - monitor.last_tick
+            result[monitor.name] = {
+                "busy_for": busy_for,
+                "context": monitor.describe(),
+                "last_tick_age": last_tick_age,
+                "stalled": monitor.stalled_since is not None,
+                "stalls": monitor.stalls,
+                "max_lag": monitor.max_lag,
+                "threshold": monitor.threshold,
+            }
+        return result